@@ -1,16 +1,82 @@
-import React, { useState, useEffect } from 'react';
-import { MapContainer, TileLayer, Marker, Popup } from 'react-leaflet';
+import React, { useState, useEffect, useCallback } from 'react';
+import { MapContainer, TileLayer, Marker, Popup, CircleMarker, Tooltip, useMap, useMapEvents } from 'react-leaflet';
 import { Typography } from '@mui/material';
 
-const MapComponent = ({ points, onError }) => {
-  const [mapCenter] = useState([19.0760, 72.8777]); // Mumbai center coordinates
+const API_BASE_URL = 'http://127.0.0.1:8080/api';
+
+const clusterColor = (cluster) => {
+  if (cluster.status_counts.Full * 2 >= cluster.count) return '#d32f2f';
+  if (cluster.average_capacity >= 75) return '#f57c00';
+  return '#2e7d32';
+};
+
+// Refetches the clusters for the visible bounds whenever the map moves
+const ClusterLayer = ({ onError }) => {
+  const map = useMap();
+  const [clusters, setClusters] = useState([]);
+
+  const fetchClusters = useCallback(async () => {
+    const bounds = map.getBounds();
+    const bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()].join(',');
+    try {
+      const response = await fetch(`${API_BASE_URL}/map/clusters?bbox=${bbox}&zoom=${map.getZoom()}`);
+      if (!response.ok) {
+        throw new Error(`Failed to fetch clusters: ${response.status}`);
+      }
+      setClusters(await response.json());
+    } catch (error) {
+      console.error('Error fetching clusters:', error);
+      if (onError) onError(error);
+    }
+  }, [map, onError]);
+
+  useMapEvents({ moveend: fetchClusters });
 
-  // Report any errors to parent
   useEffect(() => {
-    return () => {
-      // Cleanup if needed
-    };
-  }, [onError]);
+    fetchClusters();
+  }, [fetchClusters]);
+
+  return clusters.map((cluster) => (
+    cluster.count === 1 ? (
+      <Marker key={cluster.id} position={[cluster.latitude, cluster.longitude]}>
+        <Popup>
+          <div>
+            <Typography variant="subtitle1" component="div">
+              Collection point #{cluster.point_id}
+            </Typography>
+            <Typography variant="body2" component="div">
+              Status: {Object.keys(cluster.status_counts).find((status) => cluster.status_counts[status]) || 'Unknown'}
+              <br />
+              Capacity: {cluster.average_capacity}%
+            </Typography>
+          </div>
+        </Popup>
+      </Marker>
+    ) : (
+      <CircleMarker
+        key={cluster.id}
+        center={[cluster.latitude, cluster.longitude]}
+        radius={Math.min(40, 12 + Math.log2(cluster.count) * 3)}
+        pathOptions={{ color: clusterColor(cluster), fillOpacity: 0.6 }}
+        eventHandlers={{
+          click: () => map.setView([cluster.latitude, cluster.longitude], map.getZoom() + 2),
+        }}
+      >
+        <Tooltip direction="center" permanent>{cluster.count}</Tooltip>
+        <Popup>
+          <Typography variant="body2" component="div">
+            {cluster.count} points, average capacity {cluster.average_capacity}%
+            <br />
+            Full: {cluster.status_counts.Full}, Maintenance: {cluster.status_counts.Maintenance}
+          </Typography>
+        </Popup>
+      </CircleMarker>
+    )
+  ));
+};
+
+const MapComponent = ({ onError }) => {
+  const [mapCenter] = useState([19.0760, 72.8777]); // Mumbai center coordinates
 
   try {
     return (
@@ -29,31 +95,7 @@ const MapComponent = ({ points, onError }) => {
           url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
           attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
         />
-        {points.map((point) => (
-          <Marker
-            key={point.id}
-            position={point.position || [
-              19.0760 + (Math.random() - 0.5) * 0.1,
-              72.8777 + (Math.random() - 0.5) * 0.1
-            ]}
-          >
-            <Popup>
-              <div>
-                <Typography variant="subtitle1" component="div">
-                  {point.name}
-                </Typography>
-                <Typography variant="body2" component="div">
-                  {point.address}
-                </Typography>
-                <Typography variant="body2" component="div">
-                  Status: {point.status}
-                  <br />
-                  Capacity: {point.capacity}%
-                </Typography>
-              </div>
-            </Popup>
-          </Marker>
-        ))}
+        <ClusterLayer onError={onError} />
       </MapContainer>
     );
   } catch (error) {
@@ -63,4 +105,4 @@ const MapComponent = ({ points, onError }) => {
   }
 };
 
-export default MapComponent; 
\ No newline at end of file
+export default MapComponent;
@@ -50,6 +50,7 @@ import NewCollectionForm from '../components/forms/NewCollectionForm';
 import EditCollectionForm from '../components/forms/EditCollectionForm';
 
 const API_BASE_URL = 'http://127.0.0.1:8080/api';
+const COLLECTIONS_PAGE_SIZE = 200;
 
 const Collection = () => {
   const theme = useTheme();
@@ -60,6 +61,7 @@ const Collection = () => {
   const [openEditCollection, setOpenEditCollection] = useState(false);
   const [openDeleteDialog, setOpenDeleteDialog] = useState(false);
   const [collections, setCollections] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [filteredCollections, setFilteredCollections] = useState([]);
   const [searchQuery, setSearchQuery] = useState('');
   const [page, setPage] = useState(1);
@@ -76,6 +78,29 @@ const Collection = () => {
     fetchCollections();
   }, []);
 
+  // Apply server-pushed changes instead of re-fetching the whole list
+  useEffect(() => {
+    const events = new EventSource(`${API_BASE_URL}/events?topics=collections`);
+    events.addEventListener('collections', (message) => {
+      const { action, data } = JSON.parse(message.data);
+      if (action === 'created') {
+        setCollections(prev => (prev.some(c => c.id === data.id) ? prev : [data, ...prev]));
+      } else if (action === 'updated') {
+        setCollections(prev => prev.map(c => (c.id === data.id ? { ...c, ...data } : c)));
+      } else if (action === 'deleted') {
+        setCollections(prev => prev.filter(c => c.id !== data.id));
+      } else if (action === 'bulk_updated') {
+        // Status transitions and dispatches send one partial row per collection
+        const changes = new Map(data.map(change => [change.id, change]));
+        setCollections(prev => prev.map(c => (changes.has(c.id) ? { ...c, ...changes.get(c.id) } : c)));
+      } else if (action === 'bulk_created' || action === 'archived') {
+        fetchCollections();
+      }
+    });
+    events.addEventListener('reset', () => fetchCollections());
+    return () => events.close();
+  }, []);
+
   useEffect(() => {
     filterCollections();
   }, [searchQuery, collections]);
@@ -105,10 +130,15 @@ const Collection = () => {
     setPage(1); // Reset to first page when searching
   };
 
-  const fetchCollections = async () => {
+  const fetchCollections = async (cursor = null) => {
     console.log('Fetching collections from API...');
     try {
-      const response = await fetch(`${API_BASE_URL}/collections`, {
+      // The API returns one page at a time; X-Next-Cursor points at the next one
+      const params = new URLSearchParams({ limit: COLLECTIONS_PAGE_SIZE, order: 'desc' });
+      if (cursor) {
+        params.set('cursor', cursor);
+      }
+      const response = await fetch(`${API_BASE_URL}/collections?${params}`, {
         headers: {
           'Accept': 'application/json',
           'Content-Type': 'application/json'
@@ -127,7 +157,8 @@ const Collection = () => {
         throw new Error('Invalid data format received');
       }
       
-      setCollections(data);
+      setCollections(prevCollections => (cursor ? [...prevCollections, ...data] : data));
+      setNextCursor(response.headers.get('X-Next-Cursor'));
     } catch (error) {
       console.error('Error fetching collections:', error);
       setError(error.message);
@@ -397,6 +428,9 @@ const Collection = () => {
 
   const handlePageChange = (event, value) => {
     setPage(value);
+    if (nextCursor && value * pageSize >= collections.length) {
+      fetchCollections(nextCursor);
+    }
   };
 
   const handlePageSizeChange = (event) => {
@@ -410,7 +444,7 @@ const Collection = () => {
     return filteredCollections.slice(startIndex, endIndex);
   };
 
-  const totalPages = Math.ceil(filteredCollections.length / pageSize);
+  const totalPages = Math.ceil(filteredCollections.length / pageSize) + (nextCursor ? 1 : 0);
 
   return (
     <Box>
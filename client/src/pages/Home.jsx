@@ -50,7 +50,6 @@ const Home = () => {
   const isMobile = useMediaQuery(theme.breakpoints.down('sm'));
   const { translate, currentLanguage, changeLanguage } = useLanguage();
   const [collections, setCollections] = useState([]);
-  const [points, setPoints] = useState([]);
   const [recentActivities, setRecentActivities] = useState([]);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState(null);
@@ -167,32 +166,6 @@ const Home = () => {
     fetchHomeData();
   }, []);
 
-  const fetchPoints = async () => {
-    try {
-      console.log('Fetching collection points...');
-      const response = await fetch(`${API_BASE_URL}/collection-points`, {
-        headers: {
-          'Accept': 'application/json',
-          'Content-Type': 'application/json'
-        }
-      });
-      if (!response.ok) {
-        throw new Error(`HTTP error! Status: ${response.status}`);
-      }
-      const data = await response.json();
-      console.log('Collection points data:', data);
-      
-      if (!Array.isArray(data)) {
-        throw new Error('Invalid data format received');
-      }
-
-      setPoints(data);
-    } catch (error) {
-      console.error('Error in fetchPoints:', error);
-      throw error;
-    }
-  };
-
   const getTotalWasteCollected = () => {
     if (!collections.length) return 0;
     
@@ -217,14 +190,6 @@ const Home = () => {
     return totalWaste > 0 ? Math.round((recyclableWaste / totalWaste) * 100) : 0;
   };
 
-  const getActiveCollectionPoints = () => {
-    return points.filter(p => p.status !== 'Inactive').length || 0;
-  };
-
-  const getFullBinCount = () => {
-    return points.filter(p => p.status === 'Full').length || 0;
-  };
-
   const formatDate = (dateString) => {
     if (!dateString) return 'N/A';
     const date = new Date(dateString);
@@ -308,7 +273,7 @@ const Home = () => {
     {
       id: 'collectionPoints',
       title: 'stats.collectionPoints',
-      value: getActiveCollectionPoints(),
+      value: activeCollectionPoints,
       unit: '',
       icon: <LocationIcon />,
       color: '#ff9800',
@@ -318,7 +283,7 @@ const Home = () => {
     {
       id: 'binsAtCapacity',
       title: 'stats.binsAtCapacity',
-      value: getFullBinCount(),
+      value: binsAtCapacity,
       unit: '',
       icon: <WarningIcon />,
       color: '#f44336',
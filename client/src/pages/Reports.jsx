@@ -61,62 +61,64 @@ ChartJS.register(
 
 const API_BASE_URL = 'http://localhost:8080';
 
+const TIME_RANGE_DAYS = {
+  week: 7,
+  month: 30,
+  year: 365,
+};
+
+const formatLocalDate = (date) => {
+  const pad = (value) => String(value).padStart(2, '0');
+  return `${date.getFullYear()}-${pad(date.getMonth() + 1)}-${pad(date.getDate())}`;
+};
+
 const Reports = () => {
   const theme = useTheme();
   const isMobile = useMediaQuery(theme.breakpoints.down('sm'));
-  const [collections, setCollections] = useState([]);
+  const [trendRows, setTrendRows] = useState([]);
   const [loading, setLoading] = useState(true);
   const [timeRange, setTimeRange] = useState('week');
 
   useEffect(() => {
-    fetchCollections();
+    fetchTrends();
   }, [timeRange]);
 
-  const fetchCollections = async () => {
+  // Aggregation happens server-side: one row per day, waste type and status
+  const fetchTrends = async () => {
     try {
-      console.log('Fetching collections from API...');
-      const response = await fetch(`${API_BASE_URL}/api/collections`);
+      const days = TIME_RANGE_DAYS[timeRange];
+      const start = new Date();
+      start.setHours(0, 0, 0, 0);
+      start.setDate(start.getDate() - days);
+      const params = new URLSearchParams({
+        bucket: 'day',
+        group_by: 'waste_type,status',
+        start: formatLocalDate(start),
+      });
+      const response = await fetch(`${API_BASE_URL}/api/analytics/trends?${params}`);
       if (!response.ok) {
-        throw new Error('Failed to fetch collections');
+        throw new Error('Failed to fetch collection trends');
       }
       const data = await response.json();
-      console.log('Received collections data:', data);
-      setCollections(data);
+      setTrendRows(data.rows);
     } catch (error) {
-      console.error('Error fetching collections:', error);
+      console.error('Error fetching collection trends:', error);
     } finally {
       setLoading(false);
     }
   };
 
-  const getFilteredCollections = () => {
-    const now = new Date();
-    return collections.filter(collection => {
-      const collectionDate = new Date(collection.date_time);
-      const daysDiff = (now - collectionDate) / (1000 * 60 * 60 * 24);
-      
-      switch (timeRange) {
-        case 'week':
-          return daysDiff <= 7;
-        case 'month':
-          return daysDiff <= 30;
-        case 'year':
-          return daysDiff <= 365;
-        default:
-          return true;
-      }
-    });
-  };
+  const sumBy = (key, value) => trendRows.reduce((acc, row) => {
+    acc[row[key]] = (acc[row[key]] || 0) + row[value];
+    return acc;
+  }, {});
+
+  const formatBucket = (bucket, options) =>
+    new Date(`${bucket}T00:00:00`).toLocaleDateString('en-US', options);
 
   // Process data for charts
   const getWasteTypeDistribution = () => {
-    console.log('Processing waste type distribution...');
-    const filteredCollections = getFilteredCollections();
-    const distribution = filteredCollections.reduce((acc, collection) => {
-      acc[collection.waste_type] = (acc[collection.waste_type] || 0) + 1;
-      return acc;
-    }, {});
-    console.log('Waste type distribution:', distribution);
+    const distribution = sumBy('waste_type', 'collections');
 
     return {
       labels: Object.keys(distribution),
@@ -134,13 +136,7 @@ const Reports = () => {
   };
 
   const getCollectionsByStatus = () => {
-    console.log('Processing collections by status...');
-    const filteredCollections = getFilteredCollections();
-    const statusCounts = filteredCollections.reduce((acc, collection) => {
-      acc[collection.status] = (acc[collection.status] || 0) + 1;
-      return acc;
-    }, {});
-    console.log('Status counts:', statusCounts);
+    const statusCounts = sumBy('status', 'collections');
 
     return {
       labels: Object.keys(statusCounts),
@@ -153,33 +149,18 @@ const Reports = () => {
   };
 
   const getCollectionsOverTime = () => {
-    console.log('Processing collections over time...');
-    const filteredCollections = getFilteredCollections();
-    
-    // Sort collections by date
-    const sortedCollections = [...filteredCollections].sort((a, b) => 
-      new Date(a.date_time) - new Date(b.date_time)
-    );
-    console.log('Sorted collections:', sortedCollections);
+    const groupedData = sumBy('bucket', 'collections');
+    const buckets = Object.keys(groupedData).sort();
 
-    // Group by date with better formatting
-    const groupedData = sortedCollections.reduce((acc, collection) => {
-      const date = new Date(collection.date_time);
-      const formattedDate = date.toLocaleDateString('en-US', {
+    return {
+      labels: buckets.map(bucket => formatBucket(bucket, {
         month: 'short',
         day: 'numeric',
         year: 'numeric'
-      });
-      acc[formattedDate] = (acc[formattedDate] || 0) + 1;
-      return acc;
-    }, {});
-    console.log('Grouped data:', groupedData);
-
-    return {
-      labels: Object.keys(groupedData),
+      })),
       datasets: [{
         label: 'Collections Over Time',
-        data: Object.values(groupedData),
+        data: buckets.map(bucket => groupedData[bucket]),
         borderColor: '#FF6384',
         tension: 0.1,
         fill: false
@@ -188,24 +169,12 @@ const Reports = () => {
   };
 
   const getWasteCollectionData = () => {
-    console.log('Processing waste collection data...');
-    const filteredCollections = getFilteredCollections();
-    
-    // Calculate total waste collected
-    const totalWaste = filteredCollections.reduce((sum, collection) => 
-      sum + (collection.waste_collected || 0), 0
-    );
-
-    // Group by waste type
-    const wasteByType = filteredCollections.reduce((acc, collection) => {
-      acc[collection.waste_type] = (acc[collection.waste_type] || 0) + (collection.waste_collected || 0);
-      return acc;
-    }, {});
+    const wasteByType = sumBy('waste_type', 'waste_collected');
+    const wasteByBucket = sumBy('bucket', 'waste_collected');
+    const totalWaste = Object.values(wasteByType).reduce((sum, value) => sum + value, 0);
 
-    // Group by date for trend
-    const wasteByDate = filteredCollections.reduce((acc, collection) => {
-      const date = new Date(collection.date_time).toLocaleDateString();
-      acc[date] = (acc[date] || 0) + (collection.waste_collected || 0);
+    const wasteByDate = Object.keys(wasteByBucket).sort().reduce((acc, bucket) => {
+      acc[formatBucket(bucket)] = wasteByBucket[bucket];
       return acc;
     }, {});
 
@@ -11,10 +11,12 @@ load_dotenv()
 app = Flask(__name__)
 CORS(app)
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///waste_management.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Database configuration (FLASK_CONFIG selects a class from config/config.py)
+from config.config import config, apply_sqlite_pragmas
+app.config.from_object(config[os.getenv('FLASK_CONFIG', 'default')])
 db = SQLAlchemy(app)
+with app.app_context():
+    apply_sqlite_pragmas(db.engine)
 
 # Import routes after db initialization to avoid circular imports
 from routes import waste_collection, users, analytics
@@ -30,4 +32,4 @@ def health_check():
     return {"status": "healthy", "service": "waste-management-api"}
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    app.run(debug=app.config.get('DEBUG', False))
@@ -0,0 +1,15 @@
+# Production entry point.
+#
+#   FLASK_CONFIG=production python wsgi.py          gevent server on $PORT
+#   FLASK_CONFIG=production gunicorn -k gevent -w 4 wsgi:app
+from gevent import monkey
+monkey.patch_all()
+
+import os
+from gevent.pywsgi import WSGIServer
+from server import app
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5000))
+    print(f"Serving on 0.0.0.0:{port}")
+    WSGIServer(('0.0.0.0', port), app).serve_forever()
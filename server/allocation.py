@@ -0,0 +1,313 @@
+import hashlib
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+import numpy as np
+from sqlalchemy import delete, func, insert, select
+from models import (
+    db, AllocationDay, CenterAllocation, Collection, CollectionArchiveSummary, CollectionPoint,
+    RecyclingCenter, RecyclingCenterMaterial
+)
+from materials import active_center_filter, accepting_centers
+from spatial import EARTH_RADIUS_KM, cell_center
+
+# Allocation of each day's completed collection tonnage to recycling centers.
+# Supply is grouped by the grid cell of the collection point and the waste
+# type; each center takes the waste types of the materials it accepts, up to
+# throughput_kg_per_day shared across types. The plan minimizes kg·km of haul
+# distance from the cell center and is solved as a transportation problem by
+# successive shortest paths: every step sends as much as fits along the
+# cheapest path from a source with supply left to a center with room left,
+# re-routing earlier flows through reverse arcs when that is cheaper. What no
+# center can take goes to the UNALLOCATED center at UNALLOCATED_KM per kg.
+#
+# The flows are stored per day. When more collections close on a day and the
+# active centers are unchanged, the stored plan stays optimal for the supply
+# it covers, so only the new tonnage is routed instead of re-solving the day.
+
+UNALLOCATED = 0
+UNALLOCATED_KM = 10000.0
+EPSILON_KG = 1e-6
+DEFAULT_MIN_ROOM_KG = 0.0
+
+_solve_lock = threading.Lock()
+
+
+def _distances_km(latitudes, longitudes, center_latitudes, center_longitudes):
+    lat1 = np.radians(latitudes)[:, None]
+    lat2 = np.radians(center_latitudes)[None, :]
+    dlat = lat2 - lat1
+    dlon = np.radians(center_longitudes)[None, :] - np.radians(longitudes)[:, None]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+# Active located centers with throughput and at least one waste type, and a
+# signature of the fields the plan depends on
+def load_centers():
+    rows = db.session.query(
+        RecyclingCenter.id, RecyclingCenter.name, RecyclingCenter.latitude, RecyclingCenter.longitude,
+        RecyclingCenter.throughput_kg_per_day
+    ).filter(
+        active_center_filter(), RecyclingCenter.latitude.isnot(None), RecyclingCenter.longitude.isnot(None),
+        RecyclingCenter.throughput_kg_per_day > 0
+    ).order_by(RecyclingCenter.id).all()
+    accepted = defaultdict(set)
+    for center_id, waste_type in db.session.query(
+        RecyclingCenterMaterial.center_id, RecyclingCenterMaterial.waste_type
+    ).filter(RecyclingCenterMaterial.waste_type.isnot(None)):
+        accepted[center_id].add(waste_type)
+    centers = [
+        {'id': id, 'name': name, 'latitude': latitude, 'longitude': longitude,
+         'throughput_kg_per_day': throughput, 'waste_types': sorted(accepted[id])}
+        for id, name, latitude, longitude, throughput in rows if accepted[id]
+    ]
+    signature = repr([(c['id'], c['latitude'], c['longitude'], c['throughput_kg_per_day'], c['waste_types'])
+                      for c in centers])
+    return centers, hashlib.sha256(signature.encode()).hexdigest()
+
+
+def _day_bounds(day):
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
+
+# {(grid_cell, waste_type): kg} completed on the day, from live collections
+# and the archive summary, and the kg at addresses with no collection point
+def load_supply(day):
+    start, end = _day_bounds(day)
+    supply = defaultdict(float)
+    unlocated = 0.0
+
+    waste_type = func.lower(Collection.waste_type)
+    hot = db.session.query(
+        CollectionPoint.grid_cell, waste_type, func.sum(Collection.waste_collected)
+    ).outerjoin(CollectionPoint, CollectionPoint.address == Collection.location).filter(
+        Collection.status == 'completed', Collection.date_time >= start, Collection.date_time < end,
+        Collection.waste_collected > 0
+    ).group_by(CollectionPoint.grid_cell, waste_type)
+
+    waste_type = func.lower(CollectionArchiveSummary.waste_type)
+    archived = db.session.query(
+        CollectionPoint.grid_cell, waste_type, func.sum(CollectionArchiveSummary.waste_collected)
+    ).outerjoin(CollectionPoint, CollectionPoint.address == CollectionArchiveSummary.location).filter(
+        CollectionArchiveSummary.day == day, CollectionArchiveSummary.waste_collected > 0
+    ).group_by(CollectionPoint.grid_cell, waste_type)
+
+    for cell, waste_type, kg in list(hot) + list(archived):
+        if cell is None:
+            unlocated += kg
+        else:
+            supply[(cell, waste_type)] += kg
+    return dict(supply), unlocated
+
+
+class TransportationProblem:
+    # sources: [(grid_cell, waste_type)]; the last column is UNALLOCATED
+    def __init__(self, sources, centers):
+        self.sources = sources
+        self.centers = centers
+        coordinates = np.array([cell_center(cell) for cell, _ in sources], dtype=float).reshape(-1, 2)
+        distance = np.full((len(sources), len(centers) + 1), UNALLOCATED_KM)
+        if centers:
+            distance[:, :-1] = _distances_km(
+                coordinates[:, 0], coordinates[:, 1],
+                np.array([c['latitude'] for c in centers]), np.array([c['longitude'] for c in centers])
+            )
+            accepts = np.array([[waste_type in c['waste_types'] for c in centers] for _, waste_type in sources],
+                               dtype=bool).reshape(len(sources), len(centers))
+            distance[:, :-1][~accepts] = np.inf
+        self.distance = distance
+        self.column = {c['id']: index for index, c in enumerate(centers)}
+        self.column[UNALLOCATED] = len(centers)
+        self.room = np.array([c['throughput_kg_per_day'] for c in centers] + [np.inf], dtype=float)
+        self.flow = np.zeros_like(distance)
+        self.supply = np.zeros(len(sources))
+
+    def place(self, source, center_id, kg):
+        column = self.column[center_id]
+        self.flow[source, column] += kg
+        self.room[column] -= kg
+
+    # Bellman-Ford over the residual graph from every source with supply left:
+    # forward arcs source -> center at +distance, reverse arcs center -> source
+    # at -distance where flow is placed. Labels only move on a strict
+    # improvement so equal-cost ties cannot turn the predecessors into a cycle.
+    def _shortest_paths(self):
+        rows = np.arange(len(self.sources))
+        columns = np.arange(self.distance.shape[1])
+        source_cost = np.where(self.supply > EPSILON_KG, 0.0, np.inf)
+        source_pred = np.full(len(self.sources), -1)
+        center_cost = np.full(len(columns), np.inf)
+        center_pred = np.full(len(columns), -1)
+        placed = self.flow > EPSILON_KG
+        with np.errstate(invalid='ignore'):
+            for _ in range(len(self.sources) + len(columns) + 1):
+                totals = source_cost[:, None] + self.distance
+                best = totals.argmin(axis=0)
+                candidate = totals[best, columns]
+                centers_improved = candidate < center_cost - 1e-9
+                center_cost = np.where(centers_improved, candidate, center_cost)
+                center_pred = np.where(centers_improved, best, center_pred)
+
+                back = np.where(placed, center_cost[None, :] - self.distance, np.inf)
+                via = back.argmin(axis=1)
+                candidate = back[rows, via]
+                sources_improved = candidate < source_cost - 1e-9
+                if not sources_improved.any():
+                    break
+                source_cost = np.where(sources_improved, candidate, source_cost)
+                source_pred = np.where(sources_improved, via, source_pred)
+            else:
+                raise RuntimeError('Allocation residual graph has a negative cycle')
+        return center_cost, center_pred, source_pred
+
+    def _augment(self):
+        center_cost, center_pred, source_pred = self._shortest_paths()
+        target = int(np.argmin(np.where(self.room > EPSILON_KG, center_cost, np.inf)))
+        forward, backward = [], []
+        column = target
+        source = int(center_pred[column])
+        forward.append((source, column))
+        while source_pred[source] != -1:
+            column = int(source_pred[source])
+            backward.append((source, column))
+            source = int(center_pred[column])
+            forward.append((source, column))
+        kg = min([self.supply[source], self.room[target]] + [self.flow[arc] for arc in backward])
+        for arc in forward:
+            self.flow[arc] += kg
+        for arc in backward:
+            self.flow[arc] -= kg
+        self.supply[source] -= kg
+        self.room[target] -= kg
+
+    def solve(self):
+        steps = 0
+        while (self.supply > EPSILON_KG).any():
+            self._augment()
+            steps += 1
+        return steps
+
+    def allocations(self):
+        center_ids = [c['id'] for c in self.centers] + [UNALLOCATED]
+        for source, column in zip(*np.nonzero(self.flow > EPSILON_KG)):
+            cell, waste_type = self.sources[source]
+            distance = self.distance[source, column]
+            yield {
+                'grid_cell': cell, 'waste_type': waste_type, 'center_id': center_ids[column],
+                'kg': float(self.flow[source, column]),
+                'distance_km': 0.0 if center_ids[column] == UNALLOCATED else float(distance),
+            }
+
+
+def _stored(day):
+    return db.session.query(CenterAllocation).filter(CenterAllocation.day == day).all()
+
+
+# Solves the day, routing only new tonnage onto the stored plan when it is
+# still valid. Returns the plan.
+def allocate_day(day, full=False):
+    with _solve_lock:
+        started = time.perf_counter()
+        centers, centers_key = load_centers()
+        supply, unlocated = load_supply(day)
+        state = db.session.get(AllocationDay, day)
+        stored = _stored(day)
+        placed = defaultdict(float)
+        for row in stored:
+            placed[(row.grid_cell, row.waste_type)] += row.kg
+
+        incremental = (
+            not full and state is not None and state.centers_key == centers_key
+            and all(supply.get(source, 0.0) >= kg - EPSILON_KG for source, kg in placed.items())
+        )
+        if incremental and all(kg - placed.get(source, 0.0) <= EPSILON_KG for source, kg in supply.items()):
+            return plan(day, centers, stored, unlocated, steps=0, incremental=True, started=started)
+
+        sources = sorted(set(supply) | (set(placed) if incremental else set()))
+        problem = TransportationProblem(sources, centers)
+        index = {source: i for i, source in enumerate(sources)}
+        for source, kg in supply.items():
+            problem.supply[index[source]] = kg - (placed.get(source, 0.0) if incremental else 0.0)
+        if incremental:
+            for row in stored:
+                problem.place(index[(row.grid_cell, row.waste_type)], row.center_id, row.kg)
+        np.maximum(problem.supply, 0.0, out=problem.supply)
+        steps = problem.solve()
+
+        rows = [{'day': day, **allocation} for allocation in problem.allocations()]
+        table = CenterAllocation.__table__
+        db.session.execute(delete(table).where(table.c.day == day))
+        if rows:
+            db.session.execute(insert(table), rows)
+        if state is None:
+            state = AllocationDay(day=day)
+            db.session.add(state)
+        state.centers_key = centers_key
+        state.solved_at = datetime.utcnow()
+        db.session.commit()
+        return plan(day, centers, _stored(day), unlocated, steps, incremental, started)
+
+
+def plan(day, centers, allocations, unlocated, steps, incremental, started):
+    by_center = {c['id']: {**c, 'allocated_kg': 0.0, 'by_waste_type': defaultdict(float)} for c in centers}
+    flows = []
+    allocated = unallocated = tonne_km = 0.0
+    for row in allocations:
+        latitude, longitude = cell_center(row.grid_cell)
+        flows.append({
+            'grid_cell': row.grid_cell, 'latitude': round(latitude, 5), 'longitude': round(longitude, 5),
+            'waste_type': row.waste_type, 'center_id': row.center_id or None,
+            'kg': round(row.kg, 3), 'distance_km': round(row.distance_km, 3),
+        })
+        if row.center_id == UNALLOCATED:
+            unallocated += row.kg
+            continue
+        allocated += row.kg
+        tonne_km += row.kg * row.distance_km / 1000
+        center = by_center.get(row.center_id)
+        if center:
+            center['allocated_kg'] += row.kg
+            center['by_waste_type'][row.waste_type] += row.kg
+    summaries = []
+    for center in by_center.values():
+        summaries.append({
+            'id': center['id'], 'name': center['name'],
+            'throughput_kg_per_day': center['throughput_kg_per_day'],
+            'allocated_kg': round(center['allocated_kg'], 3),
+            'utilisation': round(center['allocated_kg'] / center['throughput_kg_per_day'], 4),
+            'by_waste_type': {key: round(kg, 3) for key, kg in sorted(center['by_waste_type'].items())},
+        })
+    return {
+        'date': day.isoformat(),
+        'allocated_kg': round(allocated, 3),
+        'unallocated_kg': round(unallocated, 3),
+        'unlocated_kg': round(unlocated, 3),
+        'tonne_km': round(tonne_km, 3),
+        'centers': summaries,
+        'flows': flows,
+        'incremental': incremental,
+        'steps': steps,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+# Active centers accepting the material or waste type with at least
+# min_room_kg of throughput not yet allocated on the day
+def centers_with_room(material=None, waste_type=None, day=None, min_room_kg=DEFAULT_MIN_ROOM_KG):
+    day = day or date.today()
+    allocated = select(
+        CenterAllocation.center_id, func.sum(CenterAllocation.kg).label('kg')
+    ).where(CenterAllocation.day == day).group_by(CenterAllocation.center_id).subquery()
+    room = RecyclingCenter.throughput_kg_per_day - func.coalesce(allocated.c.kg, 0.0)
+    query = db.session.query(RecyclingCenter, room).outerjoin(
+        allocated, allocated.c.center_id == RecyclingCenter.id
+    ).filter(active_center_filter(), room >= min_room_kg)
+    if material or waste_type:
+        query = query.filter(RecyclingCenter.id.in_(accepting_centers(material, waste_type)))
+    return [
+        {**center.to_dict(), 'room_kg': round(room_kg, 3)}
+        for center, room_kg in query.order_by(room.desc(), RecyclingCenter.id)
+    ]
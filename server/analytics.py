@@ -0,0 +1,281 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, literal, select
+from models import db, Collection, CollectionPoint, CollectionArchiveSummary
+from archive import archived_through
+from single_flight import SingleFlight
+
+# Time-bucketed GROUP BY aggregations over collections. Buckets that ended
+# before the current one are cached per (bucket, grouping); only the open
+# bucket, future buckets and partially covered edge buckets hit the database.
+# Collection writes invalidate the buckets containing the affected dates.
+# That only reaches the cache of the process that handled the write, so
+# cached buckets also expire after CACHE_TTL_SECONDS; with several workers a
+# past edit shows up everywhere within that time.
+
+BUCKETS = ['day', 'week', 'month']
+GROUP_FIELDS = ['waste_type', 'assigned_team', 'area', 'status']
+DEFAULT_BUCKET_COUNT = 30
+
+MAX_CACHED_BUCKETS = 5000
+CACHE_TTL_SECONDS = 60
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Bumped on invalidation so a query racing with a write is not cached
+_generation = 0
+# Dashboards polling the same range at once share one query
+_flights = SingleFlight()
+
+
+def bucket_start(value, bucket):
+    day = datetime(value.year, value.month, value.day)
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    if bucket == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(start, bucket):
+    if bucket == 'week':
+        return start + timedelta(days=7)
+    if bucket == 'month':
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start + timedelta(days=1)
+
+
+def bucket_key(start):
+    return start.strftime('%Y-%m-%d')
+
+
+def _bucket_expression(bucket, column=Collection.date_time):
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(func.date_trunc(bucket, column), 'YYYY-MM-DD')
+    if bucket == 'week':
+        # Monday on or before the date
+        return func.date(column, '-6 days', 'weekday 1')
+    if bucket == 'month':
+        return func.strftime('%Y-%m-01', column)
+    return func.date(column)
+
+
+# Ward of a collection, taken from the point at its location
+def area_expression(model=Collection):
+    area = select(CollectionPoint.area).where(
+        CollectionPoint.address == model.location
+    ).limit(1).scalar_subquery()
+    return func.coalesce(area, 'Unknown')
+
+
+def _group_expression(field, model=Collection):
+    if field == 'area':
+        return area_expression(model)
+    if field == 'status' and model is CollectionArchiveSummary:
+        return literal('completed')
+    return getattr(model, field)
+
+
+def _query_rows(bucket, group_by, start, end):
+    bucket_column = _bucket_expression(bucket).label('bucket')
+    group_columns = [_group_expression(field).label(field) for field in group_by]
+    query = db.session.query(
+        bucket_column,
+        *group_columns,
+        func.count(Collection.id).label('collections'),
+        func.sum(case((Collection.status == 'completed', 1), else_=0)).label('completed'),
+        func.coalesce(func.sum(case(
+            (Collection.status == 'completed', Collection.waste_collected), else_=0.0
+        )), 0.0).label('waste_collected')
+    )
+    if start is not None:
+        query = query.filter(Collection.date_time >= start)
+    if end is not None:
+        query = query.filter(Collection.date_time < end)
+    query = query.group_by(bucket_column, *group_columns)
+
+    rows = [{
+        'bucket': row.bucket,
+        **{field: getattr(row, field) for field in group_by},
+        'collections': row.collections,
+        'completed': int(row.completed or 0),
+        'waste_collected': float(row.waste_collected or 0.0)
+    } for row in query.all()]
+
+    through = archived_through()
+    if through is not None and (start is None or start <= through):
+        rows = _merge_rows(rows + _archived_rows(bucket, group_by, start, end), group_by)
+    return rows
+
+
+# _query_rows shared with concurrent identical calls; each caller gets its
+# own row dicts
+def _shared_rows(bucket, group_by, start, end):
+    key = (bucket, tuple(group_by), start, end, _generation)
+    rows, _ = _flights.do(key, lambda: _query_rows(bucket, group_by, start, end))
+    return [dict(row) for row in rows]
+
+
+# Same rows for archived collections, from the per-day archive summary
+def _archived_rows(bucket, group_by, start, end):
+    summary = CollectionArchiveSummary
+    bucket_column = _bucket_expression(bucket, summary.day).label('bucket')
+    group_columns = [_group_expression(field, summary).label(field) for field in group_by]
+    query = db.session.query(
+        bucket_column,
+        *group_columns,
+        func.sum(summary.count).label('collections'),
+        func.sum(summary.waste_collected).label('waste_collected')
+    )
+    # Archived rows are summarized per day, so range edges are whole days
+    if start is not None:
+        query = query.filter(summary.day >= start.date())
+    if end is not None:
+        query = query.filter(summary.day < end.date())
+    query = query.group_by(bucket_column, *group_columns)
+
+    return [{
+        'bucket': row.bucket,
+        **{field: getattr(row, field) for field in group_by},
+        'collections': int(row.collections or 0),
+        'completed': int(row.collections or 0),
+        'waste_collected': float(row.waste_collected or 0.0)
+    } for row in query.all()]
+
+
+def _merge_rows(rows, group_by):
+    merged = {}
+    for row in rows:
+        key = (row['bucket'], *[row[field] for field in group_by])
+        if key not in merged:
+            merged[key] = dict(row)
+            continue
+        total = merged[key]
+        total['collections'] += row['collections']
+        total['completed'] += row['completed']
+        total['waste_collected'] += row['waste_collected']
+    return list(merged.values())
+
+
+def _cached_rows(bucket, group_by, start, end):
+    keys = []
+    current = start
+    while current < end:
+        keys.append(bucket_key(current))
+        current = next_bucket(current, bucket)
+
+    grouping = tuple(group_by)
+    cached = {}
+    now = time.monotonic()
+    with _cache_lock:
+        for key in keys:
+            entry = _cache.get((bucket, key))
+            if entry is not None and grouping in entry:
+                stored_at, rows = entry[grouping]
+                if now - stored_at < CACHE_TTL_SECONDS:
+                    cached[key] = rows
+                    _cache.move_to_end((bucket, key))
+
+    missing = [key for key in keys if key not in cached]
+    if missing:
+        generation = _generation
+        missing_start = datetime.fromisoformat(missing[0])
+        missing_end = next_bucket(datetime.fromisoformat(missing[-1]), bucket)
+        fetched = {key: [] for key in missing}
+        for row in _shared_rows(bucket, group_by, missing_start, missing_end):
+            if row['bucket'] in fetched:
+                fetched[row['bucket']].append(row)
+        with _cache_lock:
+            for key, rows in fetched.items():
+                if generation != _generation:
+                    break
+                _cache.setdefault((bucket, key), {})[grouping] = (now, rows)
+                _cache.move_to_end((bucket, key))
+            while len(_cache) > MAX_CACHED_BUCKETS:
+                _cache.popitem(last=False)
+        cached.update(fetched)
+
+    return [row for key in keys for row in cached[key]]
+
+
+# Returns one row per (bucket, group values) between start (inclusive) and
+# end (exclusive); end=None leaves the range open towards the future
+def aggregate(bucket='day', group_by=(), start=None, end=None, now=None):
+    if bucket not in BUCKETS:
+        raise ValueError(f"Invalid bucket: expected one of {', '.join(BUCKETS)}")
+    unknown = [field for field in group_by if field not in GROUP_FIELDS]
+    if unknown:
+        raise ValueError(f"Invalid group_by: {', '.join(unknown)}")
+    group_by = list(group_by)
+
+    now = now or datetime.now()
+    current_start = bucket_start(now, bucket)
+    if start is None:
+        start = current_start
+        for _ in range(DEFAULT_BUCKET_COUNT - 1):
+            start = bucket_start(start - timedelta(days=1), bucket)
+
+    # Only buckets that lie fully inside the range and have already ended
+    # can be served from the cache
+    cache_start = bucket_start(start, bucket)
+    if cache_start < start:
+        cache_start = next_bucket(cache_start, bucket)
+    cache_end = current_start
+    if end is not None:
+        cache_end = min(cache_end, bucket_start(end, bucket))
+
+    if cache_start >= cache_end:
+        return _shared_rows(bucket, group_by, start, end)
+
+    rows = []
+    if start < cache_start:
+        rows += _shared_rows(bucket, group_by, start, cache_start)
+    rows += _cached_rows(bucket, group_by, cache_start, cache_end)
+    if end is None or cache_end < end:
+        rows += _shared_rows(bucket, group_by, cache_end, end)
+    return rows
+
+
+def invalidate_dates(*values):
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        for value in values:
+            if value is None:
+                continue
+            for bucket in BUCKETS:
+                _cache.pop((bucket, bucket_key(bucket_start(value, bucket))), None)
+
+
+def clear_cache():
+    global _generation
+    with _cache_lock:
+        _generation += 1
+        _cache.clear()
+
+
+# Folds aggregate rows into totals keyed by the given fields
+def fold(rows, fields):
+    totals = {}
+    for row in rows:
+        key = tuple(row[field] for field in fields)
+        total = totals.setdefault(key, {
+            **{field: row[field] for field in fields},
+            'collections': 0, 'completed': 0, 'waste_collected': 0.0
+        })
+        total['collections'] += row['collections']
+        total['completed'] += row['completed']
+        total['waste_collected'] += row['waste_collected']
+    return list(totals.values())
+
+
+# Totals per group with completion rates, largest tonnage first, for the
+# reports endpoint and report jobs
+def report_rows(bucket, group_by, start=None, end=None):
+    rows = fold(aggregate(bucket, group_by, start, end), group_by)
+    for row in rows:
+        row['completion_rate'] = round(row['completed'] / row['collections'] * 100, 2) if row['collections'] else 0
+    rows.sort(key=lambda row: row['waste_collected'], reverse=True)
+    return rows
@@ -1,86 +1,354 @@
+import logging
+import os
+import click
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from models import db, Collection, CollectionPoint
-from datetime import datetime
+from config import config
+from engine_settings import apply_sqlite_pragmas
+from models import db, Collection, CollectionPoint, RecyclingCenter, add_missing_columns, create_missing_indexes
+from datetime import date, datetime
 from routes.collection_points import collection_points_bp
+from routes.analytics import analytics_bp
+from routes.recycling_centers import recycling_centers_bp
+from routes.spatial import spatial_bp
+from routes.route_planning import route_planning_bp
+from routes.forecast import forecast_bp
+from fill_forecast import forecaster
+from routes.events import events_bp
+from routes.exports import exports_bp
+from routes.search import search_bp
+from routes.sync import sync_bp
+from routes.schedule import schedule_bp
+from routes.users import users_bp
+from routes.allocations import allocations_bp
+from routes.jobs import jobs_bp
+import change_feed
+import jobs
+import response_cache
+import observability
+from spatial import backfill_grid_cells
+from collection_queries import query_collections
+from archive import archive_collections, source_for
+from json_stream import stream_json
+from row_updates import VersionConflict, expected_version, patch_row, transition_collections
+from sync import TOMBSTONE_RETENTION_DAYS, ensure_sync_log, prune_tombstones
+import search
+from search import create_search_indexes, rebuild_search_indexes
+from export import FORMATS, export_collections, filename as export_filename
+import analytics
+import rewards
+from materials import backfill_center_materials
+from map_clusters import rebuild_clusters
+from heatmap import rebuild_heatmap
+from allocation import allocate_day
+from bulk_ingest import ingest_collections, iter_ndjson
+from statistics_rollup import (
+    collection_state, record_collection_change, ensure_statistics,
+    rebuild_statistics, check_statistics, read_statistics
+)
 
-def create_app():
+logger = logging.getLogger(__name__)
+
+def create_app(config_name=None):
     app = Flask(__name__)
-    CORS(app)
+    CORS(app, expose_headers=['X-Next-Cursor', 'ETag', 'X-Heatmap-Shape', 'X-Heatmap-Bounds', 'X-Heatmap-Total-Kg'])
     
-    # Configure SQLAlchemy
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///waste_management.db'
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Configure SQLAlchemy (DATABASE_URL switches to PostgreSQL, see config.py)
+    config_name = config_name or os.getenv('APP_CONFIG', 'default')
+    app.config.from_object(config[config_name])
+    # Job worker processes build their app from the same configuration
+    app.config['APP_CONFIG_NAME'] = config_name
     
     # Initialize extensions
     db.init_app(app)
+    response_cache.init_app(app)
+    jobs.init_app(app)
+    search.init_app(app)
+    with app.app_context():
+        apply_sqlite_pragmas(db.engine)
+        observability.init_app(app, db.engine)
     
     # Register blueprints
     app.register_blueprint(collection_points_bp)
+    app.register_blueprint(analytics_bp)
+    app.register_blueprint(recycling_centers_bp)
+    app.register_blueprint(spatial_bp)
+    app.register_blueprint(route_planning_bp)
+    app.register_blueprint(forecast_bp)
+    app.register_blueprint(events_bp)
+    app.register_blueprint(exports_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(sync_bp)
+    app.register_blueprint(schedule_bp)
+    app.register_blueprint(users_bp)
+    app.register_blueprint(allocations_bp)
+    app.register_blueprint(jobs_bp)
     
     # Create tables
     with app.app_context():
         # Create all tables if they don't exist
         db.create_all()
+        add_missing_columns()
+        create_missing_indexes()
+        create_search_indexes()
+        backfill_grid_cells(db, CollectionPoint)
+        backfill_grid_cells(db, RecyclingCenter)
+        forecaster.rebuild()
+        ensure_statistics()
+        ensure_sync_log()
+        rewards.ensure_balances()
+        backfill_center_materials()
+
+    @app.cli.command('rebuild-statistics')
+    def rebuild_statistics_command():
+        rebuild_statistics()
+        db.session.commit()
+        print('Statistics rollup rebuilt')
+
+    @app.cli.command('check-statistics')
+    def check_statistics_command():
+        mismatches = check_statistics()
+        for name, expected, actual in mismatches:
+            print(f"{name}: expected {expected}, found {actual}")
+        if mismatches:
+            raise SystemExit(1)
+        print('Statistics rollup is consistent')
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        rebuild_search_indexes()
+        print('Search indexes rebuilt')
+
+    @app.cli.command('prune-sync-log')
+    @click.option('--days', default=TOMBSTONE_RETENTION_DAYS, show_default=True,
+                  help='Keep deletion tombstones this many days')
+    def prune_sync_log_command(days):
+        print(f'Pruned {prune_tombstones(days)} tombstones')
+
+    @app.cli.command('credit-rewards')
+    def credit_rewards_command():
+        print(f'Credited {rewards.credit_completed()} collections')
+
+    @app.cli.command('compact-rewards')
+    @click.option('--days', default=rewards.LEDGER_RETENTION_DAYS, show_default=True,
+                  help='Keep ledger entries this many days')
+    def compact_rewards_command(days):
+        print(f'Compacted {rewards.compact_ledger(days)} ledger entries')
+
+    @app.cli.command('check-rewards')
+    def check_rewards_command():
+        mismatches = rewards.check_balances()
+        for user_id, expected, actual in mismatches:
+            print(f"user {user_id}: expected {expected}, found {actual}")
+        if mismatches:
+            raise SystemExit(1)
+        print('Reward balances are consistent')
+
+    @app.cli.command('rebuild-map-clusters')
+    def rebuild_map_clusters_command():
+        print(f'Clustered {rebuild_clusters()} collection points')
+
+    @app.cli.command('rebuild-heatmap')
+    def rebuild_heatmap_command():
+        print(f'Binned {rebuild_heatmap()} completed collections')
+
+    @app.cli.command('allocate-waste')
+    @click.option('--date', 'day', default=None, help='ISO date (default today)')
+    @click.option('--full', is_flag=True, help='Re-solve the day instead of routing new tonnage only')
+    def allocate_waste_command(day, full):
+        plan = allocate_day(date.fromisoformat(day) if day else date.today(), full)
+        print(f"Allocated {plan['allocated_kg']} kg, {plan['unallocated_kg']} kg without a center, "
+              f"{plan['tonne_km']} tonne-km in {plan['elapsed_ms']} ms")
+
+    @app.cli.command('archive-collections')
+    @click.option('--horizon-days', type=int, default=None,
+                  help='Archive completed collections older than this (default ARCHIVE_HORIZON_DAYS)')
+    def archive_collections_command(horizon_days):
+        moved = archive_collections(horizon_days or app.config['ARCHIVE_HORIZON_DAYS'])
+        for month, count in moved.items():
+            print(f'{month}: archived {count} collections')
+        print(f'Archived {sum(moved.values())} collections')
+
+    @app.cli.command('run-jobs')
+    @click.option('--workers', type=int, default=None,
+                  help='Worker processes (default JOB_WORKERS, at least 1)')
+    def run_jobs_command(workers):
+        workers = workers or max(app.config['JOB_WORKERS'], 1)
+        print(f'Running jobs on {workers} worker processes')
+        jobs.dispatcher.run(app, workers)
+
+    @app.cli.command('prune-jobs')
+    @click.option('--days', default=jobs.JOB_RETENTION_DAYS, show_default=True,
+                  help='Keep finished jobs this many days')
+    def prune_jobs_command(days):
+        print(f'Pruned {jobs.prune_jobs(days)} jobs')
+
+    @app.cli.command('export-collections')
+    @click.option('--format', 'format', type=click.Choice(list(FORMATS)), default='csv')
+    @click.option('--output', '-o', default=None, help='Output file, - for stdout')
+    @click.option('--start', help='ISO date or datetime, inclusive')
+    @click.option('--end', help='ISO date or datetime, exclusive')
+    @click.option('--status', help='Comma separated statuses')
+    @click.option('--waste-type', help='Comma separated waste types')
+    @click.option('--area', help='Comma separated wards')
+    @click.option('--gzip', 'compress', is_flag=True, help='Compress the output with gzip')
+    def export_collections_command(format, output, start, end, status, waste_type, area, compress):
+        args = {'start': start, 'end': end, 'status': status, 'waste_type': waste_type, 'area': area}
+        try:
+            chunks = export_collections({key: value for key, value in args.items() if value}, format, compress)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        output = output or export_filename(format, compress)
+        with click.open_file(output, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+        if output != '-':
+            click.echo(f'Exported collections to {output}', err=True)
 
     # Collections routes
     @app.route('/api/collections', methods=['GET'])
+    @response_cache.cached_response('collections')
     def get_collections():
-        collections = Collection.query.all()
-        return jsonify([collection.to_dict() for collection in collections])
+        try:
+            rows, next_cursor = query_collections(source_for(request.args), request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return stream_json(rows, {'X-Next-Cursor': next_cursor} if next_cursor else None)
 
     @app.route('/api/collections', methods=['POST'])
     def create_collection():
         data = request.json
         collection = Collection(**data)
         db.session.add(collection)
+        record_collection_change(None, collection_state(collection))
         db.session.commit()
-        return jsonify(collection.to_dict()), 201
+        analytics.invalidate_dates(collection.date_time)
+        result = collection.to_dict()
+        change_feed.publish('collections', 'created', result)
+        jobs.submit_follow_up('credit-rewards')
+        return jsonify(result), 201
+
+    # Accepts a JSON array or a newline-delimited JSON stream
+    @app.route('/api/collections/bulk', methods=['POST'])
+    def bulk_create_collections():
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            records = iter_ndjson(request.stream)
+        else:
+            records = request.get_json(silent=True)
+            if not isinstance(records, list):
+                return jsonify({'error': 'Expected a JSON array of collections'}), 400
+        results = ingest_collections(records)
+        jobs.submit_follow_up('credit-rewards')
+        created = sum(1 for result in results if result['status'] == 'created')
+        failed = len(results) - created
+        status_code = 201 if not failed else (207 if created else 400)
+        return jsonify({
+            'created': created,
+            'failed': failed,
+            'results': results
+        }), status_code
 
     @app.route('/api/collections/<int:id>', methods=['PUT'])
     def update_collection(id):
         collection = Collection.query.get_or_404(id)
         data = request.json
+        before = collection_state(collection)
+        previous_date_time = collection.date_time
+        previous = change_feed.snapshot(collection)
         for key, value in data.items():
             setattr(collection, key, value)
+        record_collection_change(before, collection_state(collection))
         db.session.commit()
+        analytics.invalidate_dates(previous_date_time, collection.date_time)
+        change_feed.publish('collections', 'updated', change_feed.diff(previous, change_feed.snapshot(collection)))
+        jobs.submit_follow_up('credit-rewards')
         return jsonify(collection.to_dict())
 
+    # Partial update in one statement. Send the version from the last read in
+    # If-Match or the body to be refused (409) if the row changed since.
+    @app.route('/api/collections/<int:id>', methods=['PATCH'])
+    def patch_collection(id):
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        try:
+            result = patch_row(Collection, id, data, expected_version(data),
+                               old_columns=('status', 'waste_type', 'waste_collected', 'date_time'))
+            if result is None:
+                db.session.rollback()
+                return jsonify({'error': 'Collection not found'}), 404
+            old, new = result
+            if old is not None:
+                record_collection_change(collection_state(old), collection_state(new))
+            db.session.commit()
+        except VersionConflict as e:
+            db.session.rollback()
+            return jsonify({'error': str(e), 'version': e.current}), 409
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        analytics.invalidate_dates(new.date_time, *([old.date_time] if old is not None else []))
+        result = Collection.to_dict(new)
+        change_feed.publish('collections', 'updated', {
+            'id': id, 'version': new.version, **{key: result[key] for key in data}
+        })
+        jobs.submit_follow_up('credit-rewards')
+        response = jsonify(result)
+        response.headers['ETag'] = f'"{new.version}"'
+        return response
+
+    # Set-based transition of many collections, e.g. closing out a shift:
+    # {"where": {"assigned_team": "Team 3", "status": "in_progress"},
+    #  "set": {"status": "completed"}, "weights": {"412": 38.5, "413": 12.0}}
+    @app.route('/api/collections/transition', methods=['POST'])
+    def transition_collections_route():
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        try:
+            rows = transition_collections(data.get('where') or {}, data.get('set') or {}, data.get('weights'))
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 500
+        analytics.invalidate_dates(*{row.date_time for row in rows})
+        changed = [{
+            'id': row.id, 'version': row.version, 'status': row.status, 'assigned_team': row.assigned_team,
+            'notes': row.notes, 'waste_collected': row.waste_collected
+        } for row in rows]
+        if changed:
+            change_feed.publish('collections', 'bulk_updated', changed)
+            jobs.submit_follow_up('credit-rewards')
+        return jsonify({'updated': len(changed), 'collections': changed})
+
     @app.route('/api/collections/<int:id>', methods=['DELETE'])
     def delete_collection(id):
         collection = Collection.query.get_or_404(id)
         db.session.delete(collection)
+        record_collection_change(collection_state(collection), None)
         db.session.commit()
+        analytics.invalidate_dates(collection.date_time)
+        change_feed.publish('collections', 'deleted', {'id': id})
+        jobs.submit_follow_up('credit-rewards')
         return '', 204
 
     @app.route('/api/statistics', methods=['GET'])
+    @response_cache.cached_response('collections', 'collection-points', coalesce=True)
     def get_statistics():
         try:
-            # Get collection points statistics
-            collection_points = CollectionPoint.query.all()
-            total_points = len(collection_points)
-            bins_at_capacity = len([p for p in collection_points if p.status == 'Full'])
-            
-            # Get collections statistics
-            collections = Collection.query.filter_by(status='completed').all()
-            total_waste = sum(c.waste_collected for c in collections if c.waste_collected)
-            recyclable_waste = sum(c.waste_collected for c in collections 
-                                 if c.waste_collected and c.waste_type.lower() == 'recyclable')
-            
-            recycling_rate = (recyclable_waste / total_waste * 100) if total_waste > 0 else 0
-            
             return jsonify({
-                'totalWaste': total_waste,
-                'recyclingRate': round(recycling_rate),
-                'activePoints': total_points,
-                'binsAtCapacity': bins_at_capacity
+                **read_statistics(),
+                'binsPredictedFull': forecaster.count_predicted_full(within_hours=24)
             })
         except Exception as e:
-            print(f"Error getting statistics: {str(e)}")
+            logger.exception('Error getting statistics')
             return jsonify({'error': str(e)}), 500
     
     return app
 
 if __name__ == '__main__':
-    app = create_app()
-    app.run(port=8080, debug=True) 
\ No newline at end of file
+    app = create_app('development')
+    app.run(port=8080, debug=app.config['DEBUG']) 
\ No newline at end of file
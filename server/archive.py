@@ -0,0 +1,124 @@
+from datetime import datetime, timedelta
+from sqlalchemy import Date, cast, delete, func, insert, literal, select, union_all
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+from models import db, Collection, CollectionArchive, CollectionArchiveSummary
+import change_feed
+
+# Hot/cold storage for collections. Completed collections older than the
+# archive horizon are moved a month at a time from the collection table into
+# collection_archive, keeping their ids, and their totals are folded into
+# collection_archive_summary. The hot table then only holds recent and open
+# collections, so list queries, indexes and per-location lookups stay small.
+#
+# Reads stay complete: collection lists that ask for a range reaching back
+# into archived months read a UNION ALL of both tables, analytics add the
+# summary rows for archived days, and the statistics rollup and last
+# collection dates count archived collections.
+
+DEFAULT_HORIZON_DAYS = 365
+
+
+def _month_start(value):
+    return datetime(value.year, value.month, 1)
+
+
+def _next_month(value):
+    return value.replace(year=value.year + value.month // 12, month=value.month % 12 + 1)
+
+
+def archived_through():
+    return db.session.query(func.max(CollectionArchive.date_time)).scalar()
+
+
+def day_expression(column):
+    if db.engine.dialect.name == 'postgresql':
+        return cast(func.date_trunc('day', column), Date)
+    return func.date(column)
+
+
+def _summary_upsert(rows):
+    table = CollectionArchiveSummary.__table__
+    dialect_insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    statement = dialect_insert(table).from_select(
+        ['day', 'location', 'waste_type', 'assigned_team', 'count', 'waste_collected'], rows
+    )
+    return statement.on_conflict_do_update(
+        index_elements=['day', 'location', 'waste_type', 'assigned_team'],
+        set_={
+            'count': table.c.count + statement.excluded.count,
+            'waste_collected': table.c.waste_collected + statement.excluded.waste_collected,
+        }
+    )
+
+
+def _archive_month(month_start, month_end):
+    table = Collection.__table__
+    condition = (table.c.status == 'completed') & (table.c.date_time >= month_start) & (table.c.date_time < month_end)
+    columns = [column.name for column in table.columns]
+
+    day = day_expression(table.c.date_time)
+    summary = select(
+        day, table.c.location, table.c.waste_type, table.c.assigned_team,
+        func.count(), func.coalesce(func.sum(table.c.waste_collected), 0.0)
+    ).where(condition).group_by(day, table.c.location, table.c.waste_type, table.c.assigned_team)
+    db.session.execute(_summary_upsert(summary))
+
+    db.session.execute(insert(CollectionArchive.__table__).from_select(
+        columns + ['archived_at'],
+        select(*[table.c[name] for name in columns], literal(datetime.utcnow())).where(condition)
+    ))
+    moved = db.session.execute(delete(table).where(condition)).rowcount
+    db.session.commit()
+    return moved
+
+
+# Moves completed collections dated before the first day of the month that
+# contains now - horizon_days. Returns {month: rows moved}.
+def archive_collections(horizon_days=DEFAULT_HORIZON_DAYS, now=None):
+    cutoff = _month_start((now or datetime.now()) - timedelta(days=horizon_days))
+    oldest = db.session.query(func.min(Collection.date_time)).filter(
+        Collection.status == 'completed', Collection.date_time < cutoff
+    ).scalar()
+
+    moved = {}
+    month = _month_start(oldest) if oldest else cutoff
+    while month < cutoff:
+        end = _next_month(month)
+        count = _archive_month(month, end)
+        if count:
+            moved[month.strftime('%Y-%m')] = count
+        month = end
+    if moved:
+        # Lists change shape even though no collection changed
+        change_feed.publish('collections', 'archived', {'before': cutoff.isoformat(), 'months': moved})
+    return moved
+
+
+# Hot collections, or hot and archived ones as a single ORM entity when the
+# requested range reaches back into archived months
+def collection_source(start=None, include_archived=False):
+    if not include_archived:
+        if start is None:
+            return Collection
+        through = archived_through()
+        if through is None or start > through:
+            return Collection
+    columns = [column.name for column in Collection.__table__.columns]
+    combined = union_all(
+        select(*[Collection.__table__.c[name] for name in columns]),
+        select(*[CollectionArchive.__table__.c[name] for name in columns])
+    ).subquery('collection_history')
+    return aliased(Collection, combined, adapt_on_names=True)
+
+
+# collection_source for list request arguments: start=<ISO date> or
+# archived=1. An invalid start is left for the list filters to report.
+def source_for(args):
+    include_archived = args.get('archived', '').lower() in ('1', 'true', 'yes')
+    try:
+        start = datetime.fromisoformat(args['start']) if args.get('start') else None
+    except ValueError:
+        start = None
+    return collection_source(start, include_archived)
@@ -0,0 +1,181 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from app import create_app, db
+from models import Collection, CollectionPoint
+
+# Reproducible endpoint benchmarks. By default every endpoint is driven
+# in-process through the Flask test client; --url runs the same requests
+# against a live server with --concurrency client threads. Results are saved
+# as JSON so runs on different commits can be compared with --compare.
+#
+#   python generate_data.py --points 20000 --collections 1000000
+#   python benchmark.py --requests 200
+#   python benchmark.py --url http://localhost:8080 --concurrency 16
+#   python benchmark.py --compare bench_results/old.json
+
+
+def endpoints():
+    point = db.session.query(CollectionPoint.latitude, CollectionPoint.longitude).first()
+    latitude, longitude = point if point else (19.076, 72.8777)
+    latest = db.session.query(Collection.date_time, Collection.assigned_team).order_by(
+        Collection.date_time.desc()).first()
+    team, day = (latest[1], latest[0].date()) if latest else ('Team 1', datetime.now().date())
+    month_ago = (datetime.now() - timedelta(days=30)).date().isoformat()
+
+    return {
+        'collections_page': '/api/collections?limit=100',
+        'collections_filtered': '/api/collections?limit=100&status=completed&waste_type=recyclable',
+        'collections_projected': '/api/collections?limit=1000&fields=id,date_time,status',
+        'collection_points': '/api/collection-points',
+        'recycling_centers': '/api/recycling-centers',
+        'statistics': '/api/statistics',
+        'analytics_trends': f'/api/analytics/trends?bucket=day&group_by=waste_type&start={month_ago}',
+        'analytics_summary': '/api/analytics/summary',
+        'analytics_reports': '/api/analytics/reports?group_by=assigned_team',
+        'analytics_metrics': f'/api/analytics/metrics?start={month_ago}',
+        'points_within_bbox': f'/api/collection-points/within?bbox={latitude - 0.01},{longitude - 0.01},'
+                              f'{latitude + 0.01},{longitude + 0.01}',
+        'points_nearest': f'/api/collection-points/nearest?lat={latitude}&lon={longitude}&k=10',
+        'points_radius': f'/api/collection-points/radius?lat={latitude}&lon={longitude}&radius_km=1',
+        'centers_nearest': f'/api/recycling-centers/nearest?lat={latitude}&lon={longitude}&k=5',
+        'route_plan': f'/api/routes/plan?team={team.replace(" ", "%20")}&date={day}&time_budget_ms=500',
+        'forecast_full': '/api/forecast/full?hours=24',
+    }
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed, sizes, errors):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'response_bytes': round(statistics.fmean(sizes)) if sizes else 0,
+    }
+
+
+def run_test_client(app, path, requests, warmup):
+    client = app.test_client()
+    for _ in range(warmup):
+        client.get(path)
+    latencies, sizes, errors = [], [], 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        response = client.get(path)
+        # Streamed bodies are only produced when read
+        size = len(response.get_data())
+        latencies.append(time.perf_counter() - request_started)
+        sizes.append(size)
+        errors += response.status_code >= 400
+    return summarize(latencies, time.perf_counter() - started, sizes, errors)
+
+
+def run_http(base_url, path, requests, warmup, concurrency):
+    def fetch(_):
+        request_started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base_url + path) as response:
+                size, ok = len(response.read()), True
+        except Exception:
+            size, ok = 0, False
+        return time.perf_counter() - request_started, size, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(fetch, range(warmup)))
+        started = time.perf_counter()
+        results = list(pool.map(fetch, range(requests)))
+        elapsed = time.perf_counter() - started
+    return summarize([r[0] for r in results], elapsed, [r[1] for r in results if r[2]],
+                     sum(1 for r in results if not r[2]))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as file:
+        baseline = json.load(file)['results']
+    print(f"\n{'endpoint':28} {'p50 before':>11} {'p50 now':>9} {'change':>8}")
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        before, now = baseline[name]['p50_ms'], result['p50_ms']
+        change = (now - before) / before * 100 if before else 0
+        print(f"{name:28} {before:11.3f} {now:9.3f} {change:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API endpoints')
+    parser.add_argument('--requests', type=int, default=100, help='measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--url', help='benchmark a running server instead of the test client')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--only', help='comma separated endpoint names')
+    parser.add_argument('--output', help='results file (default bench_results/<time>-<commit>.json)')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        targets = endpoints()
+        dataset = {
+            'collection_points': db.session.query(CollectionPoint).count(),
+            'collections': db.session.query(Collection).count(),
+        }
+    if args.only:
+        targets = {name: path for name, path in targets.items() if name in args.only.split(',')}
+
+    results = {}
+    for name, path in targets.items():
+        if args.url:
+            result = run_http(args.url.rstrip('/'), path, args.requests, args.warmup, args.concurrency)
+        else:
+            result = run_test_client(app, path, args.requests, args.warmup)
+        results[name] = result
+        print(f"{name:28} p50 {result['p50_ms']:9.3f} ms  p95 {result['p95_ms']:9.3f} ms  "
+              f"p99 {result['p99_ms']:9.3f} ms  {result['throughput_rps']:>9} req/s  "
+              f"{result['response_bytes']:>9} B  errors {result['errors']}")
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'mode': 'http' if args.url else 'test_client',
+        'concurrency': args.concurrency if args.url else 1,
+        'dataset': dataset,
+        'results': results,
+    }
+    output = args.output or os.path.join(
+        'bench_results', f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"\nSaved results to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
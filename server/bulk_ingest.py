@@ -0,0 +1,114 @@
+import json
+from datetime import datetime
+from sqlalchemy import insert
+from models import db, Collection
+from statistics_rollup import record_collection_changes
+from sync import record_changes
+import analytics
+import change_feed
+
+# Bulk ingestion of collection records (e.g. offline pickups synced from the
+# raddiwala app). Records are validated one by one and inserted with a single
+# executemany per chunk, each chunk in its own transaction.
+
+CHUNK_SIZE = 1000
+COLLECTION_STATUSES = ['scheduled', 'in_progress', 'completed', 'cancelled']
+REQUIRED_FIELDS = ['location', 'date_time', 'waste_type', 'assigned_team']
+
+
+def parse_collection(data):
+    if not isinstance(data, dict):
+        raise ValueError('Record must be a JSON object')
+    missing = [field for field in REQUIRED_FIELDS if not data.get(field)]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+
+    date_time = data['date_time']
+    if not isinstance(date_time, datetime):
+        try:
+            date_time = datetime.fromisoformat(str(date_time))
+        except ValueError:
+            raise ValueError('Invalid date_time: expected an ISO datetime')
+
+    status = data.get('status', 'scheduled')
+    if status not in COLLECTION_STATUSES:
+        raise ValueError(f"Invalid status: {status}")
+
+    waste_collected = data.get('waste_collected') or 0.0
+    if isinstance(waste_collected, bool) or not isinstance(waste_collected, (int, float)) or waste_collected < 0:
+        raise ValueError('Invalid waste_collected: expected a non-negative number')
+
+    user_id = data.get('user_id')
+    if user_id is not None and (isinstance(user_id, bool) or not isinstance(user_id, int)):
+        raise ValueError('Invalid user_id: expected an integer')
+
+    return {
+        'location': str(data['location']),
+        'date_time': date_time,
+        'waste_type': str(data['waste_type']),
+        'assigned_team': str(data['assigned_team']),
+        'status': status,
+        'notes': data.get('notes'),
+        'waste_collected': float(waste_collected),
+        'user_id': user_id
+    }
+
+
+# Yields decoded records from a newline-delimited JSON stream; lines that are
+# not valid JSON are yielded as ValueErrors so they show up in the report
+def iter_ndjson(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+
+def _insert_chunk(rows):
+    ids = db.session.execute(
+        insert(Collection).returning(Collection.id, sort_by_parameter_order=True),
+        rows
+    ).scalars().all()
+    record_changes(db.session.connection(), 'collections', ids)
+    record_collection_changes([
+        (None, (row['status'], row['waste_type'], row['waste_collected'])) for row in rows
+    ])
+    db.session.commit()
+    analytics.invalidate_dates(*{row['date_time'] for row in rows})
+    change_feed.publish('collections', 'bulk_created', {'ids': ids})
+    return ids
+
+
+# Returns one result per input record, in input order
+def ingest_collections(records, chunk_size=CHUNK_SIZE):
+    results = []
+    pending = []
+
+    def flush():
+        try:
+            ids = _insert_chunk([row for _, row in pending])
+            for (index, _), id in zip(pending, ids):
+                results[index] = {'index': index, 'status': 'created', 'id': id}
+        except Exception as e:
+            db.session.rollback()
+            for index, _ in pending:
+                results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+        pending.clear()
+
+    for index, record in enumerate(records):
+        results.append(None)
+        try:
+            if isinstance(record, Exception):
+                raise record
+            pending.append((index, parse_collection(record)))
+        except ValueError as e:
+            results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+            continue
+        if len(pending) >= chunk_size:
+            flush()
+    if pending:
+        flush()
+    return results
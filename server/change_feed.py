@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+# In-process pub/sub bus for row changes. Write handlers publish compact
+# deltas after committing; Server-Sent Events subscribers read them from a
+# bounded ring buffer, which also lets a reconnecting client resume from its
+# Last-Event-ID as long as the events are still buffered.
+
+BUFFER_SIZE = 2000
+KEEPALIVE_SECONDS = 15
+
+TOPICS = ['collections', 'collection-points', 'recycling-centers']
+
+
+def _serialize(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def snapshot(row):
+    return {column.key: _serialize(getattr(row, column.key)) for column in row.__table__.columns}
+
+
+# Only the fields that differ between two snapshots, plus the id
+def diff(before, after):
+    return {'id': after['id'], **{key: value for key, value in after.items() if before.get(key) != value}}
+
+
+class ChangeFeed:
+    def __init__(self, size=BUFFER_SIZE):
+        self._events = deque(maxlen=size)
+        self._condition = threading.Condition()
+        # Ids start from the boot time so they keep increasing across
+        # restarts and a stale Last-Event-ID is detected as a gap
+        self._last_id = int(time.time() * 1000)
+        self._listeners = []
+
+    @property
+    def last_id(self):
+        return self._last_id
+
+    def publish(self, topic, action, data):
+        with self._condition:
+            self._last_id += 1
+            event = {'id': self._last_id, 'topic': topic, 'action': action, 'data': data}
+            self._events.append(event)
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener(event)
+        return event
+
+    # Callbacks run synchronously in the publishing request, e.g. to
+    # invalidate caches derived from the topic
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    # Returns (events after last_id matching the topics, whether events were
+    # missed because they already left the buffer, id of the newest event)
+    def events_after(self, last_id, topics=None):
+        with self._condition:
+            events = list(self._events)
+            current = self._last_id
+        oldest = events[0]['id'] if events else current + 1
+        missed = last_id < oldest - 1 or last_id > current
+        return [
+            event for event in events
+            if event['id'] > last_id and (topics is None or event['topic'] in topics)
+        ], missed, current
+
+    def wait(self, last_id, timeout):
+        with self._condition:
+            return self._condition.wait_for(lambda: self._last_id > last_id, timeout)
+
+
+feed = ChangeFeed()
+
+
+def publish(topic, action, data):
+    return feed.publish(topic, action, data)
+
+
+def format_event(event):
+    payload = json.dumps({'action': event['action'], 'data': event['data']}, default=str)
+    return f"id: {event['id']}\nevent: {event['topic']}\ndata: {payload}\n\n"
+
+
+def stream(last_id=None, topics=None):
+    if last_id is None:
+        last_id = feed.last_id
+    else:
+        _, missed, current = feed.events_after(last_id, topics)
+        if missed:
+            # The client has to refetch its lists before applying deltas
+            yield f"id: {current}\nevent: reset\ndata: {{}}\n\n"
+            last_id = current
+
+    yield 'retry: 3000\n\n'
+    while True:
+        events, _, current = feed.events_after(last_id, topics)
+        for event in events:
+            yield format_event(event)
+        # Events filtered out by topic are skipped as well
+        last_id = current
+        if not feed.wait(last_id, KEEPALIVE_SECONDS):
+            yield ': keepalive\n\n'
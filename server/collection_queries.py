@@ -0,0 +1,107 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, inspect, or_
+from models import db
+from json_stream import iter_rows
+
+# Keyset pagination, filtering and column projection for collection lists.
+# The functions take the model class, or an aliased entity over the hot and
+# archived collections (see archive.py), so hot and archived reads share one
+# implementation.
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+FILTER_FIELDS = ['status', 'waste_type', 'assigned_team', 'location']
+
+
+def encode_cursor(date_time, id):
+    payload = json.dumps([date_time.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date_time, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(date_time), int(id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+
+def _parse_datetime(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: expected an ISO date or datetime")
+
+
+def selected_columns(model, fields):
+    available = [attribute.key for attribute in inspect(model).mapper.column_attrs]
+    if not fields:
+        return available
+    requested = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in available]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return requested
+
+
+def filtered_query(model, args):
+    query = db.session.query(model)
+    for field in FILTER_FIELDS:
+        value = args.get(field)
+        if value:
+            values = value.split(',')
+            column = getattr(model, field)
+            query = query.filter(column == values[0] if len(values) == 1 else column.in_(values))
+    if args.get('start'):
+        query = query.filter(model.date_time >= _parse_datetime(args['start'], 'start'))
+    if args.get('end'):
+        query = query.filter(model.date_time < _parse_datetime(args['end'], 'end'))
+    return query
+
+
+# Returns (rows, next_cursor) where rows is an iterator of dicts holding only
+# the requested fields, fetched in batches as it is consumed, and next_cursor
+# is None on the last page
+def query_collections(model, args):
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError('Invalid limit')
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    # Oldest first by default, as the list was before it was paginated
+    descending = args.get('order', 'asc') == 'desc'
+    fields = selected_columns(model, args.get('fields'))
+
+    query = filtered_query(model, args)
+    if args.get('cursor'):
+        date_time, id = decode_cursor(args['cursor'])
+        if descending:
+            query = query.filter(or_(
+                model.date_time < date_time,
+                and_(model.date_time == date_time, model.id < id)
+            ))
+        else:
+            query = query.filter(or_(
+                model.date_time > date_time,
+                and_(model.date_time == date_time, model.id > id)
+            ))
+
+    if descending:
+        query = query.order_by(model.date_time.desc(), model.id.desc())
+    else:
+        query = query.order_by(model.date_time.asc(), model.id.asc())
+
+    # The cursor is needed for the response headers before the body is
+    # streamed, so the last key of the page and whether a row follows it
+    # are read with a separate index-only query
+    keys = query.with_entities(model.date_time, model.id).offset(limit - 1).limit(2).all()
+    next_cursor = encode_cursor(*keys[0]) if len(keys) > 1 else None
+
+    statement = query.with_entities(*[getattr(model, key) for key in fields]).limit(limit).statement
+    rows = (dict(zip(fields, row)) for row in iter_rows(query.session, statement))
+    return rows, next_cursor
@@ -0,0 +1,58 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Imported after load_dotenv so the pragma and pool settings see .env
+from engine_settings import engine_options  # noqa: E402
+
+DEFAULT_DATABASE_URL = 'sqlite:///waste_management.db'
+
+
+class Config:
+    """Base configuration"""
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL)
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # Shared generation counters for multi-worker deployments, e.g.
+    # /dev/shm/kachra-response-cache; unset keeps them per process
+    RESPONSE_CACHE_SHM = os.getenv('RESPONSE_CACHE_SHM')
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    # How often the search vocabulary checks the indexes for changes
+    SEARCH_VOCABULARY_TTL_SECONDS = float(os.getenv('SEARCH_VOCABULARY_TTL_SECONDS', 60))
+    # Completed collections older than this move to the archive tables
+    ARCHIVE_HORIZON_DAYS = int(os.getenv('ARCHIVE_HORIZON_DAYS', 365))
+    # Worker processes the web process runs background jobs on; 0 leaves the
+    # jobs to flask run-jobs. Results default to instance/jobs.
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+    JOB_RESULTS_DIR = os.getenv('JOB_RESULTS_DIR')
+
+
+class DevelopmentConfig(Config):
+    """Development configuration"""
+    DEBUG = True
+
+
+class ProductionConfig(Config):
+    """Production configuration"""
+    DEBUG = False
+    # gevent workers should not fork a process pool; run flask run-jobs
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 0))
+
+
+class TestingConfig(Config):
+    """Testing configuration"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # Tests run jobs in process with jobs.run_job
+    JOB_WORKERS = 0
+
+
+config = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+    'default': DevelopmentConfig
+}
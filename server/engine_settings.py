@@ -0,0 +1,49 @@
+import os
+from sqlalchemy import event
+
+# Database engine settings shared by the server and flask-server apps.
+# SQLite connections get WAL so readers run alongside a writer, NORMAL sync
+# (safe under WAL), a busy timeout so concurrent writers wait for the lock
+# instead of failing straight away, and memory-mapped reads.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'temp_store': 'MEMORY',
+}
+
+
+# Connection pool settings for the given database URL
+def engine_options(database_url):
+    if not database_url:
+        return {}
+    if database_url.startswith('postgresql'):
+        return {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 20)),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True,
+        }
+    if database_url.startswith('sqlite') and ':memory:' not in database_url:
+        return {
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 8)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 8)),
+            'connect_args': {'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000},
+        }
+    return {}
+
+
+# Sets the pragmas on every new connection of a SQLite engine
+def apply_sqlite_pragmas(engine, pragmas=SQLITE_PRAGMAS):
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
@@ -0,0 +1,148 @@
+import csv
+import io
+import zlib
+from datetime import datetime
+from models import db
+from collection_queries import filtered_query
+from analytics import area_expression
+from archive import source_for
+from json_stream import dumps, iter_batches
+
+# Streaming exports of collection records for municipal reporting. Rows are
+# read in batches through a server-side cursor (yield_per) and each batch is
+# encoded and optionally gzip-compressed before the next one is fetched, so an
+# export of any size runs in memory bounded by the batch size.
+
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+EXPORT_BATCH_SIZE = 5000
+
+COLUMNS = ['id', 'location', 'area', 'date_time', 'waste_type', 'assigned_team',
+           'status', 'notes', 'waste_collected', 'created_at']
+
+
+def _statement(args):
+    source = source_for(args)
+    query = filtered_query(source, args)
+    area = area_expression(source)
+    if args.get('area'):
+        query = query.filter(area.in_(args['area'].split(',')))
+    columns = [area.label('area') if name == 'area' else getattr(source, name) for name in COLUMNS]
+    return query.with_entities(*columns).order_by(source.date_time, source.id).statement
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _encode_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for batch in batches:
+        writer.writerows([_csv_value(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def _encode_ndjson(batches):
+    for batch in batches:
+        yield b''.join(dumps(dict(zip(COLUMNS, row))) + b'\n' for row in batch)
+
+
+class _ChunkSink(io.RawIOBase):
+    # File object the Parquet writer writes into; drained after each row group
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_schema(pa):
+    return pa.schema([
+        ('id', pa.int64()),
+        ('location', pa.string()),
+        ('area', pa.string()),
+        ('date_time', pa.timestamp('us')),
+        ('waste_type', pa.string()),
+        ('assigned_team', pa.string()),
+        ('status', pa.string()),
+        ('notes', pa.string()),
+        ('waste_collected', pa.float64()),
+        ('created_at', pa.timestamp('us')),
+    ])
+
+
+# One row group per batch
+def _encode_parquet(batches):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(pa)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    for batch in batches:
+        columns = list(zip(*batch))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _gzip(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def check_format(format):
+    if format not in FORMATS:
+        raise ValueError(f"Invalid format: expected one of {', '.join(FORMATS)}")
+    if format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError('Parquet export requires pyarrow to be installed')
+
+
+def filename(format, compress=False):
+    extension = FORMATS[format][1]
+    return f"collections-{datetime.now():%Y%m%d-%H%M%S}.{extension}" + ('.gz' if compress else '')
+
+
+# Encoded chunks of the export; args takes the collection list filters
+# (status, waste_type, assigned_team, location, start, end, archived) plus area
+def export_collections(args, format='csv', compress=False, batch_size=EXPORT_BATCH_SIZE):
+    check_format(format)
+    statement = _statement(args)
+    batches = iter_batches(db.session, statement, batch_size)
+    encoders = {'csv': _encode_csv, 'ndjson': _encode_ndjson, 'parquet': _encode_parquet}
+    chunks = encoders[format](batches)
+    return _gzip(chunks) if compress else chunks
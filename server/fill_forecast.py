@@ -0,0 +1,334 @@
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import bindparam, func, insert, text, update
+from models import db, CollectionPoint, CapacityReading, SyncChange
+from statistics_rollup import record_point_change
+from sync import ADVISORY_LOCK_KEY as SYNC_ADVISORY_LOCK_KEY, pruned_through, record_changes
+import change_feed
+
+# Fill-level forecasting from bin sensor readings. For every point the
+# engine keeps least-squares sums of (hours, capacity) over the readings
+# since the bin was last emptied, fitted in one vectorized pass over the
+# stored readings, so a forecast for all points is a handful of NumPy array
+# operations.
+#
+# Every process keeps its own copy and nothing is updated on ingest. Reads
+# first catch up: points with readings stored after the last one fitted are
+# refitted from the table in recorded_at order, so late readings land in the
+# right fill cycle, and points deleted in the sync log are dropped. Readings
+# ingested by another worker show up on the next read and all workers agree
+# on the forecast.
+
+FULL_THRESHOLD = 90.0
+# A drop larger than this between two readings means the bin was emptied
+EMPTIED_DROP = 10.0
+LOOKBACK_DAYS = 14
+CHUNK_SIZE = 1000
+ID_CHUNK_SIZE = 500
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _hours(value):
+    return (value - _EPOCH).total_seconds() / 3600
+
+
+class FillForecaster:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._catch_up_lock = threading.Lock()
+        # Last sync log entry and capacity reading the fits reflect
+        self._seq = 0
+        self._reading_id = 0
+        self._clear()
+
+    def _clear(self):
+        self._slots = {}
+        self._used = 0
+        self._point_ids = np.zeros(0, dtype=np.int64)
+        # Per slot: reading count, first/last reading time in hours, last
+        # capacity and the regression sums over time relative to first_t
+        self._n = np.zeros(0)
+        self._first_t = np.zeros(0)
+        self._last_t = np.zeros(0)
+        self._last_y = np.zeros(0)
+        self._sum_t = np.zeros(0)
+        self._sum_y = np.zeros(0)
+        self._sum_tt = np.zeros(0)
+        self._sum_ty = np.zeros(0)
+
+    def _arrays(self):
+        return ('_n', '_first_t', '_last_t', '_last_y', '_sum_t', '_sum_y', '_sum_tt', '_sum_ty')
+
+    def _slot(self, point_id):
+        slot = self._slots.get(point_id)
+        if slot is not None:
+            return slot
+        slot = self._used
+        self._used += 1
+        if slot >= len(self._n):
+            used = len(self._n)
+            size = max(16, used * 2)
+            for name in self._arrays():
+                array = np.zeros(size)
+                array[:used] = getattr(self, name)
+                setattr(self, name, array)
+            point_ids = np.full(size, -1, dtype=np.int64)
+            point_ids[:used] = self._point_ids
+            self._point_ids = point_ids
+        self._slots[point_id] = slot
+        self._point_ids[slot] = point_id
+        return slot
+
+    def _forget(self, point_id):
+        slot = self._slots.pop(point_id, None)
+        if slot is not None:
+            self._point_ids[slot] = -1
+            self._n[slot] = 0
+
+    def forget(self, point_id):
+        with self._lock:
+            self._forget(point_id)
+
+    def _readings(self, since, point_ids):
+        query = db.session.query(
+            CapacityReading.point_id, CapacityReading.recorded_at, CapacityReading.capacity
+        ).filter(CapacityReading.recorded_at >= since)
+        order = (CapacityReading.point_id, CapacityReading.recorded_at)
+        if point_ids is None:
+            return query.order_by(*order).all()
+        rows = []
+        for start in range(0, len(point_ids), ID_CHUNK_SIZE):
+            chunk = point_ids[start:start + ID_CHUNK_SIZE]
+            rows += query.filter(CapacityReading.point_id.in_(chunk)).order_by(*order).all()
+        return rows
+
+    # Batch fit from stored readings: each point's series is split at the
+    # drops where it was emptied and only the latest fill cycle is kept.
+    # With point_ids only those points are refitted.
+    def rebuild(self, since=None, point_ids=None):
+        since = since or datetime.utcnow() - timedelta(days=LOOKBACK_DAYS)
+        head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+        last_reading = db.session.query(func.max(CapacityReading.id)).scalar() or 0
+        if point_ids is not None:
+            point_ids = sorted(point_ids)
+        rows = self._readings(since, point_ids)
+
+        fitted = {}
+        if rows:
+            ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            t = np.fromiter((_hours(row[1]) for row in rows), dtype=float, count=len(rows))
+            y = np.fromiter((row[2] for row in rows), dtype=float, count=len(rows))
+
+            new_point = np.r_[True, ids[1:] != ids[:-1]]
+            emptied = np.r_[False, y[1:] < y[:-1] - EMPTIED_DROP]
+            cycle = np.cumsum(new_point | emptied) - 1
+            # Last cycle of each point
+            last_cycle_of_point = np.maximum.reduceat(cycle, np.flatnonzero(new_point))
+            keep = cycle == np.repeat(last_cycle_of_point, np.diff(np.r_[np.flatnonzero(new_point), len(rows)]))
+
+            ids, t, y, cycle = ids[keep], t[keep], y[keep], cycle[keep]
+            starts = np.flatnonzero(np.r_[True, cycle[1:] != cycle[:-1]])
+            ends = np.r_[starts[1:], len(cycle)] - 1
+            segment = np.cumsum(np.r_[True, cycle[1:] != cycle[:-1]]) - 1
+            dt = t - t[starts][segment]
+
+            fitted = {
+                '_point_ids': ids[starts],
+                '_n': np.bincount(segment).astype(float),
+                '_first_t': t[starts],
+                '_last_t': t[ends],
+                '_last_y': y[ends],
+                '_sum_t': np.bincount(segment, weights=dt),
+                '_sum_y': np.bincount(segment, weights=y),
+                '_sum_tt': np.bincount(segment, weights=dt * dt),
+                '_sum_ty': np.bincount(segment, weights=dt * y),
+            }
+
+        with self._lock:
+            if point_ids is None:
+                self._clear()
+                self._seq = head
+                self._reading_id = last_reading
+            else:
+                refitted = set(fitted['_point_ids'].tolist()) if fitted else set()
+                for point_id in set(point_ids) - refitted:
+                    self._forget(point_id)
+            if fitted:
+                slots = np.array([self._slot(int(point_id)) for point_id in fitted['_point_ids']], dtype=np.int64)
+                for name in self._arrays():
+                    getattr(self, name)[slots] = fitted[name]
+
+    # Refits the points with readings stored since the last read and drops
+    # the points deleted since, or refits everything when the sync log was
+    # pruned past the last read
+    def catch_up(self):
+        with self._catch_up_lock:
+            if pruned_through() > self._seq:
+                self.rebuild()
+                return
+            head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+            deleted = [record_id for record_id, in db.session.query(SyncChange.record_id).filter(
+                SyncChange.seq > self._seq, SyncChange.seq <= head,
+                SyncChange.resource == 'collection-points', SyncChange.deleted.is_(True)
+            )]
+            readings = db.session.query(CapacityReading.point_id, func.max(CapacityReading.id)).filter(
+                CapacityReading.id > self._reading_id
+            ).group_by(CapacityReading.point_id).all()
+            for point_id in deleted:
+                self.forget(point_id)
+            if readings:
+                self.rebuild(point_ids=[point_id for point_id, _ in readings])
+                self._reading_id = max(reading_id for _, reading_id in readings)
+            self._seq = head
+
+    # Returns arrays (point_ids, fill_rate_per_hour, hours_until_threshold,
+    # last_capacity) for every tracked point
+    def _predict(self, threshold, now):
+        with self._lock:
+            valid = self._point_ids >= 0
+            n = self._n[valid]
+            sum_t, sum_y = self._sum_t[valid], self._sum_y[valid]
+            sum_tt, sum_ty = self._sum_tt[valid], self._sum_ty[valid]
+            last_t, last_y = self._last_t[valid], self._last_y[valid]
+            point_ids = self._point_ids[valid]
+
+        denominator = n * sum_tt - sum_t * sum_t
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = np.where((n >= 2) & (denominator > 0), (n * sum_ty - sum_t * sum_y) / denominator, 0.0)
+            hours = np.where(rate > 0, (threshold - last_y) / rate, np.inf)
+        hours = hours - (_hours(now) - last_t)
+        hours = np.where(last_y >= threshold, 0.0, np.maximum(hours, 0.0))
+        return point_ids, rate, hours, last_y
+
+    def predicted_full(self, within_hours, threshold=FULL_THRESHOLD, now=None):
+        self.catch_up()
+        now = now or datetime.utcnow()
+        point_ids, rate, hours, last_y = self._predict(threshold, now)
+        selected = np.flatnonzero(hours <= within_hours)
+        selected = selected[np.argsort(hours[selected], kind='stable')]
+        return [{
+            'point_id': int(point_ids[i]),
+            'capacity': float(last_y[i]),
+            'fill_rate_per_hour': round(float(rate[i]), 4),
+            'hours_until_full': round(float(hours[i]), 2),
+            'predicted_full_at': (now + timedelta(hours=float(hours[i]))).isoformat()
+        } for i in selected]
+
+    def count_predicted_full(self, within_hours, threshold=FULL_THRESHOLD, now=None):
+        self.catch_up()
+        _, _, hours, _ = self._predict(threshold, now or datetime.utcnow())
+        return int(np.count_nonzero(hours <= within_hours))
+
+
+forecaster = FillForecaster()
+
+
+def parse_reading(data):
+    if not isinstance(data, dict):
+        raise ValueError('Reading must be a JSON object')
+    try:
+        point_id = int(data['point_id'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Invalid or missing point_id')
+    capacity = data.get('capacity')
+    if isinstance(capacity, bool) or not isinstance(capacity, (int, float)) or not 0 <= capacity <= 100:
+        raise ValueError('Invalid capacity: expected a percentage between 0 and 100')
+    recorded_at = data.get('recorded_at')
+    try:
+        recorded_at = datetime.fromisoformat(recorded_at) if recorded_at else datetime.utcnow()
+    except (TypeError, ValueError):
+        raise ValueError('Invalid recorded_at: expected an ISO datetime')
+    return {'point_id': point_id, 'recorded_at': recorded_at, 'capacity': float(capacity)}
+
+
+def _point_status(status, capacity):
+    if status == 'Maintenance':
+        return status
+    return 'Full' if capacity >= FULL_THRESHOLD else ('Active' if status == 'Full' else status)
+
+
+# Stores the readings and moves each point's current capacity and Full
+# status to its latest reading, unless a newer reading was already stored
+def _insert_chunk(rows):
+    if db.engine.dialect.name == 'postgresql':
+        # Reading ids become visible in order, as the forecaster reads
+        # them after the last id it fitted
+        db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': SYNC_ADVISORY_LOCK_KEY})
+    point_ids = {row['point_id'] for row in rows}
+    points = {
+        point.id: point for point in db.session.query(
+            CollectionPoint.id, CollectionPoint.status, CollectionPoint.capacity
+        ).filter(CollectionPoint.id.in_(point_ids)).with_for_update().all()
+    }
+    unknown = {row['point_id'] for row in rows if row['point_id'] not in points}
+    accepted = [row for row in rows if row['point_id'] in points]
+
+    changes = []
+    if accepted:
+        stored = dict(db.session.query(CapacityReading.point_id, func.max(CapacityReading.recorded_at)).filter(
+            CapacityReading.point_id.in_(points)
+        ).group_by(CapacityReading.point_id).all())
+        db.session.execute(insert(CapacityReading), accepted)
+        latest = {}
+        for row in sorted(accepted, key=lambda row: row['recorded_at']):
+            if stored.get(row['point_id']) is None or row['recorded_at'] >= stored[row['point_id']]:
+                latest[row['point_id']] = row
+        for point_id, row in latest.items():
+            point = points[point_id]
+            status = _point_status(point.status, row['capacity'])
+            changes.append({'id': point_id, 'capacity': row['capacity'], 'status': status})
+            if status != point.status:
+                record_point_change((point.status,), (status,))
+    if changes:
+        table = CollectionPoint.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('point_id')).values(
+                capacity=bindparam('new_capacity'), status=bindparam('new_status'), version=table.c.version + 1
+            ),
+            [{'point_id': change['id'], 'new_capacity': change['capacity'], 'new_status': change['status']}
+             for change in changes]
+        )
+        record_changes(db.session.connection(), 'collection-points', [change['id'] for change in changes])
+    db.session.commit()
+    if changes:
+        change_feed.publish('collection-points', 'bulk_updated', changes)
+    # The forecaster refits these points from the stored readings on its
+    # next read
+    return unknown
+
+
+# Returns one result per input reading, in input order
+def ingest_readings(records, chunk_size=CHUNK_SIZE):
+    results = []
+    pending = []
+
+    def flush():
+        try:
+            unknown = _insert_chunk([row for _, row in pending])
+            for index, row in pending:
+                if row['point_id'] in unknown:
+                    results[index] = {'index': index, 'status': 'error', 'error': 'Unknown point_id'}
+                else:
+                    results[index] = {'index': index, 'status': 'created'}
+        except Exception as e:
+            db.session.rollback()
+            for index, _ in pending:
+                results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+        pending.clear()
+
+    for index, record in enumerate(records):
+        results.append(None)
+        try:
+            if isinstance(record, Exception):
+                raise record
+            pending.append((index, parse_reading(record)))
+        except ValueError as e:
+            results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+            continue
+        if len(pending) >= chunk_size:
+            flush()
+    if pending:
+        flush()
+    return results
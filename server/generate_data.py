@@ -0,0 +1,191 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import insert
+from app import create_app, db
+from models import (
+    AllocationDay, CenterAllocation, Collection, CollectionArchive, CollectionArchiveSummary, CollectionPoint,
+    CapacityReading, CollectionReward, RewardCursor, RewardLedger, RewardSnapshot, User, UserBalance
+)
+from heatmap import rebuild_heatmap
+from map_clusters import rebuild_clusters
+from spatial import grid_cell
+from statistics_rollup import rebuild_statistics
+from sync import reset_sync_log
+import analytics
+import rewards
+
+# Synthetic municipal-scale dataset: collection points spread over Mumbai's
+# wards and years of collection history, generated with NumPy and written
+# with chunked Core inserts.
+#
+#   python generate_data.py --points 20000 --collections 2000000 --days 730 --users 100000
+
+WARDS = {
+    "Colaba": (18.9067, 72.8147), "Fort": (18.9353, 72.8360), "Byculla": (18.9790, 72.8330),
+    "Worli": (18.9986, 72.8174), "Dadar": (19.0178, 72.8478), "Sion": (19.0390, 72.8619),
+    "Bandra": (19.0596, 72.8295), "Chembur": (19.0522, 72.9005), "Kurla": (19.0728, 72.8826),
+    "Santacruz": (19.0800, 72.8400), "Juhu": (19.0883, 72.8262), "Ghatkopar": (19.0858, 72.9089),
+    "Andheri": (19.1136, 72.8697), "Powai": (19.1176, 72.9060), "Vikhroli": (19.1100, 72.9300),
+    "Jogeshwari": (19.1360, 72.8490), "Goregaon": (19.1663, 72.8526), "Malad": (19.1860, 72.8480),
+    "Mulund": (19.1726, 72.9560), "Kandivali": (19.2040, 72.8520), "Borivali": (19.2307, 72.8567),
+    "Dahisar": (19.2500, 72.8600), "Bhandup": (19.1440, 72.9370), "Mankhurd": (19.0480, 72.9320),
+}
+STREET_PREFIXES = ["Shivaji", "Gandhi", "Nehru", "Ambedkar", "Tilak", "Subhash",
+                   "Vivekananda", "Tagore", "Azad", "Bhagat Singh", "Sardar Patel", "Phule"]
+STREET_TYPES = ["Road", "Street", "Lane", "Marg", "Path", "Cross Road", "Main Road"]
+WASTE_TYPES = ["general", "recyclable", "hazardous", "organic", "electronic", "medical"]
+WASTE_TYPE_WEIGHTS = [0.35, 0.25, 0.05, 0.25, 0.06, 0.04]
+TEAMS = 40
+# Share of collections handed over by a registered user when --users is set
+USER_SHARE = 0.7
+CHUNK_SIZE = 50000
+
+
+def _insert(model, rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        db.session.execute(insert(model), rows[start:start + CHUNK_SIZE])
+        db.session.commit()
+
+
+def generate_points(rng, count):
+    names = list(WARDS)
+    ward = rng.integers(0, len(names), count)
+    centers = np.array([WARDS[name] for name in names])
+    coordinates = centers[ward] + rng.normal(0, 0.008, (count, 2))
+    capacity = np.round(rng.uniform(0, 100, count), 1)
+    status = np.where(capacity >= 90, 'Full', np.where(rng.random(count) < 0.05, 'Maintenance', 'Active'))
+    prefixes = rng.integers(0, len(STREET_PREFIXES), count)
+    types = rng.integers(0, len(STREET_TYPES), count)
+
+    rows = []
+    for i in range(count):
+        area = names[ward[i]]
+        latitude, longitude = float(coordinates[i, 0]), float(coordinates[i, 1])
+        rows.append({
+            'name': f"{area} Bin {i + 1}",
+            'address': f"{i + 1} {STREET_PREFIXES[prefixes[i]]} {STREET_TYPES[types[i]]}, {area}",
+            'area': area,
+            'latitude': latitude,
+            'longitude': longitude,
+            'capacity': float(capacity[i]),
+            'status': str(status[i]),
+            'grid_cell': grid_cell(latitude, longitude),
+            'created_at': datetime.utcnow()
+        })
+    return rows
+
+
+def generate_users(rng, count):
+    names = list(WARDS)
+    ward = rng.integers(0, len(names), count)
+    raddiwala = rng.random(count) < 0.1
+    return [{
+        'name': f"{'Raddiwala' if raddiwala[i] else 'Citizen'} {i + 1}",
+        'phone': f"9{i + 1:09d}",
+        'role': 'raddiwala' if raddiwala[i] else 'citizen',
+        'area': names[ward[i]],
+        'created_at': datetime.utcnow()
+    } for i in range(count)]
+
+
+def generate_collections(rng, addresses, count, days, now, user_ids=()):
+    start = now - timedelta(days=days)
+    # Up to a week of scheduled collections ahead of now
+    span_seconds = (days + 7) * 86400
+    addresses = np.array(addresses, dtype=object)
+
+    for offset in range(0, count, CHUNK_SIZE):
+        size = min(CHUNK_SIZE, count - offset)
+        seconds = np.sort(rng.integers(0, span_seconds, size))
+        date_times = (np.datetime64(start, 's') + seconds.astype('timedelta64[s]')).astype(object)
+        past = seconds < days * 86400
+        cancelled = rng.random(size) < 0.03
+        status = np.where(past, np.where(cancelled, 'cancelled', 'completed'),
+                          np.where(rng.random(size) < 0.1, 'in_progress', 'scheduled'))
+        waste = np.where(status == 'completed', np.round(rng.gamma(2.0, 60.0, size), 2), 0.0)
+        waste_type = rng.choice(WASTE_TYPES, size, p=WASTE_TYPE_WEIGHTS)
+        team = rng.integers(1, TEAMS + 1, size)
+        location = addresses[rng.integers(0, len(addresses), size)]
+        if len(user_ids):
+            registered = rng.random(size) < USER_SHARE
+            user_id = np.asarray(user_ids)[rng.integers(0, len(user_ids), size)]
+        created_at = datetime.utcnow()
+
+        yield [{
+            'location': location[i],
+            'date_time': date_times[i],
+            'waste_type': str(waste_type[i]),
+            'assigned_team': f"Team {team[i]}",
+            'status': str(status[i]),
+            'notes': None,
+            'waste_collected': float(waste[i]),
+            'created_at': created_at,
+            'user_id': int(user_id[i]) if len(user_ids) and registered[i] else None
+        } for i in range(size)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic dataset')
+    parser.add_argument('--points', type=int, default=20000)
+    parser.add_argument('--collections', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=730, help='days of history before today')
+    parser.add_argument('--users', type=int, default=0, help='registered citizens and raddiwalas')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep-existing', action='store_true', help='append instead of clearing tables')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        if not args.keep_existing:
+            db.session.query(CapacityReading).delete()
+            for model in (CollectionReward, RewardCursor, RewardLedger, RewardSnapshot, UserBalance, User):
+                db.session.query(model).delete()
+            db.session.query(CollectionArchiveSummary).delete()
+            db.session.query(CollectionArchive).delete()
+            db.session.query(Collection).delete()
+            db.session.query(CollectionPoint).delete()
+            db.session.commit()
+
+        points = generate_points(rng, args.points)
+        _insert(CollectionPoint, points)
+        print(f"Inserted {len(points)} collection points in {time.perf_counter() - started:.1f}s")
+
+        user_ids = []
+        if args.users:
+            _insert(User, generate_users(rng, args.users))
+            users = db.session.query(User.id, User.role).order_by(User.id).all()
+            user_ids = [id for id, _ in users]
+            _insert(UserBalance, [{'user_id': id, 'role': role} for id, role in users])
+            print(f"Inserted {len(user_ids)} users")
+
+        addresses = [point['address'] for point in points]
+        inserted = 0
+        for rows in generate_collections(rng, addresses, args.collections, args.days, datetime.now(), user_ids):
+            _insert(Collection, rows)
+            inserted += len(rows)
+            elapsed = time.perf_counter() - started
+            print(f"Inserted {inserted}/{args.collections} collections ({inserted / elapsed:.0f} rows/s)")
+
+        rebuild_statistics()
+        db.session.commit()
+        # The tables derived from collections and points are rebuilt against
+        # the regenerated sync log rather than left for their next refresh
+        reset_sync_log()
+        rebuild_heatmap()
+        rebuild_clusters()
+        # Allocations are solved per day on demand, see allocate-waste
+        for model in (CenterAllocation, AllocationDay):
+            db.session.query(model).delete()
+        db.session.commit()
+        analytics.clear_cache()
+        if args.users:
+            print(f"Credited rewards for {rewards.credit_completed()} collections")
+        print(f"Done in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
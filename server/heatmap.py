@@ -0,0 +1,366 @@
+import gzip
+import logging
+import threading
+import zlib
+from collections import defaultdict
+from datetime import datetime
+import numpy as np
+from sqlalchemy import delete, func, insert, select, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import (
+    db, Collection, CollectionArchive, CollectionPoint, HeatmapContribution, HeatmapCursor, HeatmapLayer,
+    HeatmapPoint, SyncChange, ADDRESS_CHUNK_SIZE
+)
+from sync import pruned_through
+
+# Waste generation heatmap. Completed tonnage is binned on a fixed
+# HEATMAP_CELL_SIZE degree grid over Mumbai by the coordinates of the
+# collection point, giving one layer per day and waste type stored as a
+# zlib-compressed array of (cell, kg) for its non-empty cells. A request for
+# any date range and set of waste types concatenates the matching layers and
+# sums them with one bincount, without touching the collections.
+#
+# Layers follow the collections entries of the sync log the same way the
+# rewards crediting pass does: heatmap_contributions holds what each
+# collection last added, and a refresh takes the old contribution out of
+# its layer and adds the new one with np.add.at for every collection changed
+# since the cursor. Archived collections keep their contribution.
+#
+# A collection's cell comes from the point at its address, so the
+# collection-points entries are followed too: heatmap_points holds the
+# address and cell each point was last applied with, and a point that was
+# registered, moved, re-addressed or deleted has every completed collection
+# at its old and new address re-derived. Sensor readings, which touch points
+# without moving them, cost one comparison each.
+
+HEATMAP_BOUNDS = (18.85, 72.75, 19.35, 73.05)  # south, west, north, east
+HEATMAP_CELL_SIZE = 0.0025  # degrees, roughly 275 m
+HEATMAP_ROWS = int(round((HEATMAP_BOUNDS[2] - HEATMAP_BOUNDS[0]) / HEATMAP_CELL_SIZE))
+HEATMAP_COLUMNS = int(round((HEATMAP_BOUNDS[3] - HEATMAP_BOUNDS[1]) / HEATMAP_CELL_SIZE))
+HEATMAP_CELLS = HEATMAP_ROWS * HEATMAP_COLUMNS
+
+# One non-empty cell of a stored layer
+LAYER_DTYPE = np.dtype([('cell', '<u4'), ('kg', '<f4')])
+
+REFRESH_BATCH_SIZE = 5000
+ID_CHUNK_SIZE = 500
+# Serializes refreshes across PostgreSQL workers
+ADVISORY_LOCK_KEY = 0x4845_4154
+
+logger = logging.getLogger(__name__)
+_refresh_lock = threading.Lock()
+
+
+# Row-major cell index on the heatmap grid, -1 outside it; works on scalars
+# and arrays
+def heatmap_cell(latitude, longitude):
+    south, west, _, _ = HEATMAP_BOUNDS
+    row = np.floor((np.asarray(latitude, dtype=float) - south) / HEATMAP_CELL_SIZE).astype(np.int64)
+    column = np.floor((np.asarray(longitude, dtype=float) - west) / HEATMAP_CELL_SIZE).astype(np.int64)
+    inside = (row >= 0) & (row < HEATMAP_ROWS) & (column >= 0) & (column < HEATMAP_COLUMNS)
+    return np.where(inside, row * HEATMAP_COLUMNS + column, -1)
+
+
+# Dense kg per cell to the stored sparse form
+def encode_weights(weights):
+    cells = np.flatnonzero(weights)
+    layer = np.empty(len(cells), dtype=LAYER_DTYPE)
+    layer['cell'] = cells
+    layer['kg'] = np.asarray(weights)[cells]
+    return zlib.compress(layer.tobytes())
+
+
+def decode_layer(data):
+    return np.frombuffer(zlib.decompress(data), dtype=LAYER_DTYPE)
+
+
+def decode_weights(data):
+    layer = decode_layer(data)
+    return np.bincount(layer['cell'], layer['kg'], minlength=HEATMAP_CELLS)
+
+
+def _layer_upsert(rows):
+    table = HeatmapLayer.__table__
+    dialect_insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['day', 'waste_type'],
+        set_={name: statement.excluded[name] for name in ('weights', 'total_kg', 'collections', 'updated_at')}
+    )
+    db.session.execute(statement, rows)
+
+
+def _point_locations(addresses):
+    addresses = list(addresses)
+    locations = {}
+    for start in range(0, len(addresses), ADDRESS_CHUNK_SIZE):
+        for address, latitude, longitude in db.session.query(
+            CollectionPoint.address, CollectionPoint.latitude, CollectionPoint.longitude
+        ).filter(CollectionPoint.address.in_(addresses[start:start + ADDRESS_CHUNK_SIZE])):
+            locations.setdefault(address, (latitude, longitude))
+    return locations
+
+
+def _select_in(columns, key, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield from db.session.execute(select(*columns).where(key.in_(ids[start:start + ID_CHUNK_SIZE])))
+
+
+def _collection_rows(ids):
+    rows = {}
+    for model in (Collection, CollectionArchive):
+        # Archived collections left the hot table without a sync tombstone
+        columns = [model.id, model.location, model.date_time, model.waste_type, model.status, model.waste_collected]
+        for row in _select_in(columns, model.id, [id for id in ids if id not in rows]):
+            rows[row.id] = row
+    return rows
+
+
+# (day, waste type, cell, kg) a collection adds to the heatmap, or None
+def _contribution(row, locations):
+    if row is None or row.status != 'completed' or not row.waste_collected or row.location not in locations:
+        return None
+    cell = int(heatmap_cell(*locations[row.location]))
+    if cell < 0:
+        return None
+    return (row.date_time.date(), (row.waste_type or '').lower(), cell, float(row.waste_collected))
+
+
+def _read_cursor():
+    return db.session.execute(select(HeatmapCursor.seq).where(HeatmapCursor.id == 1)).scalar()
+
+
+def _write_cursor(seq):
+    if db.session.execute(update(HeatmapCursor).where(HeatmapCursor.id == 1).values(seq=seq)).rowcount == 0:
+        db.session.execute(insert(HeatmapCursor), [{'id': 1, 'seq': seq}])
+
+
+# Bins every completed collection again, one vectorized pass per layer
+def rebuild_heatmap(head=None):
+    if head is None:
+        head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+    db.session.execute(delete(HeatmapLayer))
+    db.session.execute(delete(HeatmapContribution))
+    db.session.execute(delete(HeatmapPoint))
+    locations = {}
+    points = []
+    for id, address, latitude, longitude in db.session.query(
+        CollectionPoint.id, CollectionPoint.address, CollectionPoint.latitude, CollectionPoint.longitude
+    ):
+        locations.setdefault(address, (latitude, longitude))
+        points.append({'point_id': id, 'address': address, 'cell': int(heatmap_cell(latitude, longitude))})
+    if points:
+        db.session.execute(insert(HeatmapPoint.__table__), points)
+
+    contributions = []
+    for model in (Collection, CollectionArchive):
+        for row in db.session.execute(select(
+            model.id, model.location, model.date_time, model.waste_type, model.status, model.waste_collected
+        ).where(model.status == 'completed', model.waste_collected > 0)):
+            contribution = _contribution(row, locations)
+            if contribution:
+                contributions.append((row.id, *contribution))
+    if contributions:
+        db.session.execute(insert(HeatmapContribution.__table__), [
+            {'collection_id': id, 'day': day, 'waste_type': waste_type, 'cell': cell, 'kg': kg}
+            for id, day, waste_type, cell, kg in contributions
+        ])
+        layers = sorted({(day, waste_type) for _, day, waste_type, _, _ in contributions})
+        layer_index = {layer: index for index, layer in enumerate(layers)}
+        groups = np.array([layer_index[(day, waste_type)] for _, day, waste_type, _, _ in contributions])
+        cells = np.array([cell for _, _, _, cell, _ in contributions], dtype=np.int64)
+        kg = np.array([kg for _, _, _, _, kg in contributions])
+        order = np.argsort(groups, kind='stable')
+        bounds = np.searchsorted(groups[order], np.arange(len(layers) + 1))
+        now = datetime.utcnow()
+        rows = []
+        for index, (day, waste_type) in enumerate(layers):
+            members = order[bounds[index]:bounds[index + 1]]
+            weights = np.bincount(cells[members], kg[members], minlength=HEATMAP_CELLS)
+            rows.append({'day': day, 'waste_type': waste_type, 'weights': encode_weights(weights),
+                         'total_kg': float(kg[members].sum()), 'collections': len(members), 'updated_at': now})
+        db.session.execute(insert(HeatmapLayer.__table__), rows)
+    _write_cursor(head)
+    db.session.commit()
+    return len(contributions)
+
+
+def _apply_changes(changes):
+    by_layer = defaultdict(list)
+    for day, waste_type, cell, kg, count in changes:
+        by_layer[(day, waste_type)].append((cell, kg, count))
+    table = HeatmapLayer.__table__
+    layers = {}
+    for day, waste_type in by_layer:
+        layer = db.session.execute(select(table).where(table.c.day == day, table.c.waste_type == waste_type)).first()
+        if layer is not None:
+            layers[(day, waste_type)] = layer
+    rows = []
+    now = datetime.utcnow()
+    for key, entries in by_layer.items():
+        layer = layers.get(key)
+        weights = decode_weights(layer.weights) if layer else np.zeros(HEATMAP_CELLS)
+        cells = np.array([cell for cell, _, _ in entries], dtype=np.int64)
+        kg = np.array([kg for _, kg, _ in entries])
+        np.add.at(weights, cells, kg)
+        # Float32 storage leaves crumbs where a collection was taken out
+        weights[weights < 1e-3] = 0.0
+        collections = (layer.collections if layer else 0) + sum(count for _, _, count in entries)
+        total_kg = (layer.total_kg if layer else 0.0) + float(kg.sum())
+        rows.append({'day': key[0], 'waste_type': key[1], 'weights': encode_weights(weights),
+                     'total_kg': max(total_kg, 0.0), 'collections': collections, 'updated_at': now})
+    if rows:
+        _layer_upsert(rows)
+        db.session.execute(delete(table).where(table.c.collections <= 0))
+
+
+# Records the new state of the points whose address or cell changed since
+# they were last applied. Returns the ids of the completed collections at
+# their old and new addresses.
+def _moved_points(point_ids):
+    current = {row.id: (row.address, int(heatmap_cell(row.latitude, row.longitude))) for row in _select_in(
+        [CollectionPoint.id, CollectionPoint.address, CollectionPoint.latitude, CollectionPoint.longitude],
+        CollectionPoint.id, point_ids
+    )}
+    applied = {row.point_id: (row.address, row.cell) for row in _select_in(
+        HeatmapPoint.__table__.c, HeatmapPoint.point_id, point_ids
+    )}
+    moved = [id for id in point_ids if current.get(id) != applied.get(id)]
+    if not moved:
+        return []
+
+    table = HeatmapPoint.__table__
+    for start in range(0, len(moved), ID_CHUNK_SIZE):
+        db.session.execute(delete(table).where(table.c.point_id.in_(moved[start:start + ID_CHUNK_SIZE])))
+    rows = [{'point_id': id, 'address': current[id][0], 'cell': current[id][1]} for id in moved if id in current]
+    if rows:
+        db.session.execute(insert(table), rows)
+
+    addresses = sorted({state[0] for id in moved for state in (current.get(id), applied.get(id)) if state})
+    ids = []
+    for model in (Collection, CollectionArchive):
+        for start in range(0, len(addresses), ADDRESS_CHUNK_SIZE):
+            ids += db.session.execute(select(model.id).where(
+                model.location.in_(addresses[start:start + ADDRESS_CHUNK_SIZE]), model.status == 'completed'
+            )).scalars().all()
+    return ids
+
+
+# Applies the collection and collection point changes among one batch of
+# sync log entries after seq, up to head. Returns the last seq read.
+def _refresh_batch(after, head):
+    entries = db.session.execute(
+        select(SyncChange.seq, SyncChange.resource, SyncChange.record_id, SyncChange.deleted).where(
+            SyncChange.seq > after, SyncChange.seq <= head,
+            SyncChange.resource.in_(['collections', 'collection-points'])
+        ).order_by(SyncChange.seq).limit(REFRESH_BATCH_SIZE)
+    ).all()
+    through = entries[-1].seq if len(entries) == REFRESH_BATCH_SIZE else head
+    ids = [entry.record_id for entry in entries if entry.resource == 'collections']
+    deleted = {entry.record_id for entry in entries if entry.resource == 'collections' and entry.deleted}
+    seen = set(ids)
+    ids += [id for id in _moved_points(
+        [entry.record_id for entry in entries if entry.resource == 'collection-points']
+    ) if id not in seen and id not in deleted]
+    rows = _collection_rows([id for id in ids if id not in deleted])
+    locations = _point_locations({row.location for row in rows.values() if row.status == 'completed'})
+    applied = {row.collection_id: row for row in _select_in(
+        HeatmapContribution.__table__.c, HeatmapContribution.collection_id, ids
+    )}
+
+    changes, removed, added = [], [], []
+    for id in ids:
+        if id not in deleted and id not in rows:
+            continue
+        previous = applied.get(id)
+        old = (previous.day, previous.waste_type, previous.cell, previous.kg) if previous else None
+        new = _contribution(rows.get(id), locations)
+        if old == new:
+            continue
+        if old is not None:
+            day, waste_type, cell, kg = old
+            changes.append((day, waste_type, cell, -kg, -1))
+            removed.append(id)
+        if new is not None:
+            day, waste_type, cell, kg = new
+            changes.append((day, waste_type, cell, kg, 1))
+            added.append({'collection_id': id, 'day': day, 'waste_type': waste_type, 'cell': cell, 'kg': kg})
+
+    _apply_changes(changes)
+    for start in range(0, len(removed), ID_CHUNK_SIZE):
+        db.session.execute(delete(HeatmapContribution).where(
+            HeatmapContribution.collection_id.in_(removed[start:start + ID_CHUNK_SIZE])
+        ))
+    if added:
+        db.session.execute(insert(HeatmapContribution.__table__), added)
+    _write_cursor(through)
+    return through
+
+
+# Brings the layers up to date with the sync log, committing once per batch
+def refresh_heatmap():
+    with _refresh_lock:
+        head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+        after = _read_cursor()
+        if after is None or after < pruned_through():
+            logger.info('Rebuilding waste heatmap')
+            rebuild_heatmap(head)
+            return
+        while after < head:
+            try:
+                after = _refresh_batch(after, head)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            if db.engine.dialect.name == 'postgresql' and after < head:
+                db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+        db.session.rollback()
+
+
+# Sum of the layers from start (inclusive) to end (exclusive) dates for the
+# waste types, or all of them. Returns (kg per cell, total kg, collections).
+def heatmap_grid(start=None, end=None, waste_types=None):
+    refresh_heatmap()
+    query = select(HeatmapLayer.weights, HeatmapLayer.total_kg, HeatmapLayer.collections)
+    if start:
+        query = query.where(HeatmapLayer.day >= start)
+    if end:
+        query = query.where(HeatmapLayer.day < end)
+    if waste_types:
+        query = query.where(HeatmapLayer.waste_type.in_([waste_type.lower() for waste_type in waste_types]))
+    layers = [np.empty(0, dtype=LAYER_DTYPE)]
+    total_kg = 0.0
+    collections = 0
+    for weights, layer_kg, layer_collections in db.session.execute(query):
+        layers.append(decode_layer(weights))
+        total_kg += layer_kg
+        collections += layer_collections
+    cells = np.concatenate(layers)
+    grid = np.bincount(cells['cell'], cells['kg'], minlength=HEATMAP_CELLS)
+    return grid.astype('<f4'), total_kg, collections
+
+
+def grid_metadata():
+    south, west, north, east = HEATMAP_BOUNDS
+    return {'bounds': {'south': south, 'west': west, 'north': north, 'east': east},
+            'cell_size': HEATMAP_CELL_SIZE, 'rows': HEATMAP_ROWS, 'columns': HEATMAP_COLUMNS}
+
+
+# Non-empty cells as [latitude, longitude, kg] at the cell middle
+def grid_points(grid):
+    south, west, _, _ = HEATMAP_BOUNDS
+    cells = np.flatnonzero(grid)
+    rows, columns = np.divmod(cells, HEATMAP_COLUMNS)
+    latitudes = np.round(south + (rows + 0.5) * HEATMAP_CELL_SIZE, 5)
+    longitudes = np.round(west + (columns + 0.5) * HEATMAP_CELL_SIZE, 5)
+    return [[float(lat), float(lon), round(float(kg), 2)]
+            for lat, lon, kg in zip(latitudes, longitudes, grid[cells])]
+
+
+def gzip_grid(grid):
+    return gzip.compress(np.asarray(grid, dtype='<f4').tobytes(), compresslevel=6)
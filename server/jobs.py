@@ -0,0 +1,454 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from functools import partial
+from flask import current_app
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from models import db, Job
+import analytics
+import rewards
+from allocation import allocate_day
+from archive import archive_collections
+from export import FORMATS, check_format, export_collections, filename as export_filename
+from heatmap import rebuild_heatmap
+from map_clusters import rebuild_clusters
+from statistics_rollup import rebuild_statistics, read_statistics
+
+# Background jobs for work too slow for a request: exports, reports and the
+# maintenance passes that otherwise only run from the CLI. Jobs are rows in
+# the jobs table, so they survive restarts and any process can report on
+# them; a dispatcher thread claims queued rows with a guarded UPDATE and runs
+# them on a pool of worker processes, each with its own app and database
+# connections, so a long export never holds the GIL of a web worker.
+#
+# Submitting is idempotent while a job is live: the key is a hash of the kind
+# and its normalised parameters, a partial unique index allows one queued job
+# per key, and a second identical submission gets the queued or running job
+# back instead of queueing the same work twice. Follow-up kinds, the passes
+# that catch up with the sync log, only coalesce with a queued job: a running
+# pass may have read the log before the write that submitted it.
+
+POLL_SECONDS = 2
+STALE_JOB_SECONDS = 6 * 60 * 60
+JOB_RETENTION_DAYS = 7
+LIVE_STATUSES = ('queued', 'running')
+FINISHED_STATUSES = ('succeeded', 'failed', 'cancelled')
+DEFAULT_JOB_LIMIT = 50
+MAX_JOB_LIMIT = 500
+ID_CHUNK_SIZE = 500
+
+JobKind = namedtuple('JobKind', ['function', 'check', 'follow_up'])
+JOB_KINDS = {}
+
+logger = logging.getLogger(__name__)
+
+
+def _no_params(params):
+    return {}
+
+
+# Registers a job kind. check(params) validates the submitted parameters and
+# returns them normalised, raising ValueError for bad input at submit time.
+def job_kind(name, check=None, follow_up=False):
+    def register(function):
+        JOB_KINDS[name] = JobKind(function, check or _no_params, follow_up)
+        return function
+    return register
+
+
+def job_key(kind, params):
+    return hashlib.sha256(json.dumps([kind, params], sort_keys=True).encode()).hexdigest()
+
+
+def result_file(job_id):
+    return os.path.join(current_app.config['JOB_RESULTS_DIR'], f'job-{job_id}')
+
+
+def _flag(value):
+    return value is True or str(value).lower() in ('1', 'true', 'yes')
+
+
+def _iso_datetime(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(str(value)).isoformat()
+    except ValueError:
+        raise ValueError(f'Invalid {name}: expected an ISO date or datetime')
+
+
+EXPORT_FILTERS = ['status', 'waste_type', 'assigned_team', 'location', 'area']
+
+
+def _export_params(params):
+    format = params.get('format', 'csv')
+    check_format(format)
+    normalised = {'format': format, 'gzip': _flag(params.get('gzip', False))}
+    for name in ('start', 'end'):
+        if params.get(name):
+            normalised[name] = _iso_datetime(params, name)
+    for name in EXPORT_FILTERS:
+        if params.get(name):
+            normalised[name] = str(params[name])
+    if _flag(params.get('archived', False)):
+        normalised['archived'] = 'true'
+    return normalised
+
+
+# Writes the export next to the other results and returns what the result
+# endpoint needs to serve it
+@job_kind('export', _export_params)
+def _export(job):
+    args = dict(job.params)
+    format, compress = args.pop('format'), args.pop('gzip')
+    path = result_file(job.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    size = 0
+    with open(path + '.part', 'wb') as file:
+        for chunk in export_collections(args, format, compress):
+            file.write(chunk)
+            size += len(chunk)
+    os.replace(path + '.part', path)
+    return {
+        'filename': export_filename(format, compress),
+        'mimetype': 'application/gzip' if compress else FORMATS[format][0],
+        'bytes': size,
+    }
+
+
+def _report_params(params):
+    bucket = params.get('bucket', 'month')
+    if bucket not in analytics.BUCKETS:
+        raise ValueError(f"Invalid bucket: expected one of {', '.join(analytics.BUCKETS)}")
+    group_by = params.get('group_by') or ['assigned_team']
+    if isinstance(group_by, str):
+        group_by = [field for field in group_by.split(',') if field]
+    unknown = [field for field in group_by if field not in analytics.GROUP_FIELDS]
+    if unknown:
+        raise ValueError(f"Invalid group_by: {', '.join(unknown)}")
+    return {
+        'bucket': bucket,
+        'group_by': list(group_by),
+        'start': _iso_datetime(params, 'start'),
+        'end': _iso_datetime(params, 'end'),
+    }
+
+
+@job_kind('report', _report_params)
+def _report(job):
+    params = job.params
+    start = datetime.fromisoformat(params['start']) if params['start'] else None
+    end = datetime.fromisoformat(params['end']) if params['end'] else None
+    rows = analytics.report_rows(params['bucket'], params['group_by'], start, end)
+    return {'group_by': params['group_by'], 'rows': rows}
+
+
+@job_kind('statistics')
+def _statistics(job):
+    rebuild_statistics()
+    db.session.commit()
+    return read_statistics()
+
+
+@job_kind('credit-rewards', follow_up=True)
+def _credit_rewards(job):
+    return {'credited': rewards.credit_completed()}
+
+
+def _allocation_params(params):
+    try:
+        day = date.fromisoformat(str(params['date'])) if params.get('date') else date.today()
+    except ValueError:
+        raise ValueError('Invalid date: expected an ISO date')
+    return {'date': day.isoformat(), 'full': _flag(params.get('full', False))}
+
+
+@job_kind('allocate-waste', _allocation_params)
+def _allocate_waste(job):
+    return allocate_day(date.fromisoformat(job.params['date']), job.params['full'])
+
+
+def _archive_params(params):
+    horizon_days = params.get('horizon_days') or current_app.config['ARCHIVE_HORIZON_DAYS']
+    try:
+        horizon_days = int(horizon_days)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid horizon_days: expected a number of days')
+    return {'horizon_days': horizon_days}
+
+
+@job_kind('archive-collections', _archive_params)
+def _archive_collections(job):
+    moved = archive_collections(job.params['horizon_days'])
+    return {'months': moved, 'archived': sum(moved.values())}
+
+
+@job_kind('rebuild-heatmap')
+def _rebuild_heatmap(job):
+    return {'collections': rebuild_heatmap()}
+
+
+@job_kind('rebuild-map-clusters')
+def _rebuild_map_clusters(job):
+    return {'points': rebuild_clusters()}
+
+
+def _live_job(key, statuses=LIVE_STATUSES):
+    return Job.query.filter(Job.key == key, Job.status.in_(statuses)).order_by(Job.id).first()
+
+
+# Queues a job, or returns the live job with the same kind and parameters.
+# Returns (job, coalesced).
+def submit(kind, params=None):
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Invalid kind: expected one of {', '.join(JOB_KINDS)}")
+    params = JOB_KINDS[kind].check(params or {})
+    key = job_key(kind, params)
+    statuses = ('queued',) if JOB_KINDS[kind].follow_up else LIVE_STATUSES
+    job = _live_job(key, statuses)
+    if job is not None:
+        return job, True
+    job = Job(kind=kind, key=key, params=params)
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Lost the race to an identical submission
+        db.session.rollback()
+        job = _live_job(key, ('queued',))
+        if job is None:
+            raise
+        return job, True
+    dispatcher.wake()
+    return job, False
+
+
+# For write handlers: queues a follow-up pass without failing the write. A
+# failed submission is covered by the next write's.
+def submit_follow_up(kind):
+    try:
+        return submit(kind)[0]
+    except Exception:
+        db.session.rollback()
+        logger.exception('Queueing a %s job failed', kind)
+        return None
+
+
+# Cancels a queued job. Returns False when a worker claimed it first.
+def cancel(job_id):
+    table = Job.__table__
+    cancelled = db.session.execute(
+        update(table).where(table.c.id == job_id, table.c.status == 'queued')
+        .values(status='cancelled', finished_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return bool(cancelled)
+
+
+def remove(job):
+    path = result_file(job.id)
+    if os.path.exists(path):
+        os.remove(path)
+    db.session.delete(job)
+    db.session.commit()
+
+
+# Deletes finished jobs and their result files after the retention period.
+# Returns the number of jobs deleted.
+def prune_jobs(days=JOB_RETENTION_DAYS, now=None):
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    ids = [row.id for row in db.session.query(Job.id).filter(
+        Job.status.in_(FINISHED_STATUSES), Job.finished_at < cutoff
+    )]
+    for job_id in ids:
+        path = result_file(job_id)
+        if os.path.exists(path):
+            os.remove(path)
+    if ids:
+        table = Job.__table__
+        for start in range(0, len(ids), ID_CHUNK_SIZE):
+            db.session.execute(delete(table).where(table.c.id.in_(ids[start:start + ID_CHUNK_SIZE])))
+        db.session.commit()
+    return len(ids)
+
+
+def _finish(job_id, status, result=None, error=None):
+    table = Job.__table__
+    # Round-trip through JSON so dates and numpy scalars are stored as text
+    # and numbers rather than failing the whole job
+    result = json.loads(json.dumps(result, default=str)) if result is not None else None
+    db.session.execute(
+        update(table).where(table.c.id == job_id, table.c.status == 'running')
+        .values(status=status, result=result, error=error, finished_at=datetime.utcnow())
+    )
+    db.session.commit()
+
+
+# Runs a claimed job in the current app context
+def run_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.status != 'running':
+        return
+    try:
+        result = JOB_KINDS[job.kind].function(job)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Job %d (%s) failed', job_id, job.kind)
+        _finish(job_id, 'failed', error=f'{type(e).__name__}: {e}')
+        return
+    _finish(job_id, 'succeeded', result=result)
+
+
+_worker_app = None
+
+
+def _init_worker(config_name):
+    global _worker_app
+    from app import create_app
+    _worker_app = create_app(config_name)
+
+
+def _run_in_worker(job_id):
+    with _worker_app.app_context():
+        try:
+            run_job(job_id)
+        finally:
+            db.session.remove()
+
+
+class Dispatcher:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._app = None
+        self._workers = 0
+        self._thread = None
+        self._pool = None
+        self._running = set()
+
+    def wake(self):
+        self._wake.set()
+
+    # Starts the dispatcher thread once per process
+    def start(self, app, workers):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._app, self._workers = app, workers
+            self._thread = threading.Thread(target=self._loop, name='job-dispatcher', daemon=True)
+            self._thread.start()
+
+    # Dispatches in the calling thread until interrupted, for flask run-jobs
+    def run(self, app, workers):
+        self._app, self._workers = app, workers
+        try:
+            self._loop()
+        finally:
+            with self._lock:
+                pool, self._pool = self._pool, None
+            if pool is not None:
+                pool.shutdown(wait=True)
+
+    def _loop(self):
+        while True:
+            try:
+                with self._app.app_context():
+                    self._dispatch()
+            except Exception:
+                logger.exception('Job dispatch failed')
+            self._wake.wait(POLL_SECONDS)
+            self._wake.clear()
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    self._workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker, initargs=(self._app.config['APP_CONFIG_NAME'],),
+                )
+            return self._pool
+
+    def _dispatch(self):
+        self._fail_stale()
+        while True:
+            with self._lock:
+                if len(self._running) >= self._workers:
+                    return
+            job_id = self._claim()
+            if job_id is None:
+                return
+            with self._lock:
+                self._running.add(job_id)
+            try:
+                future = self._executor().submit(_run_in_worker, job_id)
+            except Exception as e:
+                self._done(job_id, error=e)
+                raise
+            future.add_done_callback(partial(self._completed, job_id))
+
+    def _claim(self):
+        table = Job.__table__
+        try:
+            while True:
+                job_id = db.session.query(Job.id).filter(Job.status == 'queued').order_by(Job.id).limit(1).scalar()
+                if job_id is None:
+                    return None
+                claimed = db.session.execute(
+                    update(table).where(table.c.id == job_id, table.c.status == 'queued')
+                    .values(status='running', started_at=datetime.utcnow(), attempts=table.c.attempts + 1)
+                ).rowcount
+                db.session.commit()
+                if claimed:
+                    return job_id
+        finally:
+            db.session.remove()
+
+    # Running jobs nobody finished, e.g. because the process that ran them
+    # was killed
+    def _fail_stale(self):
+        table = Job.__table__
+        cutoff = datetime.utcnow() - timedelta(seconds=STALE_JOB_SECONDS)
+        db.session.execute(
+            update(table).where(table.c.status == 'running', table.c.started_at < cutoff)
+            .values(status='failed', error='Job timed out', finished_at=datetime.utcnow())
+        )
+        db.session.commit()
+
+    def _completed(self, job_id, future):
+        self._done(job_id, future.exception())
+
+    def _done(self, job_id, error=None):
+        with self._lock:
+            self._running.discard(job_id)
+            if isinstance(error, BrokenProcessPool) and self._pool is not None:
+                # A worker died; later jobs get a fresh pool
+                self._pool.shutdown(wait=False)
+                self._pool = None
+        if error is not None:
+            logger.error('Job %d worker failed: %s', job_id, error)
+            with self._app.app_context():
+                _finish(job_id, 'failed', error=f'Worker failed: {type(error).__name__}: {error}')
+                db.session.remove()
+        self._wake.set()
+
+
+dispatcher = Dispatcher()
+
+
+def init_app(app):
+    if not app.config.get('JOB_RESULTS_DIR'):
+        app.config['JOB_RESULTS_DIR'] = os.path.join(app.instance_path, 'jobs')
+    workers = app.config.get('JOB_WORKERS', 0)
+    if workers > 0:
+        @app.before_request
+        def start_job_dispatcher():
+            dispatcher.start(app, workers)
@@ -0,0 +1,65 @@
+import json
+from datetime import date, datetime
+from flask import Response, stream_with_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Streaming JSON arrays for list endpoints. Rows are pulled from the database
+# in batches (Core tuples with yield_per rather than ORM objects), encoded a
+# batch at a time and written out as a generator response, so peak memory is
+# one batch and the first bytes leave before the query has been exhausted.
+
+BATCH_SIZE = 1000
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(value):
+        return orjson.dumps(value, default=_default)
+else:
+    _encoder = json.JSONEncoder(separators=(',', ':'), default=_default)
+
+    def dumps(value):
+        return _encoder.encode(value).encode()
+
+
+# Yields the encoded JSON array for an iterable of dict rows, one chunk per
+# batch of rows
+def iter_json_array(rows, batch_size=BATCH_SIZE):
+    yield b'['
+    batch = []
+    first = True
+    for row in rows:
+        batch.append(dumps(row))
+        if len(batch) >= batch_size:
+            yield (b'' if first else b',') + b','.join(batch)
+            first = False
+            batch = []
+    if batch:
+        yield (b'' if first else b',') + b','.join(batch)
+    yield b']'
+
+
+# Lists of Core rows from a select, fetched batch_size at a time
+def iter_batches(session, statement, batch_size=BATCH_SIZE):
+    result = session.execute(statement.execution_options(yield_per=batch_size))
+    yield from result.partitions()
+
+
+def iter_rows(session, statement, batch_size=BATCH_SIZE):
+    for batch in iter_batches(session, statement, batch_size):
+        yield from batch
+
+
+def stream_json(rows, headers=None, batch_size=BATCH_SIZE):
+    # The request context is kept alive so the session can keep fetching
+    body = stream_with_context(iter_json_array(rows, batch_size))
+    return Response(body, mimetype='application/json', headers=headers)
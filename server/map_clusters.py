@@ -0,0 +1,292 @@
+import logging
+import math
+import threading
+from collections import defaultdict
+import numpy as np
+from sqlalchemy import bindparam, delete, func, insert, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, CollectionPoint, MapCluster, MapClusterCursor, MapClusterPoint, SyncChange
+from spatial import within_bbox
+from sync import pruned_through
+
+# Collection point marker clusters for the map. Every zoom level from 0 to
+# MAX_CLUSTER_ZOOM has a grid of CLUSTER_CELL_PX web mercator cells, and a
+# cell at one zoom is exactly four cells of the next, so the levels form a
+# hierarchy and a point's cell at every zoom follows from its cell at the
+# deepest one by a bit shift. Each non-empty cell is one map_clusters row of
+# running sums (count, coordinates, capacity, status counts), so a viewport
+# is an index range read that returns at most a few hundred rows however
+# many points there are.
+#
+# Clusters follow the collection-points entries of the sync log:
+# map_cluster_points holds the state last applied for every point, and a
+# refresh subtracts the old contribution and adds the new one for each point
+# changed since the cursor. A full rebuild only happens on first use or when
+# the log was reset or pruned past the cursor.
+
+MAX_CLUSTER_ZOOM = 16
+TILE_SIZE_PX = 256
+CLUSTER_CELL_PX = 64
+MAX_MERCATOR_LATITUDE = 85.05112878
+# Cells per axis at MAX_CLUSTER_ZOOM
+GRID_SIZE = (TILE_SIZE_PX // CLUSTER_CELL_PX) << MAX_CLUSTER_ZOOM
+MAX_ZOOM = 22
+MAX_CLUSTERS = 5000
+REFRESH_BATCH_SIZE = 5000
+ID_CHUNK_SIZE = 500
+STATUS_COLUMNS = {'Active': 'active', 'Maintenance': 'maintenance', 'Full': 'full'}
+SUM_COLUMNS = ['count', 'latitude_sum', 'longitude_sum', 'capacity_sum', 'active', 'maintenance', 'full', 'id_sum']
+# Serializes refreshes across PostgreSQL workers
+ADVISORY_LOCK_KEY = 0x4D41_5043
+
+logger = logging.getLogger(__name__)
+_refresh_lock = threading.Lock()
+
+
+def _world_xy(latitude, longitude):
+    latitude = np.clip(latitude, -MAX_MERCATOR_LATITUDE, MAX_MERCATOR_LATITUDE)
+    sine = np.sin(np.radians(latitude))
+    x = (np.asarray(longitude, dtype=float) + 180) / 360
+    y = 0.5 - np.log((1 + sine) / (1 - sine)) / (4 * math.pi)
+    return x, y
+
+
+# Cell at MAX_CLUSTER_ZOOM; works on scalars and arrays
+def _deepest_cell(latitude, longitude):
+    x, y = _world_xy(latitude, longitude)
+    return (np.clip((x * GRID_SIZE).astype(np.int64), 0, GRID_SIZE - 1),
+            np.clip((y * GRID_SIZE).astype(np.int64), 0, GRID_SIZE - 1))
+
+
+def cell_range(zoom, south, west, north, east):
+    shift = MAX_CLUSTER_ZOOM - zoom
+    (x0, x1), (y0, y1) = _deepest_cell(np.array([north, south]), np.array([west, east]))
+    return int(x0) >> shift, int(y0) >> shift, int(x1) >> shift, int(y1) >> shift
+
+
+def _state(row):
+    if row is None:
+        return None
+    return (row.latitude, row.longitude, row.capacity or 0.0, row.status)
+
+
+def _accumulate(deltas, point_id, state, sign):
+    latitude, longitude, capacity, status = state
+    x, y = (int(value) for value in _deepest_cell(latitude, longitude))
+    status_column = STATUS_COLUMNS.get(status)
+    for zoom in range(MAX_CLUSTER_ZOOM + 1):
+        shift = MAX_CLUSTER_ZOOM - zoom
+        delta = deltas[(zoom, x >> shift, y >> shift)]
+        delta['count'] += sign
+        delta['latitude_sum'] += sign * latitude
+        delta['longitude_sum'] += sign * longitude
+        delta['capacity_sum'] += sign * capacity
+        delta['id_sum'] += sign * point_id
+        if status_column:
+            delta[status_column] += sign
+
+
+def _apply_deltas(deltas):
+    table = MapCluster.__table__
+    rows = [
+        {'zoom': zoom, 'cell_x': x, 'cell_y': y, **{name: delta[name] for name in SUM_COLUMNS}}
+        for (zoom, x, y), delta in deltas.items() if any(delta.values())
+    ]
+    if not rows:
+        return
+    dialect_insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['zoom', 'cell_x', 'cell_y'],
+        set_={name: table.c[name] + statement.excluded[name] for name in SUM_COLUMNS}
+    )
+    db.session.execute(statement, rows)
+    emptied = [{'b_zoom': row['zoom'], 'b_x': row['cell_x'], 'b_y': row['cell_y']}
+               for row in rows if row['count'] < 0]
+    if emptied:
+        db.session.execute(delete(table).where(
+            table.c.zoom == bindparam('b_zoom'), table.c.cell_x == bindparam('b_x'),
+            table.c.cell_y == bindparam('b_y'), table.c.count <= 0
+        ), emptied)
+
+
+def _read_cursor():
+    return db.session.execute(select(MapClusterCursor.seq).where(MapClusterCursor.id == 1)).scalar()
+
+
+def _write_cursor(seq):
+    if db.session.execute(update(MapClusterCursor).where(MapClusterCursor.id == 1).values(seq=seq)).rowcount == 0:
+        db.session.execute(insert(MapClusterCursor), [{'id': 1, 'seq': seq}])
+
+
+def _select_in(columns, key, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield from db.session.execute(select(*columns).where(key.in_(ids[start:start + ID_CHUNK_SIZE])))
+
+
+# Recomputes every cluster from the point table, grouping one zoom level at
+# a time with numpy
+def rebuild_clusters(head=None):
+    if head is None:
+        head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+    points = db.session.execute(select(
+        CollectionPoint.id, CollectionPoint.latitude, CollectionPoint.longitude,
+        CollectionPoint.capacity, CollectionPoint.status
+    )).all()
+    db.session.execute(delete(MapCluster))
+    db.session.execute(delete(MapClusterPoint))
+    if points:
+        ids = np.array([point.id for point in points], dtype=np.int64)
+        latitudes = np.array([point.latitude for point in points], dtype=float)
+        longitudes = np.array([point.longitude for point in points], dtype=float)
+        capacities = np.array([point.capacity or 0.0 for point in points], dtype=float)
+        statuses = {column: np.array([STATUS_COLUMNS.get(point.status) == column for point in points])
+                    for column in STATUS_COLUMNS.values()}
+        x, y = _deepest_cell(latitudes, longitudes)
+        rows = []
+        for zoom in range(MAX_CLUSTER_ZOOM + 1):
+            shift = MAX_CLUSTER_ZOOM - zoom
+            keys, inverse = np.unique(((x >> shift) << 32) | (y >> shift), return_inverse=True)
+            sums = {
+                'count': np.bincount(inverse), 'latitude_sum': np.bincount(inverse, latitudes),
+                'longitude_sum': np.bincount(inverse, longitudes),
+                'capacity_sum': np.bincount(inverse, capacities), 'id_sum': np.bincount(inverse, ids),
+                **{column: np.bincount(inverse, mask) for column, mask in statuses.items()},
+            }
+            for index, key in enumerate(keys.tolist()):
+                row = {'zoom': zoom, 'cell_x': key >> 32, 'cell_y': key & 0xFFFFFFFF}
+                for name in SUM_COLUMNS:
+                    value = sums[name][index]
+                    row[name] = float(value) if name.endswith('_sum') and name != 'id_sum' else int(round(value))
+                rows.append(row)
+        db.session.execute(insert(MapCluster.__table__), rows)
+        db.session.execute(insert(MapClusterPoint.__table__), [
+            {'point_id': point.id, 'latitude': point.latitude, 'longitude': point.longitude,
+             'capacity': point.capacity or 0.0, 'status': point.status}
+            for point in points
+        ])
+    _write_cursor(head)
+    db.session.commit()
+    return len(points)
+
+
+# Applies the collection point changes among one batch of sync log entries
+# after seq, up to head. Returns the last seq read.
+def _refresh_batch(after, head):
+    entries = db.session.execute(
+        select(SyncChange.seq, SyncChange.record_id, SyncChange.deleted).where(
+            SyncChange.seq > after, SyncChange.seq <= head, SyncChange.resource == 'collection-points'
+        ).order_by(SyncChange.seq).limit(REFRESH_BATCH_SIZE)
+    ).all()
+    through = entries[-1].seq if len(entries) == REFRESH_BATCH_SIZE else head
+    ids = [entry.record_id for entry in entries]
+    deleted = {entry.record_id for entry in entries if entry.deleted}
+    current = {row.id: row for row in _select_in(
+        [CollectionPoint.id, CollectionPoint.latitude, CollectionPoint.longitude,
+         CollectionPoint.capacity, CollectionPoint.status],
+        CollectionPoint.id, [id for id in ids if id not in deleted]
+    )}
+    applied = {row.point_id: row for row in _select_in(
+        MapClusterPoint.__table__.c, MapClusterPoint.point_id, ids
+    )}
+
+    deltas = defaultdict(lambda: dict.fromkeys(SUM_COLUMNS, 0))
+    removed, added = [], []
+    for id in ids:
+        old, new = _state(applied.get(id)), _state(current.get(id))
+        if old == new:
+            continue
+        if old is not None:
+            _accumulate(deltas, id, old, -1)
+            removed.append(id)
+        if new is not None:
+            _accumulate(deltas, id, new, 1)
+            latitude, longitude, capacity, status = new
+            added.append({'point_id': id, 'latitude': latitude, 'longitude': longitude,
+                          'capacity': capacity, 'status': status})
+
+    _apply_deltas(deltas)
+    for start in range(0, len(removed), ID_CHUNK_SIZE):
+        db.session.execute(delete(MapClusterPoint).where(
+            MapClusterPoint.point_id.in_(removed[start:start + ID_CHUNK_SIZE])
+        ))
+    if added:
+        db.session.execute(insert(MapClusterPoint.__table__), added)
+    _write_cursor(through)
+    return through
+
+
+# Brings the clusters up to date with the sync log, committing once per
+# batch
+def refresh_clusters():
+    with _refresh_lock:
+        head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+        if db.engine.dialect.name == 'postgresql':
+            db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+        after = _read_cursor()
+        if after is None or after < pruned_through():
+            logger.info('Rebuilding map clusters')
+            rebuild_clusters(head)
+            return
+        while after < head:
+            try:
+                after = _refresh_batch(after, head)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            if db.engine.dialect.name == 'postgresql' and after < head:
+                db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+        db.session.rollback()
+
+
+def _cluster_dict(zoom, row):
+    count = row['count']
+    return {
+        'id': f"{zoom}/{row['cell_x']}/{row['cell_y']}",
+        'latitude': round(row['latitude_sum'] / count, 6),
+        'longitude': round(row['longitude_sum'] / count, 6),
+        'count': count,
+        'point_id': int(row['id_sum']) if count == 1 else None,
+        'average_capacity': round(row['capacity_sum'] / count, 1),
+        'status_counts': {status: row[column] for status, column in STATUS_COLUMNS.items()},
+    }
+
+
+def _point_dict(point):
+    return {
+        'id': f'point/{point.id}',
+        'latitude': point.latitude,
+        'longitude': point.longitude,
+        'count': 1,
+        'point_id': point.id,
+        'average_capacity': round(point.capacity or 0.0, 1),
+        'status_counts': {status: int(point.status == status) for status in STATUS_COLUMNS},
+    }
+
+
+# Clusters intersecting the bbox at the zoom; past MAX_CLUSTER_ZOOM every
+# point is its own marker
+def clusters_in_bbox(south, west, north, east, zoom):
+    if zoom > MAX_CLUSTER_ZOOM:
+        points = within_bbox(CollectionPoint, south, west, north, east, limit=MAX_CLUSTERS + 1)
+        if len(points) > MAX_CLUSTERS:
+            raise ValueError('Too many points in bbox, zoom in or shrink the bbox')
+        return [_point_dict(point) for point in points]
+
+    refresh_clusters()
+    table = MapCluster.__table__
+    x0, y0, x1, y1 = cell_range(zoom, south, west, north, east)
+    if x0 <= x1:
+        columns = table.c.cell_x.between(x0, x1)
+    else:
+        # bbox crossing the antimeridian
+        columns = or_(table.c.cell_x >= x0, table.c.cell_x <= x1)
+    rows = db.session.execute(select(table).where(
+        table.c.zoom == zoom, columns, table.c.cell_y.between(y0, y1)
+    ).limit(MAX_CLUSTERS + 1)).all()
+    if len(rows) > MAX_CLUSTERS:
+        raise ValueError('Too many clusters in bbox, zoom out or shrink the bbox')
+    return [_cluster_dict(zoom, row._mapping) for row in rows]
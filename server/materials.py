@@ -0,0 +1,142 @@
+import re
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from models import db, RecyclingCenter, RecyclingCenterMaterial
+
+# Recycling center materials as an indexed mapping table. The free-text
+# materials list on each center is normalized to material slugs (E-waste,
+# "Electronics" and "ewaste" all become e-waste) and each slug is tagged with
+# the collection waste type it is sorted from, so "which centers take
+# electronic waste" is an index lookup instead of a JSON scan. ORM writes keep
+# the table current through the listeners below; Core updates of the materials
+# column call sync_center_materials.
+#
+# The legacy capacity string is also turned into a numeric daily intake when
+# throughput_kg_per_day is not given.
+
+MATERIAL_ALIASES = {
+    'ewaste': 'e-waste', 'e waste': 'e-waste', 'electronics': 'e-waste', 'electronic': 'e-waste',
+    'electronic waste': 'e-waste', 'battery': 'batteries',
+    'plastics': 'plastic', 'papers': 'paper', 'cardboard': 'paper', 'metals': 'metal',
+    'scrap metal': 'metal', 'scrap': 'metal', 'textile': 'textiles', 'clothes': 'textiles',
+    'organic waste': 'organic', 'food waste': 'organic', 'compost': 'organic',
+    'biomedical': 'medical', 'medical waste': 'medical', 'hazardous waste': 'hazardous',
+    'chemicals': 'hazardous', 'mixed': 'general', 'general waste': 'general', 'recyclables': 'recyclable',
+}
+MATERIAL_WASTE_TYPES = {
+    'paper': 'recyclable', 'plastic': 'recyclable', 'glass': 'recyclable', 'metal': 'recyclable',
+    'textiles': 'recyclable', 'recyclable': 'recyclable',
+    'e-waste': 'electronic', 'batteries': 'electronic',
+    'organic': 'organic', 'medical': 'medical', 'hazardous': 'hazardous', 'general': 'general',
+}
+# Daily intake assumed for the capacity levels offered by the center form
+CAPACITY_LEVELS_KG = {'low': 2000.0, 'medium': 10000.0, 'high': 25000.0}
+CAPACITY_UNITS_KG = {'kg': 1.0, 'kgs': 1.0, 't': 1000.0, 'ton': 1000.0, 'tons': 1000.0,
+                     'tonne': 1000.0, 'tonnes': 1000.0}
+ACTIVE_CENTER_STATUSES = ('active', 'open')
+
+AMOUNT_PATTERN = re.compile(r'^\s*([\d.]+)\s*([a-z]*)')
+
+
+def normalize_material(value):
+    slug = ' '.join(str(value).lower().replace('_', ' ').split())
+    slug = MATERIAL_ALIASES.get(slug, slug)
+    return slug.replace(' ', '-')
+
+
+def material_rows(center_id, materials):
+    slugs = {normalize_material(material) for material in materials or [] if str(material).strip()}
+    return [{'center_id': center_id, 'material': slug, 'waste_type': MATERIAL_WASTE_TYPES.get(slug)}
+            for slug in sorted(slugs)]
+
+
+def sync_center_materials(connection, center_id, materials):
+    table = RecyclingCenterMaterial.__table__
+    connection.execute(delete(table).where(table.c.center_id == center_id))
+    rows = material_rows(center_id, materials)
+    if rows:
+        connection.execute(insert(table), rows)
+
+
+# kg per day for "high", "5000", "12 tonnes"; None when unrecognised
+def parse_capacity(value):
+    if value is None:
+        return None
+    text = str(value).strip().lower()
+    if text in CAPACITY_LEVELS_KG:
+        return CAPACITY_LEVELS_KG[text]
+    match = AMOUNT_PATTERN.match(text)
+    if not match:
+        return None
+    try:
+        amount = float(match.group(1))
+    except ValueError:
+        return None
+    return amount * CAPACITY_UNITS_KG.get(match.group(2), 1.0)
+
+
+@event.listens_for(RecyclingCenter, 'before_insert')
+def _fill_throughput(mapper, connection, target):
+    if target.throughput_kg_per_day is None:
+        target.throughput_kg_per_day = parse_capacity(target.capacity)
+
+
+# A new capacity level replaces the throughput derived from the old one
+@event.listens_for(RecyclingCenter, 'before_update')
+def _update_throughput(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if attrs.capacity.history.has_changes() and not attrs.throughput_kg_per_day.history.has_changes():
+        throughput = parse_capacity(target.capacity)
+        if throughput is not None:
+            target.throughput_kg_per_day = throughput
+
+
+@event.listens_for(RecyclingCenter, 'after_insert')
+def _insert_materials(mapper, connection, target):
+    sync_center_materials(connection, target.id, target.materials)
+
+
+@event.listens_for(RecyclingCenter, 'after_update')
+def _update_materials(mapper, connection, target):
+    if inspect(target).attrs.materials.history.has_changes():
+        sync_center_materials(connection, target.id, target.materials)
+
+
+@event.listens_for(RecyclingCenter, 'after_delete')
+def _delete_materials(mapper, connection, target):
+    table = RecyclingCenterMaterial.__table__
+    connection.execute(delete(table).where(table.c.center_id == target.id))
+
+
+# Fills the mapping and numeric throughput for centers written before they
+# existed
+def backfill_center_materials():
+    mapped = select(RecyclingCenterMaterial.center_id).distinct()
+    centers = db.session.query(RecyclingCenter.id, RecyclingCenter.materials).filter(
+        RecyclingCenter.id.notin_(mapped)
+    ).all()
+    connection = db.session.connection()
+    for id, materials in centers:
+        sync_center_materials(connection, id, materials)
+    for id, capacity in db.session.query(RecyclingCenter.id, RecyclingCenter.capacity).filter(
+        RecyclingCenter.throughput_kg_per_day.is_(None)
+    ).all():
+        throughput = parse_capacity(capacity)
+        if throughput is not None:
+            db.session.execute(update(RecyclingCenter.__table__).where(
+                RecyclingCenter.__table__.c.id == id
+            ).values(throughput_kg_per_day=throughput))
+    db.session.commit()
+
+
+def active_center_filter():
+    return func.lower(RecyclingCenter.status).in_(ACTIVE_CENTER_STATUSES)
+
+
+# Ids of centers accepting a material slug or collection waste type
+def accepting_centers(material=None, waste_type=None):
+    query = select(RecyclingCenterMaterial.center_id).distinct()
+    if material:
+        query = query.where(RecyclingCenterMaterial.material == normalize_material(material))
+    if waste_type:
+        query = query.where(RecyclingCenterMaterial.waste_type == waste_type.lower())
+    return query
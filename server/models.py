@@ -1,8 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.orm import object_session
 from datetime import datetime
+from spatial import grid_cell
 
 db = SQLAlchemy()
 
+ACTIVE_COLLECTION_STATUSES = ['scheduled', 'in_progress']
+
+# SQLite caps the number of bound parameters per statement, so address
+# lookups are split into chunks of this size.
+ADDRESS_CHUNK_SIZE = 500
+
 class Collection(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     location = db.Column(db.String(200), nullable=False)
@@ -13,6 +22,18 @@ class Collection(db.Model):
     notes = db.Column(db.Text)
     waste_collected = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped on every update
+    user_id = db.Column(db.Integer, nullable=True, index=True)  # Citizen or raddiwala credited, see rewards.py
+
+    __table_args__ = (
+        # Serves the per-location last/next collection lookups
+        db.Index('ix_collection_location_status_date_time', 'location', 'status', 'date_time'),
+        # Keyset pagination on (date_time, id), optionally filtered
+        db.Index('ix_collection_date_time_id', 'date_time', 'id'),
+        db.Index('ix_collection_status_date_time_id', 'status', 'date_time', 'id'),
+        db.Index('ix_collection_waste_type_date_time_id', 'waste_type', 'date_time', 'id'),
+        db.Index('ix_collection_assigned_team_date_time_id', 'assigned_team', 'date_time', 'id'),
+    )
 
     def to_dict(self):
         return {
@@ -24,7 +45,9 @@ class Collection(db.Model):
             'status': self.status,
             'notes': self.notes,
             'waste_collected': self.waste_collected,
-            'created_at': self.created_at.isoformat()
+            'created_at': self.created_at.isoformat(),
+            'version': self.version,
+            'user_id': self.user_id
         }
 
 class CollectionPoint(db.Model):
@@ -39,40 +62,557 @@ class CollectionPoint(db.Model):
     last_collection = db.Column(db.DateTime, nullable=True)
     next_collection = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    grid_cell = db.Column(db.Integer, nullable=True, index=True)  # Spatial grid cell, see spatial.py
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped on every update
+
+    __table_args__ = (
+        # Collections reference points by address
+        db.Index('ix_collection_point_address', 'address'),
+    )
 
-    def get_active_collections(self):
-        return Collection.query.filter(
-            Collection.location == self.address,
-            Collection.status.in_(['scheduled', 'in_progress'])
-        ).order_by(Collection.date_time).all()
-
-    def update_collection_dates(self):
-        collections = Collection.query.filter(
-            Collection.location == self.address
-        ).order_by(Collection.date_time.desc()).all()
-        
-        completed_collections = [c for c in collections if c.status == 'completed']
-        if completed_collections:
-            self.last_collection = completed_collections[0].date_time
-        
-        future_collections = [c for c in collections 
-                            if c.status in ['scheduled', 'in_progress'] 
-                            and c.date_time > datetime.now()]
-        if future_collections:
-            self.next_collection = min(c.date_time for c in future_collections)
+    def to_dict(self, collection_dates=None):
+        if collection_dates is None:
+            collection_dates = resolve_collection_dates([self])
+        return serialize_point(self, collection_dates)
+
+
+class RecyclingCenter(db.Model):
+    __tablename__ = 'recycling_centers'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    address = db.Column(db.String(200), nullable=False)
+    phone = db.Column(db.String(20), nullable=False)
+    email = db.Column(db.String(120), nullable=False)
+    hours = db.Column(db.String(100), nullable=False)
+    materials = db.Column(db.JSON, nullable=False, default=list)
+    capacity = db.Column(db.String(20), nullable=False)  # low, medium, high or a free-text amount
+    throughput_kg_per_day = db.Column(db.Float, nullable=True)  # Daily intake limit, see materials.py
+    status = db.Column(db.String(20), nullable=False, default='active')
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    grid_cell = db.Column(db.Integer, nullable=True, index=True)  # Spatial grid cell, see spatial.py
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')  # Bumped on every update
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
-        self.update_collection_dates()
         return {
             'id': self.id,
             'name': self.name,
             'address': self.address,
-            'area': self.area,
-            'latitude': self.latitude,
-            'longitude': self.longitude,
+            'phone': self.phone,
+            'email': self.email,
+            'hours': self.hours,
+            'materials': self.materials,
             'capacity': self.capacity,
+            'throughput_kg_per_day': self.throughput_kg_per_day,
             'status': self.status,
-            'last_collection': self.last_collection.strftime('%Y-%m-%d') if self.last_collection else None,
-            'next_collection': self.next_collection.strftime('%Y-%m-%d') if self.next_collection else None,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+            'version': self.version
+        }
+
+
+# Normalized recycling center materials, one row per accepted material,
+# kept in step with RecyclingCenter.materials by materials.py
+class RecyclingCenterMaterial(db.Model):
+    __tablename__ = 'recycling_center_materials'
+    __table_args__ = (
+        db.Index('ix_recycling_center_materials_material', 'material', 'center_id'),
+        db.Index('ix_recycling_center_materials_waste_type', 'waste_type', 'center_id'),
+    )
+
+    center_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    material = db.Column(db.String(50), primary_key=True)
+    waste_type = db.Column(db.String(50), nullable=True)  # Collection.waste_type the material is sorted from
+
+
+class CapacityReading(db.Model):
+    __tablename__ = 'capacity_readings'
+
+    id = db.Column(db.Integer, primary_key=True)
+    point_id = db.Column(db.Integer, db.ForeignKey('collection_point.id'), nullable=False)
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    capacity = db.Column(db.Float, nullable=False)  # Fill level in percentage
+
+    __table_args__ = (
+        db.Index('ix_capacity_readings_point_id_recorded_at', 'point_id', 'recorded_at'),
+        db.Index('ix_capacity_readings_recorded_at', 'recorded_at'),
+        # The forecaster follows new readings by id, see fill_forecast.py
+        {'sqlite_autoincrement': True},
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'point_id': self.point_id,
+            'recorded_at': self.recorded_at.isoformat(),
+            'capacity': self.capacity
+        }
+
+# Keep the spatial grid cell in step with the coordinates on every ORM write
+@event.listens_for(CollectionPoint, 'before_insert')
+@event.listens_for(CollectionPoint, 'before_update')
+@event.listens_for(RecyclingCenter, 'before_insert')
+@event.listens_for(RecyclingCenter, 'before_update')
+def _update_grid_cell(mapper, connection, target):
+    target.grid_cell = grid_cell(target.latitude, target.longitude)
+
+
+# ORM updates bump the version that PATCH requests are checked against
+@event.listens_for(Collection, 'before_update')
+@event.listens_for(CollectionPoint, 'before_update')
+@event.listens_for(RecyclingCenter, 'before_update')
+def _bump_version(mapper, connection, target):
+    if object_session(target).is_modified(target, include_collections=False):
+        target.version = (target.version or 0) + 1
+
+
+class StatisticsRollup(db.Model):
+    __tablename__ = 'statistics_rollup'
+
+    # 'points', 'points_full' or 'waste:<waste type>'
+    name = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Float, nullable=False, default=0.0)
+
+
+# Crews that collections are assigned to by name, with the daily shift the
+# scheduler may fill, see scheduler.py
+class Team(db.Model):
+    __tablename__ = 'teams'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True)  # Matches Collection.assigned_team
+    max_stops = db.Column(db.Integer, nullable=False, default=30)  # Per shift
+    shift_start = db.Column(db.String(5), nullable=False, default='07:00')  # HH:MM
+    shift_end = db.Column(db.String(5), nullable=False, default='15:00')
+    depot_latitude = db.Column(db.Float, nullable=True)
+    depot_longitude = db.Column(db.Float, nullable=True)
+    active = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'max_stops': self.max_stops,
+            'shift_start': self.shift_start,
+            'shift_end': self.shift_end,
+            'depot_latitude': self.depot_latitude,
+            'depot_longitude': self.depot_longitude,
+            'active': self.active,
+            'created_at': self.created_at.isoformat()
+        }
+
+
+# Completed collections moved out of the hot table by archive.py, with the
+# same ids and columns
+class CollectionArchive(db.Model):
+    __tablename__ = 'collection_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    location = db.Column(db.String(200), nullable=False)
+    date_time = db.Column(db.DateTime, nullable=False)
+    waste_type = db.Column(db.String(50), nullable=False)
+    assigned_team = db.Column(db.String(100), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    notes = db.Column(db.Text)
+    waste_collected = db.Column(db.Float, default=0.0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    user_id = db.Column(db.Integer, nullable=True)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_collection_archive_date_time_id', 'date_time', 'id'),
+        db.Index('ix_collection_archive_location_date_time', 'location', 'date_time'),
+    )
+
+
+# Per day, location, waste type and team totals of archived collections,
+# which are all completed
+class CollectionArchiveSummary(db.Model):
+    __tablename__ = 'collection_archive_summary'
+
+    day = db.Column(db.Date, primary_key=True)
+    location = db.Column(db.String(200), primary_key=True)
+    waste_type = db.Column(db.String(50), primary_key=True)
+    assigned_team = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    waste_collected = db.Column(db.Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        db.Index('ix_collection_archive_summary_location_day', 'location', 'day'),
+    )
+
+
+class User(db.Model):
+    __tablename__ = 'users'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    phone = db.Column(db.String(20), nullable=True, unique=True)
+    email = db.Column(db.String(120), nullable=True, unique=True)
+    role = db.Column(db.String(20), nullable=False, default='citizen')  # citizen, raddiwala
+    area = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self, balance=None):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'phone': self.phone,
+            'email': self.email,
+            'role': self.role,
+            'area': self.area,
+            'created_at': self.created_at.isoformat(),
+            'rewards': balance.to_dict() if balance is not None else None
+        }
+
+
+# Append-only points ledger, see rewards.py. Credits are written once per
+# user per crediting batch; entries older than the retention period are
+# folded into reward_snapshots and deleted.
+class RewardLedger(db.Model):
+    __tablename__ = 'reward_ledger'
+    __table_args__ = (
+        db.Index('ix_reward_ledger_user_seq', 'user_id', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # credit, redemption, adjustment
+    points = db.Column(db.Integer, nullable=False)
+    collections = db.Column(db.Integer, nullable=False, default=0)
+    waste_collected = db.Column(db.Float, nullable=False, default=0.0)
+    note = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'seq': self.seq,
+            'kind': self.kind,
+            'points': self.points,
+            'collections': self.collections,
+            'waste_collected': self.waste_collected,
+            'note': self.note,
             'created_at': self.created_at.isoformat()
-        } 
\ No newline at end of file
+        }
+
+
+# Points each collection currently contributes, so a crediting pass that
+# sees the collection again only books the difference
+class CollectionReward(db.Model):
+    __tablename__ = 'collection_rewards'
+
+    collection_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    points = db.Column(db.Integer, nullable=False)
+    waste_collected = db.Column(db.Float, nullable=False, default=0.0)
+
+
+# Materialized per-user totals: the user's snapshot plus every ledger entry
+# after it, kept current by each write to the ledger
+class UserBalance(db.Model):
+    __tablename__ = 'user_balances'
+    __table_args__ = (
+        # Leaderboards read the top of these indexes, overall and per role
+        db.Index('ix_user_balances_leaderboard', 'lifetime_points', 'user_id'),
+        db.Index('ix_user_balances_role_leaderboard', 'role', 'lifetime_points', 'user_id'),
+    )
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # Copy of users.role so a per-role leaderboard does not join users
+    role = db.Column(db.String(20), nullable=False, default='citizen', server_default=db.text("'citizen'"))
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    lifetime_points = db.Column(db.Integer, nullable=False, default=0)  # Excludes redemptions
+    collections = db.Column(db.Integer, nullable=False, default=0)
+    waste_collected = db.Column(db.Float, nullable=False, default=0.0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'balance': self.balance,
+            'lifetime_points': self.lifetime_points,
+            'collections': self.collections,
+            'waste_collected': self.waste_collected,
+            'updated_at': self.updated_at.isoformat()
+        }
+
+
+# Totals of compacted ledger entries, through_seq being the last one folded in
+class RewardSnapshot(db.Model):
+    __tablename__ = 'reward_snapshots'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    lifetime_points = db.Column(db.Integer, nullable=False, default=0)
+    collections = db.Column(db.Integer, nullable=False, default=0)
+    waste_collected = db.Column(db.Float, nullable=False, default=0.0)
+    through_seq = db.Column(db.Integer, nullable=False, default=0)
+    compacted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Last sync_changes sequence number the rewards crediting pass has read
+class RewardCursor(db.Model):
+    __tablename__ = 'reward_cursor'
+
+    id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Per day allocation of completed collection tonnage, by grid cell and waste
+# type, to recycling centers (center_id 0 holds what no center could take),
+# see allocation.py
+class CenterAllocation(db.Model):
+    __tablename__ = 'center_allocations'
+
+    day = db.Column(db.Date, primary_key=True)
+    grid_cell = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    waste_type = db.Column(db.String(50), primary_key=True)
+    center_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    kg = db.Column(db.Float, nullable=False)
+    distance_km = db.Column(db.Float, nullable=False)
+
+
+class AllocationDay(db.Model):
+    __tablename__ = 'allocation_days'
+
+    day = db.Column(db.Date, primary_key=True)
+    centers_key = db.Column(db.String(64), nullable=False)  # Centers the plan was solved against
+    solved_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# Map marker clusters per zoom level over a hierarchical web mercator grid,
+# kept as running sums so the centroid and averages follow from count, see
+# map_clusters.py
+class MapCluster(db.Model):
+    __tablename__ = 'map_clusters'
+
+    zoom = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cell_x = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cell_y = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    latitude_sum = db.Column(db.Float, nullable=False, default=0.0)
+    longitude_sum = db.Column(db.Float, nullable=False, default=0.0)
+    capacity_sum = db.Column(db.Float, nullable=False, default=0.0)
+    active = db.Column(db.Integer, nullable=False, default=0)
+    maintenance = db.Column(db.Integer, nullable=False, default=0)
+    full = db.Column(db.Integer, nullable=False, default=0)
+    id_sum = db.Column(db.BigInteger, nullable=False, default=0)  # The point id when count is 1
+
+
+# Collection point state last applied to map_clusters
+class MapClusterPoint(db.Model):
+    __tablename__ = 'map_cluster_points'
+
+    point_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    capacity = db.Column(db.Float, nullable=False, default=0.0)
+    status = db.Column(db.String(50), nullable=True)
+
+
+# Last sync_changes sequence number applied to map_clusters
+class MapClusterCursor(db.Model):
+    __tablename__ = 'map_cluster_cursor'
+
+    id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Completed tonnage per day and waste type binned on the heatmap grid, stored
+# as a zlib-compressed array of (cell, kg) for the non-empty cells, see
+# heatmap.py
+class HeatmapLayer(db.Model):
+    __tablename__ = 'heatmap_layers'
+
+    day = db.Column(db.Date, primary_key=True)
+    waste_type = db.Column(db.String(50), primary_key=True)
+    weights = db.Column(db.LargeBinary, nullable=False)
+    total_kg = db.Column(db.Float, nullable=False, default=0.0)
+    collections = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+# What each completed collection last added to the heatmap
+class HeatmapContribution(db.Model):
+    __tablename__ = 'heatmap_contributions'
+
+    collection_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, nullable=False)
+    waste_type = db.Column(db.String(50), nullable=False)
+    cell = db.Column(db.Integer, nullable=False)
+    kg = db.Column(db.Float, nullable=False)
+
+
+# Collection point address and heatmap cell last applied to heatmap_layers
+class HeatmapPoint(db.Model):
+    __tablename__ = 'heatmap_points'
+
+    point_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    address = db.Column(db.String(200), nullable=False)
+    cell = db.Column(db.Integer, nullable=False)  # -1 outside the grid
+
+
+# Last sync_changes sequence number applied to heatmap_layers
+class HeatmapCursor(db.Model):
+    __tablename__ = 'heatmap_cursor'
+
+    id = db.Column(db.Integer, primary_key=True)
+    seq = db.Column(db.Integer, nullable=False, default=0)
+
+
+# Background jobs run by the worker pool, see jobs.py
+class Job(db.Model):
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_id', 'status', 'id'),
+        # At most one live job per kind and parameters
+        db.Index('ux_jobs_queued_key', 'key', unique=True,
+                 sqlite_where=db.text("status = 'queued'"),
+                 postgresql_where=db.text("status = 'queued'")),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    key = db.Column(db.String(64), nullable=False)  # Hash of kind and params
+    params = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed, cancelled
+    result = db.Column(db.JSON, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class SyncChange(db.Model):
+    __tablename__ = 'sync_changes'
+    __table_args__ = (
+        db.Index('ix_sync_changes_record', 'resource', 'record_id'),
+        db.Index('ix_sync_changes_deleted', 'deleted', 'changed_at'),
+        # Sequence numbers must never be reused once a client has seen them
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = db.Column(db.Integer, primary_key=True)
+    resource = db.Column(db.String(32), nullable=False)  # change_feed topic, see sync.py
+    record_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, nullable=False, default=False)
+    changed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+# Works on CollectionPoint instances and on Core rows of the point table
+def serialize_point(point, collection_dates):
+    last_collection, next_collection = collection_dates.get(point.address, (None, None))
+    last_collection = last_collection or point.last_collection
+    next_collection = next_collection or point.next_collection
+    return {
+        'id': point.id,
+        'name': point.name,
+        'address': point.address,
+        'area': point.area,
+        'latitude': point.latitude,
+        'longitude': point.longitude,
+        'capacity': point.capacity,
+        'status': point.status,
+        'last_collection': last_collection.strftime('%Y-%m-%d') if last_collection else None,
+        'next_collection': next_collection.strftime('%Y-%m-%d') if next_collection else None,
+        'created_at': point.created_at.isoformat(),
+        'version': point.version
+    }
+
+
+# Returns {address: (last_completed, next_scheduled)} for the given points,
+# computed with one grouped query per chunk of addresses
+def resolve_collection_dates(points):
+    addresses = list({point.address for point in points})
+    now = datetime.now()
+    last_completed = func.max(case(
+        (Collection.status == 'completed', Collection.date_time)
+    ))
+    next_scheduled = func.min(case(
+        ((Collection.status.in_(ACTIVE_COLLECTION_STATUSES)) & (Collection.date_time > now), Collection.date_time)
+    ))
+
+    dates = {}
+    for start in range(0, len(addresses), ADDRESS_CHUNK_SIZE):
+        chunk = addresses[start:start + ADDRESS_CHUNK_SIZE]
+        rows = db.session.query(
+            Collection.location, last_completed, next_scheduled
+        ).filter(
+            Collection.location.in_(chunk)
+        ).group_by(Collection.location).all()
+        for location, last_collection, next_collection in rows:
+            dates[location] = (last_collection, next_collection)
+
+    # Locations whose completed collections have all been archived
+    unresolved = [address for address in addresses if dates.get(address, (None, None))[0] is None]
+    for start in range(0, len(unresolved), ADDRESS_CHUNK_SIZE):
+        chunk = unresolved[start:start + ADDRESS_CHUNK_SIZE]
+        rows = db.session.query(
+            CollectionArchiveSummary.location, func.max(CollectionArchiveSummary.day)
+        ).filter(
+            CollectionArchiveSummary.location.in_(chunk)
+        ).group_by(CollectionArchiveSummary.location).all()
+        for location, last_day in rows:
+            dates[location] = (datetime.combine(last_day, datetime.min.time()), dates.get(location, (None, None))[1])
+    return dates
+
+
+# Indexes since replaced by a differently defined one
+REPLACED_INDEXES = ['ux_jobs_live_key']
+
+
+# create_all() skips tables that already exist, so indexes added later
+# are created here for older databases
+def create_missing_indexes():
+    with db.engine.begin() as connection:
+        for name in REPLACED_INDEXES:
+            connection.exec_driver_sql(f'DROP INDEX IF EXISTS {name}')
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+# create_all() does not alter existing tables, so nullable columns and
+# columns with a server default added after a table was created are added here
+def add_missing_columns():
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                if column.nullable:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'
+                    )
+                elif column.server_default is not None:
+                    connection.exec_driver_sql(
+                        f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} '
+                        f'NOT NULL DEFAULT {column.server_default.arg}'
+                    )
@@ -1,30 +0,0 @@
-from datetime import datetime
-from database import db
-
-class Collection(db.Model):
-    __tablename__ = 'collections'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    location = db.Column(db.String(200), nullable=False)
-    date_time = db.Column(db.DateTime, nullable=False)
-    waste_type = db.Column(db.String(50), nullable=False)
-    assigned_team = db.Column(db.String(100), nullable=False)
-    notes = db.Column(db.Text)
-    status = db.Column(db.String(20), nullable=False, default='scheduled')
-    waste_collected = db.Column(db.Float, default=0.0)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'location': self.location,
-            'date_time': self.date_time.isoformat() if self.date_time else None,
-            'waste_type': self.waste_type,
-            'assigned_team': self.assigned_team,
-            'notes': self.notes,
-            'status': self.status,
-            'waste_collected': self.waste_collected,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
-        } 
\ No newline at end of file
@@ -1,30 +0,0 @@
-from datetime import datetime
-from database import db
-
-class CollectionPoint(db.Model):
-    __tablename__ = 'collection_points'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    address = db.Column(db.String(200), nullable=False)
-    type = db.Column(db.String(50), nullable=False)
-    capacity = db.Column(db.String(20), nullable=False)
-    status = db.Column(db.String(20), nullable=False, default='active')
-    collection_dates = db.Column(db.JSON, nullable=False, default=list)
-    notes = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'address': self.address,
-            'type': self.type,
-            'capacity': self.capacity,
-            'status': self.status,
-            'collection_dates': self.collection_dates,
-            'notes': self.notes,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
-        } 
\ No newline at end of file
@@ -1,32 +0,0 @@
-from datetime import datetime
-from database import db
-
-class RecyclingCenter(db.Model):
-    __tablename__ = 'recycling_centers'
-    
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    address = db.Column(db.String(200), nullable=False)
-    phone = db.Column(db.String(20), nullable=False)
-    email = db.Column(db.String(120), nullable=False)
-    hours = db.Column(db.String(100), nullable=False)
-    materials = db.Column(db.JSON, nullable=False, default=list)
-    capacity = db.Column(db.String(20), nullable=False)
-    status = db.Column(db.String(20), nullable=False, default='active')
-    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
-
-    def to_dict(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'address': self.address,
-            'phone': self.phone,
-            'email': self.email,
-            'hours': self.hours,
-            'materials': self.materials,
-            'capacity': self.capacity,
-            'status': self.status,
-            'created_at': self.created_at.isoformat(),
-            'updated_at': self.updated_at.isoformat()
-        } 
\ No newline at end of file
@@ -0,0 +1,220 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from flask import Response, g, request
+from sqlalchemy import event
+
+# Structured logging plus in-process request and SQL metrics, exposed in the
+# Prometheus text format at /metrics. Metrics are per process; scrape each
+# worker separately when running several.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 500)
+# The same statement run this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = 10
+
+logger = logging.getLogger(__name__)
+
+
+class JsonFormatter(logging.Formatter):
+    RESERVED = set(vars(logging.makeLogRecord({})))
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in self.RESERVED})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+
+
+def _label_string(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help, buckets):
+        self.name, self.help, self.buckets = name, help, buckets
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, (counts, total, count) in sorted(self._series.items()):
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{_label_string(key + (("le", bound),))} {bucket_count}')
+            lines.append(f'{self.name}_bucket{_label_string(key + (("le", "+Inf"),))} {count}')
+            lines.append(f'{self.name}_sum{_label_string(key)} {total}')
+            lines.append(f'{self.name}_count{_label_string(key)} {count}')
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, help):
+        self.name, self.help = name, help
+        self._series = Counter()
+
+    def inc(self, amount=1, **labels):
+        self._series[tuple(sorted(labels.items()))] += amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        for key, value in sorted(self._series.items()):
+            lines.append(f'{self.name}{_label_string(key)} {value}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_duration = Histogram(
+            'http_request_duration_seconds', 'Request latency by route', LATENCY_BUCKETS)
+        self.response_size = Histogram(
+            'http_response_size_bytes', 'Response body size by route', SIZE_BUCKETS)
+        self.request_queries = Histogram(
+            'db_queries_per_request', 'SQL statements executed per request', QUERY_COUNT_BUCKETS)
+        self.request_query_time = Histogram(
+            'db_query_duration_seconds_per_request', 'Time spent in SQL per request', LATENCY_BUCKETS)
+        self.queries = CounterMetric('db_queries_total', 'SQL statements executed')
+        self.n_plus_one = CounterMetric(
+            'db_n_plus_one_requests_total', 'Requests repeating one statement at least '
+            f'{N_PLUS_ONE_THRESHOLD} times')
+
+    def record_request(self, route, method, status, seconds, size, queries, query_seconds):
+        labels = {'route': route, 'method': method, 'status': status}
+        with self._lock:
+            self.request_duration.observe(seconds, **labels)
+            if size is not None:
+                self.response_size.observe(size, route=route, method=method)
+            self.request_queries.observe(queries, route=route, method=method)
+            self.request_query_time.observe(query_seconds, route=route, method=method)
+            self.queries.inc(queries, route=route)
+
+    def record_n_plus_one(self, route):
+        with self._lock:
+            self.n_plus_one.inc(route=route)
+
+    def render(self):
+        with self._lock:
+            lines = []
+            for metric in (self.request_duration, self.response_size, self.request_queries,
+                           self.request_query_time, self.queries, self.n_plus_one):
+                lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    if started is None:
+        return
+    try:
+        stats = g._sql_stats
+    except (AttributeError, RuntimeError):
+        # Outside a request (CLI commands, startup)
+        return
+    stats['count'] += 1
+    stats['seconds'] += time.perf_counter() - started
+    stats['statements'][statement] += 1
+
+
+def _start_request():
+    g._request_started = time.perf_counter()
+    g._sql_stats = {'count': 0, 'seconds': 0.0, 'statements': Counter()}
+
+
+def _record(route, method, status, started, size, stats):
+    seconds = time.perf_counter() - started
+    metrics.record_request(route, method, status, seconds, size, stats['count'], stats['seconds'])
+
+    statement, repeats = stats['statements'].most_common(1)[0] if stats['statements'] else (None, 0)
+    if repeats >= N_PLUS_ONE_THRESHOLD:
+        metrics.record_n_plus_one(route)
+        logger.warning('Repeated query in request', extra={
+            'route': route, 'repeats': repeats, 'statement': statement[:200]
+        })
+
+    logger.debug('Request handled', extra={
+        'route': route, 'method': method, 'status': status,
+        'duration_ms': round(seconds * 1000, 2), 'bytes': size,
+        'queries': stats['count'], 'query_ms': round(stats['seconds'] * 1000, 2)
+    })
+
+
+# Streamed bodies run their queries after after_request, so the request is
+# recorded once the body has been sent (or the client went away). The stats
+# dict stays on g meanwhile; the streamed generator still runs inside the
+# request context and keeps counting into it.
+def _record_when_closed(body, route, method, status, started, stats):
+    size = 0
+    try:
+        for chunk in body:
+            size += len(chunk)
+            yield chunk
+    finally:
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+        _record(route, method, status, started, size, stats)
+
+
+def _finish_request(response):
+    started = g.pop('_request_started', None)
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    status = str(response.status_code)
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = _record_when_closed(
+            response.response, route, request.method, status, started, g._sql_stats)
+        return response
+    stats = g.pop('_sql_stats')
+    size = response.content_length if response.is_streamed else response.calculate_content_length()
+    _record(route, request.method, status, started, size, stats)
+    return response
+
+
+def init_app(app, engine):
+    configure_logging(app.config.get('LOG_LEVEL'))
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,195 @@
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response
+import change_feed
+from single_flight import SingleFlight
+
+# Response cache for list and statistics endpoints. Each resource has a
+# generation counter that is bumped whenever a change is published for it,
+# and a cached response is keyed by the request plus the generations of the
+# resources it was built from. The key doubles as a strong ETag, so a client
+# revalidating with If-None-Match gets a 304 without the view running.
+#
+# Counters live in process memory by default. Setting RESPONSE_CACHE_SHM to a
+# file path (ideally under /dev/shm) shares them between worker processes so
+# a write in one worker invalidates the others; payloads stay per process.
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 60
+TOKEN_SIZE = 16
+
+
+class LocalGenerations:
+    def __init__(self, names):
+        self._counters = {name: 0 for name in names}
+        self._lock = threading.Lock()
+        self.token = os.urandom(TOKEN_SIZE).hex()
+
+    def get(self, name):
+        return self._counters[name]
+
+    def bump(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+
+class SharedGenerations:
+    def __init__(self, path, names):
+        import fcntl
+        self._fcntl = fcntl
+        self._offsets = {name: TOKEN_SIZE + 8 * index for index, name in enumerate(names)}
+        size = TOKEN_SIZE + 8 * len(names)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                # A new token invalidates ETags issued against the old layout
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, os.urandom(TOKEN_SIZE), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mmap = mmap.mmap(self._fd, size)
+        self.token = bytes(self._mmap[:TOKEN_SIZE]).hex()
+
+    def get(self, name):
+        return struct.unpack_from('q', self._mmap, self._offsets[name])[0]
+
+    def bump(self, name):
+        offset = self._offsets[name]
+        self._fcntl.flock(self._fd, self._fcntl.LOCK_EX)
+        try:
+            value = struct.unpack_from('q', self._mmap, offset)[0]
+            struct.pack_into('q', self._mmap, offset, value + 1)
+        finally:
+            self._fcntl.flock(self._fd, self._fcntl.LOCK_UN)
+
+
+class ResponseLRU:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, body, headers):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (body, headers)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+generations = LocalGenerations(change_feed.TOPICS)
+responses = ResponseLRU()
+flights = SingleFlight()
+
+
+def init_app(app):
+    global generations
+    shared_path = app.config.get('RESPONSE_CACHE_SHM')
+    if shared_path:
+        generations = SharedGenerations(shared_path, change_feed.TOPICS)
+    responses.max_bytes = app.config.get('RESPONSE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES)
+
+
+def bump(resource):
+    generations.bump(resource)
+
+
+change_feed.feed.add_listener(lambda event: bump(event['topic']))
+
+
+def _etag(resources, ttl):
+    query = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    parts = [generations.token, request.path, query]
+    parts += [f'{resource}:{generations.get(resource)}' for resource in resources]
+    # Time-dependent fields (next collection dates, forecasts) expire with ttl
+    parts.append(str(int(time.time() // ttl)))
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+# Passes a streamed body through, caching it once fully sent unless it grows
+# past the cache size
+def _tee(chunks, key, headers):
+    body = bytearray()
+    for chunk in chunks:
+        if body is not None:
+            body += chunk
+            if len(body) > responses.max_bytes:
+                body = None
+        yield chunk
+    if body is not None:
+        responses.put(key, bytes(body), headers)
+
+
+# Caches a GET view whose output only changes when the given resources do.
+# With coalesce, requests missing the cache together run the view once and
+# all get its body; for views whose response is not streamed.
+def cached_response(*resources, ttl=DEFAULT_TTL_SECONDS, headers=('Content-Type', 'X-Next-Cursor'),
+                    coalesce=False):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = _etag(resources, ttl)
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            cached = responses.get(etag)
+            if cached is not None:
+                body, cached_headers = cached
+                response = make_response(body, 200, cached_headers)
+                response.set_etag(etag)
+                return response
+
+            if coalesce:
+                def render():
+                    response = make_response(view(*args, **kwargs))
+                    kept = {name: response.headers[name] for name in headers if name in response.headers}
+                    body = response.get_data()
+                    if response.status_code == 200:
+                        responses.put(etag, body, kept)
+                    return response.status_code, body, kept
+
+                status, body, kept = flights.do(etag, render)[0]
+                response = make_response(body, status, kept)
+                if status == 200:
+                    response.set_etag(etag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            cached_headers = {name: response.headers[name] for name in headers if name in response.headers}
+            if response.is_streamed:
+                response.response = _tee(response.response, etag, cached_headers)
+            else:
+                responses.put(etag, response.get_data(), cached_headers)
+            response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
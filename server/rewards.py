@@ -0,0 +1,328 @@
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, case, delete, func, insert, literal, select, text, update
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import (
+    db, Collection, CollectionArchive, CollectionReward, RewardCursor, RewardLedger, RewardSnapshot,
+    SyncChange, User, UserBalance
+)
+
+# Citizen and raddiwala rewards. Points are booked on an append-only ledger
+# and every ledger write updates the user's row in user_balances in the same
+# transaction, so balances and the leaderboard are single indexed reads no
+# matter how long the ledger grows.
+#
+# Completed collections are credited in batches by following the collections
+# entries of the sync log: each pass reads the collections changed since its
+# cursor, compares the points they are worth now with what collection_rewards
+# says they were credited, and books one ledger entry per user for the
+# difference. Re-weighing, cancelling or deleting a credited collection is
+# therefore corrected on the next pass. Old ledger entries are compacted into
+# per-user snapshots.
+
+POINTS_PER_KG = {
+    'recyclable': 15,
+    'electronic': 25,
+    'hazardous': 20,
+    'medical': 10,
+    'organic': 8,
+}
+DEFAULT_POINTS_PER_KG = 5
+USER_ROLES = ['citizen', 'raddiwala']
+
+CREDIT_BATCH_SIZE = 5000
+ID_CHUNK_SIZE = 500
+LEDGER_RETENTION_DAYS = 90
+DEFAULT_LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+DEFAULT_LEDGER_LIMIT = 50
+MAX_LEDGER_LIMIT = 500
+# Serializes crediting passes across PostgreSQL workers
+ADVISORY_LOCK_KEY = 0x5257_5244
+
+_credit_lock = threading.Lock()
+
+
+class InsufficientBalance(Exception):
+    def __init__(self, balance):
+        super().__init__(f"Insufficient balance: {balance} points available")
+        self.balance = balance
+
+
+def collection_points(waste_type, waste_collected):
+    rate = POINTS_PER_KG.get((waste_type or '').lower(), DEFAULT_POINTS_PER_KG)
+    return int(round((waste_collected or 0.0) * rate))
+
+
+# Books entries of one kind, {user_id: (points, collections, waste)}, and
+# applies them to the materialized balances
+def _book(totals, kind, note=None):
+    totals = {user_id: total for user_id, total in totals.items() if any(total)}
+    if not totals:
+        return
+    now = datetime.utcnow()
+    db.session.execute(insert(RewardLedger.__table__), [{
+        'user_id': user_id, 'kind': kind, 'points': points, 'collections': collections,
+        'waste_collected': waste, 'note': note, 'created_at': now
+    } for user_id, (points, collections, waste) in totals.items()])
+    lifetime = 0 if kind == 'redemption' else 1
+    table = UserBalance.__table__
+    db.session.execute(
+        update(table).where(table.c.user_id == bindparam('b_user_id')).values(
+            balance=table.c.balance + bindparam('b_points'),
+            lifetime_points=table.c.lifetime_points + bindparam('b_lifetime'),
+            collections=table.c.collections + bindparam('b_collections'),
+            waste_collected=table.c.waste_collected + bindparam('b_waste'),
+            updated_at=now
+        ),
+        [{'b_user_id': user_id, 'b_points': points, 'b_lifetime': points * lifetime,
+          'b_collections': collections, 'b_waste': waste}
+         for user_id, (points, collections, waste) in totals.items()]
+    )
+
+
+def _read_cursor():
+    return db.session.execute(select(RewardCursor.seq).where(RewardCursor.id == 1)).scalar()
+
+
+def _write_cursor(seq):
+    if db.session.execute(update(RewardCursor).where(RewardCursor.id == 1).values(seq=seq)).rowcount == 0:
+        db.session.execute(insert(RewardCursor), [{'id': 1, 'seq': seq}])
+
+
+def _collection_rows(ids):
+    rows = {}
+    for model in (Collection, CollectionArchive):
+        # Archived collections left the hot table without a sync tombstone
+        columns = [model.id, model.user_id, model.status, model.waste_type, model.waste_collected]
+        for row in _select_in(columns, model.id, [id for id in ids if id not in rows]):
+            rows[row.id] = row
+    return rows
+
+
+def _select_in(columns, key, ids):
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield from db.session.execute(select(*columns).where(key.in_(ids[start:start + ID_CHUNK_SIZE])))
+
+
+# Credits the collections among one batch of sync log entries after seq,
+# up to head. Returns (last seq read, collections whose credit changed).
+def _credit_batch(after, head):
+    entries = db.session.execute(
+        select(SyncChange.seq, SyncChange.record_id, SyncChange.deleted).where(
+            SyncChange.seq > after, SyncChange.seq <= head, SyncChange.resource == 'collections'
+        ).order_by(SyncChange.seq).limit(CREDIT_BATCH_SIZE)
+    ).all()
+    through = entries[-1].seq if len(entries) == CREDIT_BATCH_SIZE else head
+    ids = [entry.record_id for entry in entries]
+    deleted = {entry.record_id for entry in entries if entry.deleted}
+    rows = _collection_rows([id for id in ids if id not in deleted])
+    users = {row.id for row in _select_in([User.id], User.id, {row.user_id for row in rows.values() if row.user_id})}
+    credited = {row.collection_id: row for row in _select_in(
+        CollectionReward.__table__.c, CollectionReward.collection_id, ids
+    )}
+
+    totals = defaultdict(lambda: [0, 0, 0.0])
+    removed = []
+    added = []
+    for id in ids:
+        if id in deleted:
+            target = None
+        elif id in rows:
+            row = rows[id]
+            points = collection_points(row.waste_type, row.waste_collected)
+            if row.status == 'completed' and row.user_id in users and (points or row.waste_collected):
+                target = (row.user_id, points, row.waste_collected or 0.0)
+            else:
+                target = None
+        else:
+            continue
+        previous = credited.get(id)
+        if previous is not None and target == (previous.user_id, previous.points, previous.waste_collected):
+            continue
+        if previous is None and target is None:
+            continue
+        if previous is not None:
+            total = totals[previous.user_id]
+            total[0] -= previous.points
+            total[1] -= 1
+            total[2] -= previous.waste_collected
+            removed.append(id)
+        if target is not None:
+            user_id, points, waste = target
+            total = totals[user_id]
+            total[0] += points
+            total[1] += 1
+            total[2] += waste
+            added.append({'collection_id': id, 'user_id': user_id, 'points': points, 'waste_collected': waste})
+
+    for start in range(0, len(removed), ID_CHUNK_SIZE):
+        db.session.execute(delete(CollectionReward).where(
+            CollectionReward.collection_id.in_(removed[start:start + ID_CHUNK_SIZE])
+        ))
+    if added:
+        db.session.execute(insert(CollectionReward.__table__), added)
+    changed = len(set(removed) | {row['collection_id'] for row in added})
+    note = f"{changed} collection{'s' if changed != 1 else ''}"
+    _book({user_id: tuple(total) for user_id, total in totals.items()}, 'credit', note)
+    _write_cursor(through)
+    return through, changed
+
+
+# Credits every collection changed since the last pass, committing once per
+# batch. Returns the number of collections whose credit changed.
+def credit_completed():
+    changed = 0
+    with _credit_lock:
+        head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+        while True:
+            if db.engine.dialect.name == 'postgresql':
+                db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+            after = _read_cursor() or 0
+            if after >= head:
+                db.session.rollback()
+                return changed
+            try:
+                after, count = _credit_batch(after, head)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            changed += count
+
+
+# Adds balance rows for users created before the rewards tables existed, and
+# copies roles onto balance rows that predate the role column
+def ensure_balances():
+    missing = select(User.id, User.role).where(
+        ~select(UserBalance.user_id).where(UserBalance.user_id == User.id).exists()
+    )
+    db.session.execute(insert(UserBalance).from_select(['user_id', 'role'], missing))
+    role = select(User.role).where(User.id == UserBalance.user_id).scalar_subquery()
+    db.session.execute(update(UserBalance).where(UserBalance.role != role).values(role=role))
+    db.session.commit()
+
+
+def redeem(user_id, points, note=None):
+    if isinstance(points, bool) or not isinstance(points, int) or points <= 0:
+        raise ValueError('points must be a positive integer')
+    table = UserBalance.__table__
+    updated = db.session.execute(update(table).where(
+        table.c.user_id == user_id, table.c.balance >= points
+    ).values(balance=table.c.balance - points, updated_at=datetime.utcnow())).rowcount
+    if not updated:
+        balance = db.session.execute(select(table.c.balance).where(table.c.user_id == user_id)).scalar()
+        raise InsufficientBalance(balance or 0)
+    db.session.execute(insert(RewardLedger.__table__), [{
+        'user_id': user_id, 'kind': 'redemption', 'points': -points, 'note': note
+    }])
+
+
+# Manual correction counted towards lifetime points, positive or negative
+def adjust(user_id, points, note=None):
+    if isinstance(points, bool) or not isinstance(points, int) or points == 0:
+        raise ValueError('points must be a non-zero integer')
+    _book({user_id: (points, 0, 0.0)}, 'adjustment', note)
+
+
+def _snapshot_upsert(rows):
+    table = RewardSnapshot.__table__
+    dialect_insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    statement = dialect_insert(table).from_select(
+        ['user_id', 'balance', 'lifetime_points', 'collections', 'waste_collected', 'through_seq', 'compacted_at'],
+        rows
+    )
+    return statement.on_conflict_do_update(
+        index_elements=['user_id'],
+        set_={
+            'balance': table.c.balance + statement.excluded.balance,
+            'lifetime_points': table.c.lifetime_points + statement.excluded.lifetime_points,
+            'collections': table.c.collections + statement.excluded.collections,
+            'waste_collected': table.c.waste_collected + statement.excluded.waste_collected,
+            'through_seq': statement.excluded.through_seq,
+            'compacted_at': statement.excluded.compacted_at,
+        }
+    )
+
+
+# Folds ledger entries older than days into the snapshots and deletes
+# them. Balances already include them, so they do not change.
+def compact_ledger(days=LEDGER_RETENTION_DAYS, now=None):
+    cutoff = (now or datetime.utcnow()) - timedelta(days=days)
+    through = db.session.query(func.max(RewardLedger.seq)).filter(RewardLedger.created_at < cutoff).scalar()
+    if through is None:
+        return 0
+    ledger = RewardLedger.__table__
+    rows = select(
+        ledger.c.user_id,
+        func.sum(ledger.c.points),
+        func.sum(case((ledger.c.kind == 'redemption', 0), else_=ledger.c.points)),
+        func.sum(ledger.c.collections),
+        func.sum(ledger.c.waste_collected),
+        func.max(ledger.c.seq),
+        literal(datetime.utcnow())
+    ).where(ledger.c.seq <= through).group_by(ledger.c.user_id)
+    db.session.execute(_snapshot_upsert(rows))
+    compacted = db.session.execute(delete(ledger).where(ledger.c.seq <= through)).rowcount
+    db.session.commit()
+    return compacted
+
+
+# Returns [(user_id, expected, actual)] for every balance that disagrees
+# with its snapshot plus remaining ledger entries
+def check_balances():
+    expected = defaultdict(lambda: [0, 0, 0, 0.0])
+    for snapshot in RewardSnapshot.query:
+        expected[snapshot.user_id] = [snapshot.balance, snapshot.lifetime_points,
+                                      snapshot.collections, snapshot.waste_collected]
+    for user_id, points, lifetime, collections, waste in db.session.query(
+        RewardLedger.user_id,
+        func.sum(RewardLedger.points),
+        func.sum(case((RewardLedger.kind == 'redemption', 0), else_=RewardLedger.points)),
+        func.sum(RewardLedger.collections),
+        func.sum(RewardLedger.waste_collected)
+    ).group_by(RewardLedger.user_id):
+        total = expected[user_id]
+        total[0] += points
+        total[1] += lifetime
+        total[2] += collections
+        total[3] += waste
+    mismatches = []
+    for balance in UserBalance.query:
+        actual = (balance.balance, balance.lifetime_points, balance.collections)
+        wanted = expected.pop(balance.user_id, [0, 0, 0, 0.0])
+        if actual != tuple(wanted[:3]) or abs(balance.waste_collected - wanted[3]) > 1e-6 * max(1.0, wanted[3]):
+            mismatches.append((balance.user_id, tuple(wanted), actual + (balance.waste_collected,)))
+    for user_id, wanted in expected.items():
+        mismatches.append((user_id, tuple(wanted), None))
+    return mismatches
+
+
+def leaderboard(limit=DEFAULT_LEADERBOARD_SIZE, role=None):
+    query = db.session.query(User, UserBalance).join(UserBalance, UserBalance.user_id == User.id)
+    if role:
+        query = query.filter(UserBalance.role == role)
+    rows = query.order_by(UserBalance.lifetime_points.desc(), UserBalance.user_id.desc()).limit(limit).all()
+    return [{
+        'rank': rank,
+        'user_id': user.id,
+        'name': user.name,
+        'role': user.role,
+        'area': user.area,
+        'lifetime_points': balance.lifetime_points,
+        'collections': balance.collections,
+        'waste_collected': balance.waste_collected,
+    } for rank, (user, balance) in enumerate(rows, 1)]
+
+
+# Newest entries first, before a ledger seq for paging
+def ledger_entries(user_id, before=None, limit=DEFAULT_LEDGER_LIMIT):
+    query = RewardLedger.query.filter(RewardLedger.user_id == user_id)
+    if before is not None:
+        query = query.filter(RewardLedger.seq < before)
+    entries = query.order_by(RewardLedger.seq.desc()).limit(limit + 1).all()
+    next_cursor = str(entries[limit - 1].seq) if len(entries) > limit else None
+    return [entry.to_dict() for entry in entries[:limit]], next_cursor
@@ -0,0 +1,192 @@
+import time
+from datetime import datetime, timedelta
+from models import db, Collection, CollectionPoint, ACTIVE_COLLECTION_STATUSES
+from spatial import haversine_km
+
+# Visiting order for a team's collections on one day. Stops are resolved to
+# collection point coordinates, a Haversine distance matrix is built once,
+# and the nearest-neighbour tour is improved with 2-opt and Or-opt moves
+# until no move helps or the time budget runs out. Routes are open paths
+# starting at the depot, or at the first stop when no depot is given.
+
+DEFAULT_TIME_BUDGET_MS = 2000
+MAX_TIME_BUDGET_MS = 10000
+OR_OPT_SEGMENT_LENGTHS = (1, 2, 3)
+# Improvements smaller than this are treated as noise
+EPSILON_KM = 1e-9
+
+
+def distance_matrix(coordinates):
+    size = len(coordinates)
+    matrix = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        lat1, lon1 = coordinates[i]
+        row = matrix[i]
+        for j in range(i + 1, size):
+            distance = haversine_km(lat1, lon1, *coordinates[j])
+            row[j] = distance
+            matrix[j][i] = distance
+    return matrix
+
+
+def path_length(path, matrix):
+    return sum(matrix[path[i]][path[i + 1]] for i in range(len(path) - 1))
+
+
+def nearest_neighbour(matrix, start=0):
+    unvisited = set(range(len(matrix)))
+    unvisited.discard(start)
+    path = [start]
+    while unvisited:
+        row = matrix[path[-1]]
+        closest = min(unvisited, key=row.__getitem__)
+        unvisited.remove(closest)
+        path.append(closest)
+    return path
+
+
+def two_opt(path, matrix, deadline):
+    size = len(path)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, size - 1):
+            if time.perf_counter() >= deadline:
+                break
+            before, first = path[i - 1], path[i]
+            removed_first = matrix[before][first]
+            for j in range(i + 1, size):
+                last = path[j]
+                if j + 1 < size:
+                    after = path[j + 1]
+                    delta = (matrix[before][last] + matrix[first][after]
+                             - removed_first - matrix[last][after])
+                else:
+                    delta = matrix[before][last] - removed_first
+                if delta < -EPSILON_KM:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    improved = True
+                    before, first = path[i - 1], path[i]
+                    removed_first = matrix[before][first]
+    return path
+
+
+def _or_opt_move(path, matrix, length, deadline):
+    size = len(path)
+    for i in range(1, size - length + 1):
+        if time.perf_counter() >= deadline:
+            break
+        segment = path[i:i + length]
+        head, tail = segment[0], segment[-1]
+        before = path[i - 1]
+        after = path[i + length] if i + length < size else None
+        removal_gain = matrix[before][head] - (matrix[before][after] if after is not None else 0.0)
+        if after is not None:
+            removal_gain += matrix[tail][after]
+
+        rest = path[:i] + path[i + length:]
+        for position in range(len(rest)):
+            if position == i - 1:
+                continue
+            a = rest[position]
+            b = rest[position + 1] if position + 1 < len(rest) else None
+            existing = matrix[a][b] if b is not None else 0.0
+            for first, last in ((head, tail), (tail, head)):
+                added = matrix[a][first] + (matrix[last][b] if b is not None else 0.0) - existing
+                if added - removal_gain < -EPSILON_KM:
+                    ordered = segment if first == head else segment[::-1]
+                    return rest[:position + 1] + ordered + rest[position + 1:]
+    return None
+
+
+def or_opt(path, matrix, deadline):
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for length in OR_OPT_SEGMENT_LENGTHS:
+            if time.perf_counter() >= deadline:
+                break
+            moved = _or_opt_move(path, matrix, length, deadline)
+            if moved is not None:
+                path = moved
+                improved = True
+    return path
+
+
+# Returns an order over the indexes of coordinates, starting at index 0
+def optimize_order(coordinates, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    matrix = distance_matrix(coordinates)
+    path = nearest_neighbour(matrix)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        length = path_length(path, matrix)
+        path = two_opt(path, matrix, deadline)
+        path = or_opt(path, matrix, deadline)
+        improved = path_length(path, matrix) < length - EPSILON_KM
+    return path, matrix
+
+
+def team_stops(team, day):
+    start = datetime(day.year, day.month, day.day)
+    return Collection.query.filter(
+        Collection.assigned_team == team,
+        Collection.status.in_(ACTIVE_COLLECTION_STATUSES),
+        Collection.date_time >= start,
+        Collection.date_time < start + timedelta(days=1)
+    ).order_by(Collection.date_time, Collection.id).all()
+
+
+def plan_route(team, day, depot=None, time_budget_ms=DEFAULT_TIME_BUDGET_MS):
+    started = time.perf_counter()
+    collections = team_stops(team, day)
+
+    addresses = list({collection.location for collection in collections})
+    coordinates_by_address = {}
+    for start in range(0, len(addresses), 500):
+        rows = db.session.query(
+            CollectionPoint.address, CollectionPoint.latitude, CollectionPoint.longitude
+        ).filter(CollectionPoint.address.in_(addresses[start:start + 500])).all()
+        for address, latitude, longitude in rows:
+            coordinates_by_address.setdefault(address, (latitude, longitude))
+
+    stops = [c for c in collections if c.location in coordinates_by_address]
+    unresolved = [c.id for c in collections if c.location not in coordinates_by_address]
+
+    coordinates = ([depot] if depot else []) + [coordinates_by_address[c.location] for c in stops]
+    offset = 1 if depot else 0
+    if len(coordinates) < 2:
+        order, matrix = list(range(len(coordinates))), distance_matrix(coordinates)
+    else:
+        order, matrix = optimize_order(coordinates, time_budget_ms)
+
+    naive_km = path_length(list(range(len(coordinates))), matrix)
+    optimized_km = path_length(order, matrix)
+
+    route = []
+    previous = None
+    for index in order:
+        if index >= offset:
+            collection = stops[index - offset]
+            latitude, longitude = coordinates[index]
+            route.append({
+                'collection_id': collection.id,
+                'location': collection.location,
+                'date_time': collection.date_time.isoformat(),
+                'latitude': latitude,
+                'longitude': longitude,
+                'leg_km': round(matrix[previous][index], 3) if previous is not None else 0.0
+            })
+        previous = index
+
+    return {
+        'team': team,
+        'date': day.strftime('%Y-%m-%d'),
+        'stops': route,
+        'unresolved_collection_ids': unresolved,
+        'total_km': round(optimized_km, 3),
+        'naive_km': round(naive_km, 3),
+        'saved_km': round(naive_km - optimized_km, 3),
+        'saved_percent': round((naive_km - optimized_km) / naive_km * 100, 2) if naive_km else 0,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
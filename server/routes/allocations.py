@@ -0,0 +1,33 @@
+from flask import Blueprint, jsonify, request
+from datetime import date
+from allocation import allocate_day
+
+allocations_bp = Blueprint('allocations', __name__, url_prefix='/api/allocations')
+
+
+def _day(value):
+    return date.fromisoformat(value) if value else date.today()
+
+
+# The day's plan, first routing any collections completed since the last solve
+@allocations_bp.route('', methods=['GET'])
+def get_allocations():
+    try:
+        day = _day(request.args.get('date'))
+    except ValueError:
+        return jsonify({'error': 'Invalid date'}), 400
+    return jsonify(allocate_day(day))
+
+
+# {"date": "2024-06-03", "full": true} re-solves the day from scratch
+@allocations_bp.route('/solve', methods=['POST'])
+def solve_allocations():
+    data = request.get_json(silent=True) or {}
+    try:
+        day = _day(data.get('date'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid date'}), 400
+    try:
+        return jsonify(allocate_day(day, full=bool(data.get('full'))))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -0,0 +1,115 @@
+from flask import Blueprint, Response, jsonify, request
+from datetime import datetime
+from analytics import aggregate, fold, report_rows
+from heatmap import heatmap_grid, grid_metadata, grid_points, gzip_grid
+
+analytics_bp = Blueprint('analytics', __name__, url_prefix='/api/analytics')
+
+
+def _parse_args(default_bucket='day'):
+    bucket = request.args.get('bucket', default_bucket)
+    group_by = [field for field in request.args.get('group_by', '').split(',') if field]
+    start = request.args.get('start')
+    end = request.args.get('end')
+    try:
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) if end else None
+    except ValueError:
+        raise ValueError('Invalid start/end: expected an ISO date or datetime')
+    return bucket, group_by, start, end
+
+
+def _ratio(part, whole):
+    return round(part / whole * 100, 2) if whole else 0
+
+
+@analytics_bp.route('/trends', methods=['GET'])
+def get_trends():
+    try:
+        bucket, group_by, start, end = _parse_args()
+        rows = aggregate(bucket, group_by, start, end)
+        rows.sort(key=lambda row: row['bucket'])
+        return jsonify({'bucket': bucket, 'group_by': group_by, 'rows': rows})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@analytics_bp.route('/summary', methods=['GET'])
+def get_summary():
+    try:
+        bucket, _, start, end = _parse_args('month')
+        rows = aggregate(bucket, ['waste_type', 'status'], start, end)
+        totals = fold(rows, [])
+        return jsonify({
+            **(totals[0] if totals else {'collections': 0, 'completed': 0, 'waste_collected': 0.0}),
+            'by_waste_type': fold(rows, ['waste_type']),
+            'by_status': fold(rows, ['status'])
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@analytics_bp.route('/reports', methods=['GET'])
+def get_reports():
+    try:
+        bucket, group_by, start, end = _parse_args('month')
+        group_by = group_by or ['assigned_team']
+        return jsonify({'group_by': group_by, 'rows': report_rows(bucket, group_by, start, end)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+@analytics_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    try:
+        _, _, start, end = _parse_args()
+        rows = aggregate('day', ['waste_type'], start, end)
+        totals = fold(rows, [])
+        totals = totals[0] if totals else {'collections': 0, 'completed': 0, 'waste_collected': 0.0}
+        recyclable = sum(row['waste_collected'] for row in rows
+                         if (row['waste_type'] or '').lower() == 'recyclable')
+        days = len({row['bucket'] for row in rows})
+        return jsonify({
+            'collections': totals['collections'],
+            'completionRate': _ratio(totals['completed'], totals['collections']),
+            'recyclingRate': _ratio(recyclable, totals['waste_collected']),
+            'averageWastePerCollection': round(totals['waste_collected'] / totals['completed'], 2) if totals['completed'] else 0,
+            'collectionsPerDay': round(totals['collections'] / days, 2) if days else 0
+        })
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+
+# Completed tonnage binned on the heatmap grid, e.g.
+# /api/analytics/heatmap?start=2024-01-01&end=2024-02-01&waste_type=organic,recyclable
+# format=binary returns the grid as gzip-compressed little-endian float32 kg
+# per cell, row-major from the south-west corner, shaped by the X-Heatmap
+# headers
+@analytics_bp.route('/heatmap', methods=['GET'])
+def get_heatmap():
+    try:
+        _, _, start, end = _parse_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    format = request.args.get('format', 'json')
+    if format not in ('json', 'binary'):
+        return jsonify({'error': 'Invalid format: expected json or binary'}), 400
+    waste_types = [value for value in request.args.get('waste_type', '').split(',') if value]
+    grid, total_kg, collections = heatmap_grid(start and start.date(), end and end.date(), waste_types)
+    metadata = grid_metadata()
+
+    if format == 'binary':
+        bounds = metadata['bounds']
+        response = Response(gzip_grid(grid), mimetype='application/octet-stream')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['X-Heatmap-Shape'] = f"{metadata['rows']},{metadata['columns']}"
+        response.headers['X-Heatmap-Bounds'] = f"{bounds['south']},{bounds['west']},{bounds['north']},{bounds['east']}"
+        response.headers['X-Heatmap-Total-Kg'] = str(round(total_kg, 3))
+        return response
+    return jsonify({
+        **metadata,
+        'total_kg': round(total_kg, 3),
+        'collections': collections,
+        'max_kg': round(float(grid.max()), 3),
+        'points': grid_points(grid),
+    })
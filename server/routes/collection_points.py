@@ -1,16 +1,27 @@
 from flask import Blueprint, jsonify, request
-from models import db, CollectionPoint
+from sqlalchemy import select
+from models import db, CollectionPoint, CapacityReading, resolve_collection_dates, serialize_point
+from json_stream import iter_batches, stream_json
+from row_updates import VersionConflict, expected_version, patch_row
+from statistics_rollup import point_state, record_point_change
+import analytics
+from fill_forecast import forecaster
+import change_feed
+from response_cache import cached_response
 
 collection_points_bp = Blueprint('collection_points', __name__)
 
 @collection_points_bp.route('/api/collection-points', methods=['GET'])
+@cached_response('collection-points', 'collections')
 def get_collection_points():
-    try:
-        collection_points = CollectionPoint.query.all()
-        return jsonify([point.to_dict() for point in collection_points])
-    except Exception as e:
-        print(f"Error fetching collection points: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+    # Collection dates are resolved one batch of point rows at a time
+    def rows():
+        for batch in iter_batches(db.session, select(CollectionPoint.__table__)):
+            collection_dates = resolve_collection_dates(batch)
+            for point in batch:
+                yield serialize_point(point, collection_dates)
+
+    return stream_json(rows())
 
 @collection_points_bp.route('/api/collection-points', methods=['POST'])
 def create_collection_point():
@@ -18,8 +29,13 @@ def create_collection_point():
         data = request.json
         collection_point = CollectionPoint(**data)
         db.session.add(collection_point)
+        record_point_change(None, point_state(collection_point))
         db.session.commit()
-        return jsonify(collection_point.to_dict()), 201
+        # Area groupings depend on point addresses
+        analytics.clear_cache()
+        result = collection_point.to_dict()
+        change_feed.publish('collection-points', 'created', result)
+        return jsonify(result), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 400
@@ -29,20 +45,64 @@ def update_collection_point(id):
     try:
         collection_point = CollectionPoint.query.get_or_404(id)
         data = request.json
+        before = point_state(collection_point)
+        previous = change_feed.snapshot(collection_point)
         for key, value in data.items():
             setattr(collection_point, key, value)
+        record_point_change(before, point_state(collection_point))
         db.session.commit()
+        analytics.clear_cache()
+        change_feed.publish('collection-points', 'updated', change_feed.diff(previous, change_feed.snapshot(collection_point)))
         return jsonify(collection_point.to_dict())
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 400
 
+# Partial update in one statement, refused with 409 when the version from
+# If-Match or the body is stale
+@collection_points_bp.route('/api/collection-points/<int:id>', methods=['PATCH'])
+def patch_collection_point(id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        result = patch_row(CollectionPoint, id, data, expected_version(data),
+                           old_columns=('status', 'address', 'area'))
+        if result is None:
+            db.session.rollback()
+            return jsonify({"error": "Collection point not found"}), 404
+        old, new = result
+        if old is not None:
+            record_point_change(point_state(old), point_state(new))
+        db.session.commit()
+    except VersionConflict as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "version": e.current}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    if 'address' in data or 'area' in data:
+        # Area groupings depend on point addresses
+        analytics.clear_cache()
+    result = serialize_point(new, resolve_collection_dates([new]))
+    change_feed.publish('collection-points', 'updated', {
+        'id': id, 'version': new.version, **{key: result[key] for key in data if key in result}
+    })
+    response = jsonify(result)
+    response.headers['ETag'] = f'"{new.version}"'
+    return response
+
 @collection_points_bp.route('/api/collection-points/<int:id>', methods=['DELETE'])
 def delete_collection_point(id):
     try:
         collection_point = CollectionPoint.query.get_or_404(id)
+        CapacityReading.query.filter_by(point_id=id).delete(synchronize_session=False)
         db.session.delete(collection_point)
+        record_point_change(point_state(collection_point), None)
         db.session.commit()
+        analytics.clear_cache()
+        forecaster.forget(id)
+        change_feed.publish('collection-points', 'deleted', {'id': id})
         return '', 204
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,27 @@
+from flask import Blueprint, Response, jsonify, request
+from change_feed import stream, TOPICS
+
+events_bp = Blueprint('events', __name__)
+
+
+# Server-Sent Events stream of row changes.
+# ?topics=collections,collection-points limits the stream to those resources;
+# Last-Event-ID (header or last_event_id parameter) resumes after a reconnect.
+@events_bp.route('/api/events', methods=['GET'])
+def stream_events():
+    topics = [topic for topic in request.args.get('topics', '').split(',') if topic]
+    unknown = [topic for topic in topics if topic not in TOPICS]
+    if unknown:
+        return jsonify({'error': f"Unknown topics: {', '.join(unknown)}"}), 400
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+
+    return Response(
+        stream(last_event_id, set(topics) or None),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,31 @@
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from export import FORMATS, export_collections, filename
+from routes.jobs import accepted
+import jobs
+
+exports_bp = Blueprint('exports', __name__, url_prefix='/api')
+
+
+# Streams every matching collection as a download, e.g.
+# /api/collections/export?format=csv&start=2024-01-01&end=2024-02-01&area=Worli&gzip=1
+# With async=1 the export runs as a background job instead and the response
+# is 202 with the job, whose result is the file.
+@exports_bp.route('/collections/export', methods=['GET'])
+def export_collections_file():
+    format = request.args.get('format', 'csv')
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        params = {key: value for key, value in request.args.items() if key != 'async'}
+        try:
+            job, coalesced = jobs.submit('export', params)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return accepted(job, coalesced)
+    try:
+        chunks = export_collections(request.args, format, compress)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    mimetype = 'application/gzip' if compress else FORMATS[format][0]
+    headers = {'Content-Disposition': f'attachment; filename="{filename(format, compress)}"'}
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
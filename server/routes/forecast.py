@@ -0,0 +1,47 @@
+from flask import Blueprint, jsonify, request
+from models import db, CollectionPoint
+from bulk_ingest import iter_ndjson
+from fill_forecast import forecaster, ingest_readings, FULL_THRESHOLD
+
+forecast_bp = Blueprint('forecast', __name__, url_prefix='/api')
+
+DEFAULT_HORIZON_HOURS = 24
+
+
+# Accepts a JSON array or a newline-delimited JSON stream of
+# {point_id, capacity, recorded_at} sensor readings
+@forecast_bp.route('/capacity-readings', methods=['POST'])
+def create_capacity_readings():
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        records = iter_ndjson(request.stream)
+    else:
+        records = request.get_json(silent=True)
+        if not isinstance(records, list):
+            return jsonify({'error': 'Expected a JSON array of readings'}), 400
+    results = ingest_readings(records)
+    created = sum(1 for result in results if result['status'] == 'created')
+    failed = len(results) - created
+    status_code = 201 if not failed else (207 if created else 400)
+    return jsonify({'created': created, 'failed': failed, 'results': results}), status_code
+
+
+@forecast_bp.route('/forecast/full', methods=['GET'])
+def get_predicted_full_points():
+    try:
+        hours = float(request.args.get('hours', DEFAULT_HORIZON_HOURS))
+        threshold = float(request.args.get('threshold', FULL_THRESHOLD))
+    except ValueError:
+        return jsonify({'error': 'Invalid hours or threshold'}), 400
+
+    predictions = forecaster.predicted_full(hours, threshold)
+    points = {
+        point.id: point for point in db.session.query(
+            CollectionPoint.id, CollectionPoint.name, CollectionPoint.address, CollectionPoint.area
+        ).filter(CollectionPoint.id.in_([p['point_id'] for p in predictions])).all()
+    } if predictions else {}
+    return jsonify([
+        {**prediction, 'name': points[prediction['point_id']].name,
+         'address': points[prediction['point_id']].address,
+         'area': points[prediction['point_id']].area}
+        for prediction in predictions if prediction['point_id'] in points
+    ])
@@ -0,0 +1,90 @@
+from flask import Blueprint, jsonify, request, send_file, url_for
+from models import db, Job
+import jobs
+
+jobs_bp = Blueprint('jobs', __name__, url_prefix='/api/jobs')
+
+
+# 202 with the job and where to poll it, for every route that queues one
+def accepted(job, coalesced=False):
+    response = jsonify({**job.to_dict(), 'coalesced': coalesced})
+    response.status_code = 202
+    response.headers['Location'] = url_for('jobs.get_job', job_id=job.id)
+    return response
+
+
+# Queues a job, e.g. {"kind": "report", "params": {"bucket": "week"}}. An
+# identical job that is still queued or running is returned instead.
+@jobs_bp.route('', methods=['POST'])
+def create_job():
+    data = request.get_json(silent=True) or {}
+    try:
+        job, coalesced = jobs.submit(data.get('kind'), data.get('params'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return accepted(job, coalesced)
+
+
+@jobs_bp.route('', methods=['GET'])
+def get_jobs():
+    try:
+        limit = max(1, min(int(request.args.get('limit', jobs.DEFAULT_JOB_LIMIT)), jobs.MAX_JOB_LIMIT))
+        before = int(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    query = Job.query
+    if request.args.get('status'):
+        query = query.filter(Job.status.in_(request.args['status'].split(',')))
+    if request.args.get('kind'):
+        query = query.filter(Job.kind.in_(request.args['kind'].split(',')))
+    if before is not None:
+        query = query.filter(Job.id < before)
+    rows = query.order_by(Job.id.desc()).limit(limit + 1).all()
+    response = jsonify([job.to_dict() for job in rows[:limit]])
+    if len(rows) > limit:
+        response.headers['X-Next-Cursor'] = str(rows[limit - 1].id)
+    return response
+
+
+@jobs_bp.route('/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+
+# The job's result once it succeeded; exports are served as the file
+@jobs_bp.route('/<int:job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status in jobs.LIVE_STATUSES:
+        response = jsonify(job.to_dict())
+        response.status_code = 202
+        response.headers['Retry-After'] = str(jobs.POLL_SECONDS)
+        return response
+    if job.status == 'failed':
+        return jsonify({'error': job.error or 'Job failed'}), 500
+    if job.status == 'cancelled':
+        return jsonify({'error': 'Job was cancelled'}), 410
+    if job.kind == 'export':
+        return send_file(jobs.result_file(job.id), mimetype=job.result['mimetype'],
+                         as_attachment=True, download_name=job.result['filename'])
+    return jsonify(job.result)
+
+
+# Cancels a queued job, or deletes a finished one along with its result
+@jobs_bp.route('/<int:job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.status == 'queued' and jobs.cancel(job_id):
+        return '', 204
+    db.session.refresh(job)
+    if job.status == 'running':
+        return jsonify({'error': 'Job is running'}), 409
+    jobs.remove(job)
+    return '', 204
@@ -1,13 +1,22 @@
 from flask import Blueprint, request, jsonify
-from database import db
-from models.recycling_center import RecyclingCenter
+from datetime import date
+from sqlalchemy import select
+from models import db, RecyclingCenter
+from materials import parse_capacity, sync_center_materials
+from allocation import centers_with_room
+from json_stream import iter_rows, stream_json
+from row_updates import VersionConflict, expected_version, patch_row
+import change_feed
+from response_cache import cached_response
 
 recycling_centers_bp = Blueprint('recycling_centers', __name__)
 
 @recycling_centers_bp.route('/api/recycling-centers', methods=['GET'])
+@cached_response('recycling-centers')
 def get_recycling_centers():
-    centers = RecyclingCenter.query.all()
-    return jsonify([center.to_dict() for center in centers])
+    columns = [column for column in RecyclingCenter.__table__.columns if column.key != 'grid_cell']
+    rows = iter_rows(db.session, select(*columns))
+    return stream_json(dict(row._mapping) for row in rows)
 
 @recycling_centers_bp.route('/api/recycling-centers', methods=['POST'])
 def create_recycling_center():
@@ -22,17 +31,33 @@ def create_recycling_center():
             hours=data['hours'],
             materials=data['materials'],
             capacity=data['capacity'],
-            status=data['status']
+            status=data['status'],
+            latitude=data.get('latitude'),
+            longitude=data.get('longitude')
         )
         
         db.session.add(new_center)
         db.session.commit()
         
-        return jsonify(new_center.to_dict()), 201
+        result = new_center.to_dict()
+        change_feed.publish('recycling-centers', 'created', result)
+        return jsonify(result), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
+# Centers accepting ?material= or ?waste_type= with at least ?min_room_kg=
+# of daily throughput left after the ?date= allocation plan
+@recycling_centers_bp.route('/api/recycling-centers/available', methods=['GET'])
+def get_available_centers():
+    try:
+        day = date.fromisoformat(request.args['date']) if request.args.get('date') else None
+        min_room_kg = float(request.args.get('min_room_kg', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid date or min_room_kg'}), 400
+    return jsonify(centers_with_room(request.args.get('material'), request.args.get('waste_type'),
+                                     day, min_room_kg))
+
 @recycling_centers_bp.route('/api/recycling-centers/<int:center_id>', methods=['GET'])
 def get_recycling_center(center_id):
     center = RecyclingCenter.query.get_or_404(center_id)
@@ -44,16 +69,50 @@ def update_recycling_center(center_id):
     data = request.get_json()
     
     try:
+        previous = change_feed.snapshot(center)
         for key, value in data.items():
             if hasattr(center, key):
                 setattr(center, key, value)
         
         db.session.commit()
+        change_feed.publish('recycling-centers', 'updated', change_feed.diff(previous, change_feed.snapshot(center)))
         return jsonify(center.to_dict())
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
+# Partial update in one statement, refused with 409 when the version from
+# If-Match or the body is stale
+@recycling_centers_bp.route('/api/recycling-centers/<int:center_id>', methods=['PATCH'])
+def patch_recycling_center(center_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    if 'capacity' in data and 'throughput_kg_per_day' not in data and parse_capacity(data['capacity']) is not None:
+        data = {**data, 'throughput_kg_per_day': parse_capacity(data['capacity'])}
+    try:
+        result = patch_row(RecyclingCenter, center_id, data, expected_version(data))
+        if result is None:
+            db.session.rollback()
+            return jsonify({'error': 'Recycling center not found'}), 404
+        _, new = result
+        if 'materials' in data:
+            sync_center_materials(db.session.connection(), center_id, new.materials)
+        db.session.commit()
+    except VersionConflict as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'version': e.current}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    result = RecyclingCenter.to_dict(new)
+    change_feed.publish('recycling-centers', 'updated', {
+        'id': center_id, 'version': new.version, **{key: result[key] for key in data if key in result}
+    })
+    response = jsonify(result)
+    response.headers['ETag'] = f'"{new.version}"'
+    return response
+
 @recycling_centers_bp.route('/api/recycling-centers/<int:center_id>', methods=['DELETE'])
 def delete_recycling_center(center_id):
     center = RecyclingCenter.query.get_or_404(center_id)
@@ -61,6 +120,7 @@ def delete_recycling_center(center_id):
     try:
         db.session.delete(center)
         db.session.commit()
+        change_feed.publish('recycling-centers', 'deleted', {'id': center_id})
         return '', 204
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,21 @@
+from flask import Blueprint, jsonify, request
+from datetime import datetime
+from route_planner import plan_route, DEFAULT_TIME_BUDGET_MS, MAX_TIME_BUDGET_MS
+
+route_planning_bp = Blueprint('route_planning', __name__, url_prefix='/api/routes')
+
+
+@route_planning_bp.route('/plan', methods=['GET'])
+def get_route_plan():
+    team = request.args.get('team')
+    if not team:
+        return jsonify({'error': 'Missing parameter: team'}), 400
+    try:
+        day = datetime.fromisoformat(request.args['date']) if request.args.get('date') else datetime.now()
+        depot = None
+        if request.args.get('depot_lat') or request.args.get('depot_lon'):
+            depot = (float(request.args['depot_lat']), float(request.args['depot_lon']))
+        time_budget_ms = min(int(request.args.get('time_budget_ms', DEFAULT_TIME_BUDGET_MS)), MAX_TIME_BUDGET_MS)
+    except (KeyError, ValueError):
+        return jsonify({'error': 'Invalid date, depot_lat/depot_lon or time_budget_ms'}), 400
+    return jsonify(plan_route(team, day, depot, time_budget_ms))
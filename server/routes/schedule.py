@@ -0,0 +1,138 @@
+from flask import Blueprint, jsonify, request
+from datetime import date, datetime
+from models import db, Collection, Team
+from scheduler import (
+    dispatch, schedule, parse_shift_time, DEFAULT_HORIZON_DAYS, MAX_HORIZON_DAYS,
+    DEFAULT_TIME_BUDGET_MS, MAX_TIME_BUDGET_MS, DEFAULT_WASTE_TYPE, DEFAULT_SHIFT_START, DEFAULT_SHIFT_END
+)
+from statistics_rollup import collection_state, record_collection_change
+import analytics
+import change_feed
+
+schedule_bp = Blueprint('schedule', __name__, url_prefix='/api')
+
+TEAM_FIELDS = ['name', 'max_stops', 'shift_start', 'shift_end', 'depot_latitude', 'depot_longitude', 'active']
+
+
+def _horizon(values):
+    start = date.fromisoformat(values['start']) if values.get('start') else None
+    days = int(values.get('days', DEFAULT_HORIZON_DAYS))
+    if not 1 <= days <= MAX_HORIZON_DAYS:
+        raise ValueError(f"days must be between 1 and {MAX_HORIZON_DAYS}")
+    return start, days
+
+
+def _time_budget_ms(values):
+    return min(int(values.get('time_budget_ms', DEFAULT_TIME_BUDGET_MS)), MAX_TIME_BUDGET_MS)
+
+
+@schedule_bp.route('/schedule', methods=['GET'])
+def get_schedule():
+    try:
+        start, days = _horizon(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(schedule(start, days, request.args.get('team')))
+
+
+# Assigns all pending demand: {"start": "2024-06-03", "days": 7,
+# "time_budget_ms": 2000, "dry_run": true}
+@schedule_bp.route('/schedule/dispatch', methods=['POST'])
+def dispatch_schedule():
+    data = request.get_json(silent=True) or {}
+    try:
+        start, days = _horizon(data)
+        time_budget_ms = _time_budget_ms(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        return jsonify(dispatch(start, days, time_budget_ms, dry_run=bool(data.get('dry_run'))))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# A requested pickup at a collection point address, placed into the existing
+# schedule on or after the requested day
+@schedule_bp.route('/schedule/requests', methods=['POST'])
+def create_pickup_request():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('location'):
+        return jsonify({'error': 'Missing field: location'}), 400
+    try:
+        requested = datetime.fromisoformat(data['date_time']) if data.get('date_time') else datetime.now()
+        start, days = _horizon(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    collection = Collection(location=data['location'], date_time=requested,
+                            waste_type=data.get('waste_type') or DEFAULT_WASTE_TYPE,
+                            assigned_team='', status='scheduled', notes=data.get('notes'))
+    db.session.add(collection)
+    record_collection_change(None, collection_state(collection))
+    db.session.commit()
+    analytics.invalidate_dates(collection.date_time)
+    change_feed.publish('collections', 'created', collection.to_dict())
+
+    try:
+        result = dispatch(start or requested.date(), days, _time_budget_ms(data), collection_ids=[collection.id])
+    except Exception as e:
+        return jsonify({'error': str(e), 'collection': collection.to_dict()}), 500
+    db.session.refresh(collection)
+    status_code = 201 if result['scheduled'] else 202
+    return jsonify({
+        'collection': collection.to_dict(),
+        'unscheduled': result['unscheduled'],
+        'elapsed_ms': result['elapsed_ms'],
+    }), status_code
+
+
+def _apply_team_fields(team, data):
+    unknown = set(data) - set(TEAM_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    for key in ('shift_start', 'shift_end'):
+        if key in data:
+            parse_shift_time(data[key])
+    for key, value in data.items():
+        setattr(team, key, value)
+    if team.max_stops is not None and int(team.max_stops) < 1:
+        raise ValueError('max_stops must be positive')
+    if (parse_shift_time(team.shift_start or DEFAULT_SHIFT_START)
+            >= parse_shift_time(team.shift_end or DEFAULT_SHIFT_END)):
+        raise ValueError('shift_end must be after shift_start')
+
+
+@schedule_bp.route('/teams', methods=['GET'])
+def get_teams():
+    return jsonify([team.to_dict() for team in Team.query.order_by(Team.name).all()])
+
+
+@schedule_bp.route('/teams', methods=['POST'])
+def create_team():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('name'):
+        return jsonify({'error': 'Missing field: name'}), 400
+    team = Team()
+    try:
+        _apply_team_fields(team, data)
+        db.session.add(team)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return jsonify(team.to_dict()), 201
+
+
+@schedule_bp.route('/teams/<int:id>', methods=['PUT'])
+def update_team(id):
+    team = Team.query.get_or_404(id)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        _apply_team_fields(team, data)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    return jsonify(team.to_dict())
@@ -0,0 +1,21 @@
+from flask import Blueprint, jsonify, request
+from search import INDEXES, DEFAULT_LIMIT, MAX_LIMIT, search
+
+search_bp = Blueprint('search', __name__, url_prefix='/api')
+
+
+# /api/search?q=shivaji marg&types=collection_points,recycling_centers&limit=20
+@search_bp.route('/search', methods=['GET'])
+def search_records():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing parameter: q'}), 400
+    types = [name.strip() for name in request.args.get('types', '').split(',') if name.strip()]
+    unknown = [name for name in types if name not in INDEXES]
+    if unknown:
+        return jsonify({'error': f"Unknown types: {', '.join(unknown)}"}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    return jsonify({'query': query, 'results': search(query, types, limit)})
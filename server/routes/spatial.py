@@ -0,0 +1,114 @@
+from flask import Blueprint, jsonify, request
+from models import CollectionPoint, RecyclingCenter, resolve_collection_dates
+from spatial import within_bbox, within_radius, nearest
+from map_clusters import MAX_ZOOM, clusters_in_bbox
+
+spatial_bp = Blueprint('spatial', __name__, url_prefix='/api')
+
+MAX_NEAREST = 100
+MAX_RADIUS_KM = 50
+
+
+def _float_arg(name):
+    value = request.args.get(name)
+    if value is None:
+        raise ValueError(f"Missing parameter: {name}")
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: expected a number")
+
+
+def _location_args():
+    latitude, longitude = _float_arg('lat'), _float_arg('lon')
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError('lat/lon out of range')
+    return latitude, longitude
+
+
+def _k_arg():
+    try:
+        k = int(request.args.get('k', 5))
+    except ValueError:
+        raise ValueError('Invalid k: expected a whole number')
+    if k < 1:
+        raise ValueError('Invalid k: must be at least 1')
+    return min(k, MAX_NEAREST)
+
+
+def _points_to_dicts(matches):
+    collection_dates = resolve_collection_dates([point for point, _ in matches])
+    return [
+        {**point.to_dict(collection_dates), 'distance_km': round(distance, 3)} if distance is not None
+        else point.to_dict(collection_dates)
+        for point, distance in matches
+    ]
+
+
+def _centers_to_dicts(matches):
+    return [{**center.to_dict(), 'distance_km': round(distance, 3)} for center, distance in matches]
+
+
+def _bbox_arg():
+    try:
+        bbox = [float(value) for value in request.args.get('bbox', '').split(',')]
+        if len(bbox) != 4:
+            raise ValueError
+    except ValueError:
+        raise ValueError('Invalid bbox: expected south,west,north,east')
+    return bbox
+
+
+# bbox=south,west,north,east
+@spatial_bp.route('/collection-points/within', methods=['GET'])
+def get_collection_points_within():
+    try:
+        bbox = _bbox_arg()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    points = within_bbox(CollectionPoint, *bbox)
+    return jsonify(_points_to_dicts([(point, None) for point in points]))
+
+
+@spatial_bp.route('/collection-points/nearest', methods=['GET'])
+def get_nearest_collection_points():
+    try:
+        latitude, longitude = _location_args()
+        k = _k_arg()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_points_to_dicts(nearest(CollectionPoint, latitude, longitude, k)))
+
+
+@spatial_bp.route('/collection-points/radius', methods=['GET'])
+def get_collection_points_in_radius():
+    try:
+        latitude, longitude = _location_args()
+        radius_km = min(_float_arg('radius_km'), MAX_RADIUS_KM)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_points_to_dicts(within_radius(CollectionPoint, latitude, longitude, radius_km)))
+
+
+@spatial_bp.route('/recycling-centers/nearest', methods=['GET'])
+def get_nearest_recycling_centers():
+    try:
+        latitude, longitude = _location_args()
+        k = _k_arg()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(_centers_to_dicts(nearest(RecyclingCenter, latitude, longitude, k)))
+
+
+# Collection point clusters visible in the viewport:
+# bbox=south,west,north,east&zoom=12
+@spatial_bp.route('/map/clusters', methods=['GET'])
+def get_map_clusters():
+    try:
+        bbox = _bbox_arg()
+        zoom = request.args.get('zoom', '')
+        if not zoom.isdigit() or int(zoom) > MAX_ZOOM:
+            raise ValueError(f'Invalid zoom: expected 0 to {MAX_ZOOM}')
+        return jsonify(clusters_in_bbox(*bbox, int(zoom)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
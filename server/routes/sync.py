@@ -0,0 +1,22 @@
+from flask import Blueprint, jsonify, request
+from sync import RESOURCES, DEFAULT_LIMIT, MAX_LIMIT, changes_since
+
+sync_bp = Blueprint('sync', __name__, url_prefix='/api')
+
+
+# /api/sync?since=<next from the previous response>&resources=collections&limit=500
+# Start with since=0 and repeat while more is true; watermarks are opaque
+@sync_bp.route('/sync', methods=['GET'])
+def sync_changes():
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_LIMIT)), MAX_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    resources = [name.strip() for name in request.args.get('resources', '').split(',') if name.strip()]
+    unknown = [name for name in resources if name not in RESOURCES]
+    if unknown:
+        return jsonify({'error': f"Unknown resources: {', '.join(unknown)}"}), 400
+    try:
+        return jsonify(changes_since(request.args.get('since', '0'), resources, limit))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
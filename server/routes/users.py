@@ -0,0 +1,191 @@
+from flask import Blueprint, jsonify, request
+from sqlalchemy.exc import IntegrityError
+from models import db, Collection, RewardLedger, RewardSnapshot, User, UserBalance
+from rewards import (
+    InsufficientBalance, USER_ROLES, DEFAULT_LEADERBOARD_SIZE, MAX_LEADERBOARD_SIZE,
+    DEFAULT_LEDGER_LIMIT, MAX_LEDGER_LIMIT, adjust, leaderboard, ledger_entries, redeem
+)
+
+users_bp = Blueprint('users', __name__, url_prefix='/api/users')
+
+USER_FIELDS = ['name', 'phone', 'email', 'role', 'area']
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def _apply_user_fields(user, data):
+    unknown = set(data) - set(USER_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if 'role' in data and data['role'] not in USER_ROLES:
+        raise ValueError(f"Invalid role: expected one of {', '.join(USER_ROLES)}")
+    if 'name' in data and not data['name']:
+        raise ValueError('name cannot be empty')
+    for key, value in data.items():
+        setattr(user, key, value)
+
+
+# (user, balance) or None
+def _user_with_balance(id):
+    return db.session.query(User, UserBalance).outerjoin(
+        UserBalance, UserBalance.user_id == User.id
+    ).filter(User.id == id).first()
+
+
+@users_bp.route('', methods=['GET'])
+def get_users():
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+        after = int(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    query = db.session.query(User, UserBalance).outerjoin(UserBalance, UserBalance.user_id == User.id)
+    if request.args.get('role'):
+        query = query.filter(User.role == request.args['role'])
+    if after is not None:
+        query = query.filter(User.id > after)
+    rows = query.order_by(User.id).limit(limit + 1).all()
+    response = jsonify([user.to_dict(balance) for user, balance in rows[:limit]])
+    if len(rows) > limit:
+        response.headers['X-Next-Cursor'] = str(rows[limit - 1][0].id)
+    return response
+
+
+@users_bp.route('', methods=['POST'])
+def create_user():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data.get('name'):
+        return jsonify({'error': 'Missing field: name'}), 400
+    user = User()
+    try:
+        _apply_user_fields(user, data)
+        db.session.add(user)
+        db.session.flush()
+        balance = UserBalance(user_id=user.id, role=user.role)
+        db.session.add(balance)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'A user with this phone or email already exists'}), 409
+    return jsonify(user.to_dict(balance)), 201
+
+
+@users_bp.route('/leaderboard', methods=['GET'])
+def get_leaderboard():
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_LEADERBOARD_SIZE)), MAX_LEADERBOARD_SIZE))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    return jsonify(leaderboard(limit, request.args.get('role')))
+
+
+@users_bp.route('/<int:user_id>', methods=['GET'])
+def get_user(user_id):
+    row = _user_with_balance(user_id)
+    if row is None:
+        return jsonify({'error': 'User not found'}), 404
+    user, balance = row
+    return jsonify(user.to_dict(balance))
+
+
+@users_bp.route('/<int:user_id>', methods=['PUT'])
+def update_user(user_id):
+    row = _user_with_balance(user_id)
+    if row is None:
+        return jsonify({'error': 'User not found'}), 404
+    user, balance = row
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        _apply_user_fields(user, data)
+        if balance is not None:
+            balance.role = user.role
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'error': 'A user with this phone or email already exists'}), 409
+    return jsonify(user.to_dict(balance))
+
+
+# Users with collections or rewards history are kept so the ledger stays
+# complete
+@users_bp.route('/<int:user_id>', methods=['DELETE'])
+def delete_user(user_id):
+    user = db.session.get(User, user_id)
+    if user is None:
+        return jsonify({'error': 'User not found'}), 404
+    history = (
+        db.session.query(Collection.id).filter(Collection.user_id == user_id).first()
+        or db.session.query(RewardLedger.seq).filter(RewardLedger.user_id == user_id).first()
+        or db.session.get(RewardSnapshot, user_id)
+    )
+    if history:
+        return jsonify({'error': 'User has collections or rewards history'}), 409
+    db.session.query(UserBalance).filter(UserBalance.user_id == user_id).delete()
+    db.session.delete(user)
+    db.session.commit()
+    return '', 204
+
+
+@users_bp.route('/<int:user_id>/ledger', methods=['GET'])
+def get_ledger(user_id):
+    if db.session.get(User, user_id) is None:
+        return jsonify({'error': 'User not found'}), 404
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_LEDGER_LIMIT)), MAX_LEDGER_LIMIT))
+        before = int(request.args['cursor']) if request.args.get('cursor') else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    entries, next_cursor = ledger_entries(user_id, before, limit)
+    snapshot = db.session.get(RewardSnapshot, user_id)
+    response = jsonify({
+        'entries': entries,
+        'compacted': {
+            'balance': snapshot.balance,
+            'lifetime_points': snapshot.lifetime_points,
+            'collections': snapshot.collections,
+            'waste_collected': snapshot.waste_collected,
+            'through_seq': snapshot.through_seq,
+        } if snapshot else None
+    })
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+
+# {"points": 200, "note": "Bus pass"}
+@users_bp.route('/<int:user_id>/redeem', methods=['POST'])
+def redeem_points(user_id):
+    return _book_entry(user_id, redeem)
+
+
+# {"points": -50, "note": "Duplicate pickup"}
+@users_bp.route('/<int:user_id>/adjustments', methods=['POST'])
+def adjust_points(user_id):
+    return _book_entry(user_id, adjust)
+
+
+def _book_entry(user_id, book):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    if db.session.get(User, user_id) is None:
+        return jsonify({'error': 'User not found'}), 404
+    try:
+        book(user_id, data.get('points'), data.get('note'))
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except InsufficientBalance as e:
+        db.session.rollback()
+        return jsonify({'error': str(e), 'balance': e.balance}), 409
+    user, balance = _user_with_balance(user_id)
+    return jsonify(user.to_dict(balance)), 201
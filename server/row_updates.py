@@ -0,0 +1,175 @@
+from datetime import datetime
+from flask import request
+from sqlalchemy import DateTime, case, func, select, update
+from models import db, Collection
+from collection_queries import FILTER_FIELDS, filtered_query
+from bulk_ingest import COLLECTION_STATUSES
+from statistics_rollup import record_completed_totals
+from spatial import grid_cell
+from sync import RESOURCE_NAMES, record_changes
+
+# Set-based writes. A PATCH is one UPDATE ... RETURNING guarded by the row's
+# version column, so a client editing a stale copy gets a conflict instead of
+# silently overwriting someone else's change. Bulk transitions update every
+# matching collection in one statement. Neither loads ORM objects, so the
+# grid cell, version and sync log are maintained here; routes still apply
+# the analytics and change feed hooks after committing.
+
+READ_ONLY_COLUMNS = {'id', 'version', 'created_at', 'updated_at', 'grid_cell'}
+TRANSITION_FIELDS = {'status', 'assigned_team', 'notes', 'waste_collected'}
+MAX_TRANSITION_WEIGHTS = 5000
+
+
+class VersionConflict(Exception):
+    def __init__(self, current):
+        super().__init__(f"Version conflict: the record is at version {current}")
+        self.current = current
+
+
+# Version the client last saw, from If-Match or a "version" field in the body
+def expected_version(data):
+    body_version = data.pop('version', None)
+    header = request.headers.get('If-Match', '').strip()
+    if header.startswith('W/'):
+        header = header[2:]
+    value = header.strip('"') or body_version
+    if value in (None, '', '*'):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid version')
+
+
+def _column_values(table, data):
+    values = {}
+    for key, value in data.items():
+        if key not in table.c or key in READ_ONLY_COLUMNS:
+            raise ValueError(f"Unknown or read-only field: {key}")
+        column = table.c[key]
+        if isinstance(column.type, DateTime) and isinstance(value, str):
+            try:
+                value = datetime.fromisoformat(value)
+            except ValueError:
+                raise ValueError(f"Invalid {key}: expected an ISO datetime")
+        if value is None and not column.nullable:
+            raise ValueError(f"{key} cannot be null")
+        values[key] = value
+    if not values:
+        raise ValueError('No fields to update')
+    return values
+
+
+# Applies data to one row and returns (old, new). old holds the previous
+# values of old_columns, read only when the patch touches one of them; new is
+# the updated row. Returns None when the row does not exist.
+def patch_row(model, id, data, version=None, old_columns=()):
+    table = model.__table__
+    values = _column_values(table, data)
+    if 'updated_at' in table.c:
+        values['updated_at'] = datetime.utcnow()
+
+    # Core updates skip the ORM listener that keeps grid cells current
+    located = 'grid_cell' in table.c and ('latitude' in values or 'longitude' in values)
+    if located:
+        old_columns = tuple(old_columns) + ('latitude', 'longitude')
+
+    old = None
+    if any(name in data for name in old_columns):
+        old = db.session.execute(
+            select(*[table.c[name] for name in old_columns]).where(table.c.id == id).with_for_update()
+        ).first()
+        if old is None:
+            return None
+    if located:
+        values['grid_cell'] = grid_cell(values.get('latitude', old.latitude), values.get('longitude', old.longitude))
+
+    statement = update(table).where(table.c.id == id)
+    if version is not None:
+        statement = statement.where(table.c.version == version)
+    new = db.session.execute(
+        statement.values(**values, version=table.c.version + 1).returning(*table.c)
+    ).first()
+    if new is None:
+        current = db.session.execute(select(table.c.version).where(table.c.id == id)).scalar()
+        if current is None:
+            return None
+        raise VersionConflict(current)
+    record_changes(db.session.connection(), RESOURCE_NAMES[model], [id])
+    return old, new
+
+
+def _completed_totals(rows):
+    totals = {}
+    for waste_type, count, total in rows:
+        current = totals.get(waste_type, (0, 0.0))
+        totals[waste_type] = (current[0] + count, current[1] + (total or 0.0))
+    return totals
+
+
+def _transition_condition(where):
+    if not where:
+        raise ValueError('A where filter is required')
+    unknown = set(where) - set(FILTER_FIELDS) - {'start', 'end', 'ids'}
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+    args = {
+        key: ','.join(str(item) for item in value) if isinstance(value, list) else str(value)
+        for key, value in where.items() if key != 'ids'
+    }
+    conditions = []
+    whereclause = filtered_query(Collection, args).whereclause
+    if whereclause is not None:
+        conditions.append(whereclause)
+    if 'ids' in where:
+        try:
+            conditions.append(Collection.id.in_([int(id) for id in where['ids']]))
+        except (TypeError, ValueError):
+            raise ValueError('ids must be a list of integers')
+    return conditions
+
+
+# Updates every collection matching where in one statement, e.g. completing
+# a team's in_progress collections with per-collection weights. weights maps
+# collection ids to kilograms and overrides waste_collected for those rows.
+# Returns the updated rows.
+def transition_collections(where, values, weights=None):
+    conditions = _transition_condition(where)
+    unknown = set(values) - TRANSITION_FIELDS
+    if unknown:
+        raise ValueError(f"Fields cannot be set in a transition: {', '.join(sorted(unknown))}")
+    if 'status' in values and values['status'] not in COLLECTION_STATUSES:
+        raise ValueError(f"Invalid status: expected one of {', '.join(COLLECTION_STATUSES)}")
+    try:
+        weights = {int(id): float(kg) for id, kg in (weights or {}).items()}
+    except (TypeError, ValueError):
+        raise ValueError('weights must map collection ids to numbers')
+    if len(weights) > MAX_TRANSITION_WEIGHTS:
+        raise ValueError(f"At most {MAX_TRANSITION_WEIGHTS} weights per transition")
+    if not values and not weights:
+        raise ValueError('Nothing to update')
+
+    table = Collection.__table__
+    assignments = dict(values)
+    if weights:
+        assignments['waste_collected'] = case(
+            weights, value=table.c.id, else_=values.get('waste_collected', table.c.waste_collected)
+        )
+
+    # The rollup only counts completed collections, so their totals before
+    # and after the update are enough to keep it exact
+    waste_type = func.lower(table.c.waste_type)
+    before = db.session.execute(
+        select(waste_type, func.count(), func.sum(table.c.waste_collected))
+        .where(*conditions, table.c.status == 'completed')
+        .group_by(waste_type)
+    ).all()
+    rows = db.session.execute(
+        update(table).where(*conditions)
+        .values(**assignments, version=table.c.version + 1)
+        .returning(*table.c)
+    ).all()
+    after = [(row.waste_type.lower(), 1, row.waste_collected) for row in rows if row.status == 'completed']
+    record_completed_totals(_completed_totals(before), _completed_totals(after))
+    record_changes(db.session.connection(), 'collections', [row.id for row in rows])
+    return rows
@@ -0,0 +1,577 @@
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert
+from models import db, Collection, CollectionPoint, Team, ACTIVE_COLLECTION_STATUSES, ADDRESS_CHUNK_SIZE
+from fill_forecast import forecaster, FULL_THRESHOLD
+from spatial import KM_PER_DEGREE
+from statistics_rollup import collection_state, record_collection_changes
+from sync import record_changes
+import analytics
+import change_feed
+
+# Automatic assignment of pending demand to team shifts. Demand is every
+# collection point that is full, at NEAR_FULL_CAPACITY or forecast to fill
+# within the horizon and has no active collection yet, plus requested
+# pickups: scheduled collections whose assigned_team is left blank. Each team
+# works one shift a day of at most max_stops stops and shift_end - shift_start
+# minutes of driving and service time.
+#
+# Stops are placed most urgent first at their cheapest insertion point in the
+# shift routes of nearby teams. The cost of a placement is the added travel
+# and service time, a convex penalty on shift utilisation that spreads work
+# across teams and days, and a penalty per day the stop is served before or
+# after it is due. A relocate local search then moves placed stops while the
+# time budget lasts. Collections already assigned stay fixed, so a dispatch
+# inserts new demand into the existing schedule rather than re-solving it.
+
+DEFAULT_HORIZON_DAYS = 7
+MAX_HORIZON_DAYS = 14
+DEFAULT_TIME_BUDGET_MS = 2000
+MAX_TIME_BUDGET_MS = 10000
+NEAR_FULL_CAPACITY = 75.0
+# Near-full points without a forecast are due this many days out
+NEAR_FULL_DUE_DAYS = 1
+DEFAULT_MAX_STOPS = 30
+DEFAULT_SHIFT_START = '07:00'
+DEFAULT_SHIFT_END = '15:00'
+DEFAULT_WASTE_TYPE = 'general'
+UNASSIGNED_TEAMS = ('', 'Unassigned')
+SCHEDULED_NOTE = 'Scheduled automatically'
+
+SERVICE_MINUTES = 6
+# Straight-line speed, so it also absorbs detours and traffic
+AVERAGE_SPEED_KMH = 15.0
+MINUTES_PER_KM = 60 / AVERAGE_SPEED_KMH
+# Minutes a shift at full utilisation costs on top of its working time
+BALANCE_WEIGHT = 240.0
+LATE_DAY_PENALTY = 480.0
+EARLY_DAY_PENALTY = 30.0
+# Teams considered per stop, nearest first by depot or recent work area
+CANDIDATE_TEAMS = 8
+ANCHOR_DAYS = 30
+EPSILON_MINUTES = 1e-6
+
+_dispatch_lock = threading.Lock()
+
+
+def parse_shift_time(value):
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def _team_spec(name, max_stops=DEFAULT_MAX_STOPS, shift_start=DEFAULT_SHIFT_START,
+               shift_end=DEFAULT_SHIFT_END, depot=None):
+    return {
+        'name': name,
+        'max_stops': max_stops,
+        'shift_start': parse_shift_time(shift_start),
+        'shift_end': parse_shift_time(shift_end),
+        'depot': depot,
+    }
+
+
+# Active teams from the teams table. Until it has rows, every team that
+# worked in the last ANCHOR_DAYS days is scheduled with the default shift.
+def load_teams(now):
+    teams = Team.query.filter(Team.active.is_(True)).order_by(Team.name).all()
+    if teams:
+        return [_team_spec(
+            team.name, team.max_stops, team.shift_start, team.shift_end,
+            (team.depot_latitude, team.depot_longitude) if team.depot_latitude is not None
+            and team.depot_longitude is not None else None
+        ) for team in teams]
+    names = db.session.query(Collection.assigned_team).filter(
+        Collection.date_time >= now - timedelta(days=ANCHOR_DAYS),
+        Collection.assigned_team.notin_(UNASSIGNED_TEAMS)
+    ).distinct().all()
+    return [_team_spec(name) for name, in sorted(names)]
+
+
+def _coordinates(addresses):
+    addresses = list(addresses)
+    coordinates = {}
+    for start in range(0, len(addresses), ADDRESS_CHUNK_SIZE):
+        rows = db.session.query(
+            CollectionPoint.address, CollectionPoint.id, CollectionPoint.latitude, CollectionPoint.longitude
+        ).filter(CollectionPoint.address.in_(addresses[start:start + ADDRESS_CHUNK_SIZE])).all()
+        for address, id, latitude, longitude in rows:
+            coordinates.setdefault(address, (id, latitude, longitude))
+    return coordinates
+
+
+# Centre of each team's stops over the last ANCHOR_DAYS days, used to pick
+# candidate teams for teams without a depot
+def _work_areas(names, now):
+    rows = db.session.query(
+        Collection.assigned_team, func.avg(CollectionPoint.latitude), func.avg(CollectionPoint.longitude)
+    ).join(CollectionPoint, CollectionPoint.address == Collection.location).filter(
+        Collection.date_time >= now - timedelta(days=ANCHOR_DAYS),
+        Collection.assigned_team.in_(names)
+    ).group_by(Collection.assigned_team).all()
+    return {name: (latitude, longitude) for name, latitude, longitude in rows if latitude is not None}
+
+
+class Stop:
+    __slots__ = ('collection_id', 'point_id', 'location', 'x', 'y', 'due', 'earliest', 'reason',
+                 'fixed', 'date_time', 'status', 'shift', 'candidates', 'eta')
+
+    def __init__(self, location, point_id=None, xy=None, collection_id=None, due=None, earliest=None,
+                 reason=None, fixed=False, date_time=None, status='scheduled'):
+        self.collection_id = collection_id
+        self.point_id = point_id
+        self.location = location
+        self.x, self.y = xy if xy else (None, None)
+        self.due = due
+        self.earliest = earliest
+        self.reason = reason
+        self.fixed = fixed
+        self.date_time = date_time
+        self.status = status
+        self.shift = None
+        self.candidates = ()
+        self.eta = None
+
+
+def _distance(a, b):
+    return math.hypot(a[0] - b[0], a[1] - b[1])
+
+
+class Shift:
+    # One team on one day: an open route from the depot, or from the first
+    # stop when the team has no depot. legs[i] is the distance into stops[i].
+    def __init__(self, team, day, start, minutes, depot):
+        self.team = team
+        self.day = day
+        self.start = start
+        self.minutes = minutes
+        self.max_stops = team['max_stops']
+        self.depot = depot
+        self.stops = []
+        self.legs = []
+        self.km = 0.0
+        # Fixed stops whose address has no collection point still take time
+        self.unlocated = []
+
+    def _update(self):
+        previous = self.depot
+        self.legs = []
+        for stop in self.stops:
+            here = (stop.x, stop.y)
+            self.legs.append(_distance(previous, here) if previous else 0.0)
+            previous = here
+        self.km = sum(self.legs)
+
+    def count(self):
+        return len(self.stops) + len(self.unlocated)
+
+    def load(self, km=None, count=None):
+        km = self.km if km is None else km
+        count = self.count() if count is None else count
+        return km * MINUTES_PER_KM + count * SERVICE_MINUTES
+
+    def cost(self, km=None, count=None):
+        load = self.load(km, count)
+        return load + BALANCE_WEIGHT * (load / self.minutes) ** 2
+
+    # Cheapest (added km, position) for stop, ignoring capacity
+    def insertion(self, stop):
+        here = (stop.x, stop.y)
+        distances = [_distance(here, (other.x, other.y)) for other in self.stops]
+        count = len(self.stops)
+        best_km, best_position = None, 0
+        for position in range(count + 1):
+            if position == 0:
+                added = _distance(self.depot, here) if self.depot else 0.0
+            else:
+                added = distances[position - 1]
+            if position < count:
+                added += distances[position] - self.legs[position]
+            if best_km is None or added < best_km:
+                best_km, best_position = added, position
+        return best_km, best_position
+
+    def insert(self, stop, position):
+        self.stops.insert(position, stop)
+        stop.shift = self
+        self._update()
+
+    def remove(self, stop):
+        self.stops.remove(stop)
+        stop.shift = None
+        self._update()
+
+    # Arrival times along the route
+    def arrivals(self):
+        elapsed = 0.0
+        for stop, leg in zip(self.stops, self.legs):
+            elapsed += leg * MINUTES_PER_KM
+            yield stop, self.start + timedelta(minutes=elapsed)
+            elapsed += SERVICE_MINUTES
+
+    def summary(self):
+        load = self.load()
+        return {
+            'team': self.team['name'],
+            'date': self.day.isoformat(),
+            'stops': self.count(),
+            'new_stops': sum(1 for stop in self.stops if not stop.fixed),
+            'travel_km': round(self.km, 2),
+            'load_minutes': round(load, 1),
+            'available_minutes': round(self.minutes, 1),
+            'utilisation': round(load / self.minutes, 3),
+        }
+
+
+def _day_penalty(stop, day):
+    offset = (day - stop.due).days
+    return LATE_DAY_PENALTY * offset if offset > 0 else EARLY_DAY_PENALTY * -offset
+
+
+class Planner:
+    def __init__(self, teams, start, days, now):
+        self.teams = {team['name']: team for team in teams}
+        self.days = [start + timedelta(days=offset) for offset in range(days)]
+        self.now = now
+        self.stops = []
+        self.unscheduled = []
+        self._cos = None
+        self.shifts = {}
+
+    def project(self, latitude, longitude):
+        # Equirectangular projection, exact enough at city scale and much
+        # cheaper than Haversine inside the insertion loops
+        if self._cos is None:
+            self._cos = math.cos(math.radians(latitude))
+        return longitude * self._cos * KM_PER_DEGREE, latitude * KM_PER_DEGREE
+
+    def build_shifts(self):
+        for team in self.teams.values():
+            depot = self.project(*team['depot']) if team['depot'] else None
+            for day in self.days:
+                start = datetime.combine(day, team['shift_start'])
+                end = datetime.combine(day, team['shift_end'])
+                start = max(start, self.now)
+                minutes = (end - start).total_seconds() / 60
+                if minutes > 0:
+                    self.shifts[(team['name'], day)] = Shift(team, day, start, minutes, depot)
+
+    def add_fixed(self, stop, team, day):
+        shift = self.shifts.get((team, day))
+        if shift is None:
+            return
+        if stop.x is None:
+            shift.unlocated.append(stop)
+        else:
+            shift.stops.append(stop)
+            stop.shift = shift
+
+    def assign_candidates(self, anchors):
+        anchored = {name: self.project(*anchor) for name, anchor in anchors.items()}
+        unanchored = [name for name in self.teams if name not in anchored]
+        for stop in self.stops:
+            nearest = sorted(anchored, key=lambda name: _distance(anchored[name], (stop.x, stop.y)))
+            names = nearest[:CANDIDATE_TEAMS] + unanchored
+            stop.candidates = [
+                self.shifts[(name, day)] for name in names for day in self.days
+                if day >= stop.earliest and (name, day) in self.shifts
+            ]
+
+    # (cost, added km, position, shift) of the cheapest feasible placement
+    def best_placement(self, stop):
+        best = None
+        for shift in stop.candidates:
+            if shift.count() >= shift.max_stops:
+                continue
+            added_km, position = shift.insertion(stop)
+            km = shift.km + added_km
+            count = shift.count() + 1
+            if shift.load(km, count) > shift.minutes:
+                continue
+            cost = shift.cost(km, count) - shift.cost() + _day_penalty(stop, shift.day)
+            if best is None or cost < best[0]:
+                best = (cost, added_km, position, shift)
+        return best
+
+    def greedy(self):
+        placed = []
+        for stop in sorted(self.stops, key=lambda stop: (stop.due, len(stop.candidates))):
+            best = self.best_placement(stop)
+            if best is None:
+                self.unscheduled.append(stop)
+                continue
+            best[3].insert(stop, best[2])
+            placed.append(stop)
+        return placed
+
+    # Moves single stops to their cheapest placement, including elsewhere in
+    # the same route, until no move helps or the deadline passes
+    def local_search(self, placed, deadline, seed=0):
+        rng = random.Random(seed)
+        placed = list(placed)
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            rng.shuffle(placed)
+            for stop in placed:
+                if time.perf_counter() >= deadline:
+                    break
+                source = stop.shift
+                position = source.stops.index(stop)
+                current = source.cost() + _day_penalty(stop, source.day)
+                source.remove(stop)
+                removed = source.cost()
+                best = self.best_placement(stop)
+                if best is not None and best[0] + removed < current - EPSILON_MINUTES:
+                    best[3].insert(stop, best[2])
+                    improved = True
+                else:
+                    source.insert(stop, position)
+
+    def travel_km(self):
+        return sum(shift.km for shift in self.shifts.values())
+
+
+def _load_fixed(planner, start, end):
+    names = list(planner.teams)
+    collections = []
+    for offset in range(0, len(names), ADDRESS_CHUNK_SIZE):
+        collections.extend(db.session.query(
+            Collection.id, Collection.location, Collection.assigned_team, Collection.date_time, Collection.status
+        ).filter(
+            Collection.status.in_(ACTIVE_COLLECTION_STATUSES),
+            Collection.assigned_team.in_(names[offset:offset + ADDRESS_CHUNK_SIZE]),
+            Collection.date_time >= start,
+            Collection.date_time < end
+        ).order_by(Collection.date_time, Collection.id).all())
+    coordinates = _coordinates({collection.location for collection in collections})
+    for collection in collections:
+        point_id, latitude, longitude = coordinates.get(collection.location, (None, None, None))
+        stop = Stop(collection.location, point_id,
+                    planner.project(latitude, longitude) if point_id is not None else None,
+                    collection_id=collection.id, fixed=True, date_time=collection.date_time,
+                    status=collection.status)
+        planner.add_fixed(stop, collection.assigned_team, collection.date_time.date())
+    for shift in planner.shifts.values():
+        shift._update()
+
+
+def _scheduled_locations(addresses, end):
+    addresses = list(addresses)
+    scheduled = set()
+    for start in range(0, len(addresses), ADDRESS_CHUNK_SIZE):
+        scheduled.update(location for location, in db.session.query(Collection.location).filter(
+            Collection.location.in_(addresses[start:start + ADDRESS_CHUNK_SIZE]),
+            Collection.status.in_(ACTIVE_COLLECTION_STATUSES),
+            Collection.date_time < end
+        ).distinct())
+    return scheduled
+
+
+# Full, near-full and forecast-full points with no active collection before
+# the end of the horizon
+def _point_demand(planner, end, threshold):
+    first_day = planner.days[0]
+    hours = (end - planner.now).total_seconds() / 3600
+    predicted = {
+        prediction['point_id']: datetime.fromisoformat(prediction['predicted_full_at'])
+        for prediction in forecaster.predicted_full(hours, threshold, planner.now)
+    }
+    columns = (CollectionPoint.id, CollectionPoint.address, CollectionPoint.latitude,
+               CollectionPoint.longitude, CollectionPoint.capacity)
+    points = {point.id: point for point in db.session.query(*columns).filter(
+        CollectionPoint.capacity >= NEAR_FULL_CAPACITY, CollectionPoint.status != 'Maintenance'
+    )}
+    ids = [id for id in predicted if id not in points]
+    for start in range(0, len(ids), ADDRESS_CHUNK_SIZE):
+        for point in db.session.query(*columns).filter(
+            CollectionPoint.id.in_(ids[start:start + ADDRESS_CHUNK_SIZE]), CollectionPoint.status != 'Maintenance'
+        ):
+            points[point.id] = point
+
+    scheduled = _scheduled_locations({point.address for point in points.values()}, end)
+    seen = set()
+    for point in sorted(points.values(), key=lambda point: point.id):
+        if point.address in scheduled or point.address in seen:
+            continue
+        seen.add(point.address)
+        if (point.capacity or 0) >= threshold:
+            due, reason = first_day, 'full'
+        elif point.id in predicted:
+            due, reason = max(first_day, predicted[point.id].date()), 'predicted_full'
+        else:
+            due, reason = first_day + timedelta(days=NEAR_FULL_DUE_DAYS), 'near_full'
+        planner.stops.append(Stop(point.address, point.id, planner.project(point.latitude, point.longitude),
+                                  due=min(due, planner.days[-1]), earliest=first_day, reason=reason))
+
+
+# Scheduled collections without a team, optionally only the given ids. They
+# are served on or after their requested day.
+def _requested_demand(planner, end, collection_ids=None):
+    first_day = planner.days[0]
+    query = db.session.query(Collection.id, Collection.location, Collection.date_time).filter(
+        Collection.status == 'scheduled',
+        Collection.assigned_team.in_(UNASSIGNED_TEAMS),
+        Collection.date_time < end
+    )
+    if collection_ids is not None:
+        query = query.filter(Collection.id.in_(collection_ids))
+    requests = query.order_by(Collection.id).all()
+    coordinates = _coordinates({request.location for request in requests})
+    for request in requests:
+        day = max(first_day, request.date_time.date())
+        if request.location not in coordinates:
+            planner.unscheduled.append(Stop(request.location, collection_id=request.id, due=day,
+                                            earliest=day, reason='requested'))
+            continue
+        point_id, latitude, longitude = coordinates[request.location]
+        planner.stops.append(Stop(request.location, point_id, planner.project(latitude, longitude),
+                                  collection_id=request.id, due=day, earliest=day, reason='requested',
+                                  date_time=request.date_time))
+
+
+def _plan(start, days, now, include_points=True, collection_ids=None, threshold=FULL_THRESHOLD):
+    teams = load_teams(now)
+    planner = Planner(teams, start, days, now)
+    if not teams:
+        return planner
+    planner.build_shifts()
+    window_start = datetime.combine(start, datetime.min.time())
+    window_end = window_start + timedelta(days=days)
+    _load_fixed(planner, window_start, window_end)
+    if include_points:
+        _point_demand(planner, window_end, threshold)
+    _requested_demand(planner, window_end, collection_ids)
+    anchors = {team['name']: team['depot'] for team in teams if team['depot']}
+    missing = [name for name in planner.teams if name not in anchors]
+    if missing and planner.stops:
+        anchors.update(_work_areas(missing, now))
+    planner.assign_candidates(anchors)
+    return planner
+
+
+def _result(planner, placed, elapsed_ms, dry_run):
+    scheduled = []
+    for stop in sorted(placed, key=lambda stop: (stop.shift.team['name'], stop.eta)):
+        scheduled.append({
+            'collection_id': stop.collection_id,
+            'point_id': stop.point_id,
+            'location': stop.location,
+            'assigned_team': stop.shift.team['name'],
+            'date_time': stop.eta.isoformat(),
+            'due': stop.due.isoformat(),
+            'reason': stop.reason,
+        })
+    unscheduled = [{
+        'collection_id': stop.collection_id,
+        'point_id': stop.point_id,
+        'location': stop.location,
+        'due': stop.due.isoformat(),
+        'reason': stop.reason,
+        'error': 'Unknown location' if stop.x is None else 'No shift has capacity left',
+    } for stop in planner.unscheduled]
+    shifts = [shift.summary() for shift in planner.shifts.values() if shift.count()]
+    utilisation = [shift['utilisation'] for shift in shifts]
+    return {
+        'dry_run': dry_run,
+        'start': planner.days[0].isoformat(),
+        'days': len(planner.days),
+        'teams': len(planner.teams),
+        'scheduled': scheduled,
+        'unscheduled': unscheduled,
+        'shifts': shifts,
+        'travel_km': round(planner.travel_km(), 2),
+        'max_utilisation': max(utilisation, default=0.0),
+        'mean_utilisation': round(sum(utilisation) / len(utilisation), 3) if utilisation else 0.0,
+        'elapsed_ms': round(elapsed_ms, 1),
+    }
+
+
+def _save(placed):
+    new_stops = [stop for stop in placed if stop.collection_id is None]
+    rows = [{
+        'location': stop.location, 'date_time': stop.eta, 'waste_type': DEFAULT_WASTE_TYPE,
+        'assigned_team': stop.shift.team['name'], 'status': 'scheduled', 'notes': SCHEDULED_NOTE,
+        'waste_collected': 0.0, 'created_at': datetime.utcnow(),
+    } for stop in new_stops]
+    changes = [(None, (row['status'], row['waste_type'], row['waste_collected'])) for row in rows]
+    dates = {row['date_time'] for row in rows}
+    ids = []
+    if rows:
+        ids = db.session.execute(
+            insert(Collection).returning(Collection.id, sort_by_parameter_order=True), rows
+        ).scalars().all()
+        record_changes(db.session.connection(), 'collections', ids)
+
+    updated = []
+    for stop in placed:
+        if stop.collection_id is None:
+            continue
+        collection = db.session.get(Collection, stop.collection_id)
+        before = collection_state(collection)
+        dates.update((collection.date_time, stop.eta))
+        collection.assigned_team = stop.shift.team['name']
+        collection.date_time = stop.eta
+        updated.append(collection)
+        changes.append((before, collection_state(collection)))
+    record_collection_changes(changes)
+    db.session.commit()
+    analytics.invalidate_dates(*dates)
+    for stop, id in zip(new_stops, ids):
+        stop.collection_id = id
+    if ids:
+        change_feed.publish('collections', 'bulk_created', {'ids': ids})
+    if updated:
+        change_feed.publish('collections', 'bulk_updated', [{
+            'id': collection.id, 'version': collection.version, 'assigned_team': collection.assigned_team,
+            'date_time': collection.date_time.isoformat()
+        } for collection in updated])
+
+
+# Places pending demand into the team shifts of the days from start and
+# creates or assigns the collections, unless dry_run. collection_ids limits
+# the run to those requested pickups, skipping point demand.
+def dispatch(start=None, days=DEFAULT_HORIZON_DAYS, time_budget_ms=DEFAULT_TIME_BUDGET_MS, dry_run=False,
+             collection_ids=None, threshold=FULL_THRESHOLD, now=None):
+    started = time.perf_counter()
+    now = now or datetime.now()
+    start = max(start or now.date(), now.date())
+    with _dispatch_lock:
+        planner = _plan(start, days, now, include_points=collection_ids is None,
+                        collection_ids=collection_ids, threshold=threshold)
+        placed = planner.greedy()
+        planner.local_search(placed, started + time_budget_ms / 1000)
+        for shift in planner.shifts.values():
+            for stop, arrival in shift.arrivals():
+                if not stop.fixed:
+                    stop.eta = arrival.replace(second=0, microsecond=0)
+        if not dry_run and placed:
+            try:
+                _save(placed)
+            except Exception:
+                db.session.rollback()
+                raise
+        return _result(planner, placed, (time.perf_counter() - started) * 1000, dry_run)
+
+
+# Current assignments per team and day with estimated shift load
+def schedule(start=None, days=DEFAULT_HORIZON_DAYS, team=None, now=None):
+    now = now or datetime.now()
+    start = start or now.date()
+    teams = [spec for spec in load_teams(now) if team is None or spec['name'] == team]
+    planner = Planner(teams, start, days, datetime.combine(start, datetime.min.time()))
+    planner.build_shifts()
+    window_start = datetime.combine(start, datetime.min.time())
+    _load_fixed(planner, window_start, window_start + timedelta(days=days))
+    shifts = []
+    for shift in planner.shifts.values():
+        if not shift.count():
+            continue
+        shifts.append({**shift.summary(), 'collections': [{
+            'id': stop.collection_id,
+            'location': stop.location,
+            'date_time': stop.date_time.isoformat(),
+            'status': stop.status,
+        } for stop in sorted(shift.stops + shift.unlocated, key=lambda stop: stop.date_time)]})
+    return {'start': start.isoformat(), 'days': days, 'shifts': shifts}
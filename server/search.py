@@ -0,0 +1,325 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+from sqlalchemy import or_, text
+from models import db, Collection, CollectionPoint, RecyclingCenter, resolve_collection_dates
+
+# Full-text search over collections, collection points and recycling centers.
+# On SQLite each table has an external-content FTS5 index kept in sync by
+# triggers, so ORM writes, bulk Core inserts and raw SQL all update it. Query
+# words are prefix matched; a word with no prefix match in the index
+# vocabulary is replaced by close spellings of it, compared on a phonetic key
+# that folds common transliteration variants of Hindi/Marathi names
+# (Shivaji/Sivaji, Ghatkopar/Ghatkoper, Vile Parle/Wile Parle).
+#
+# The triggers also count writes in search_index_changes, so the vocabulary
+# only reloads after the indexes changed.
+#
+# Other databases fall back to case-insensitive LIKE filters.
+
+INDEXES = {
+    'collections': (Collection, 'collection_fts', ['location', 'notes']),
+    'collection_points': (CollectionPoint, 'collection_point_fts', ['name', 'address', 'area']),
+    'recycling_centers': (RecyclingCenter, 'recycling_center_fts', ['name', 'address', 'materials']),
+}
+
+TOKENIZER = "unicode61 remove_diacritics 2 categories 'L* N* Co M*'"
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+MAX_WORDS = 8
+MAX_EXPANSIONS = 8
+VOCABULARY_TTL_SECONDS = 60
+CHANGES_TABLE = 'search_index_changes'
+
+WORD_PATTERN = re.compile(r'[\w\u0900-\u097F]+')
+ASPIRATED = re.compile(r'([bcdgjkpt])h')
+REPEATED = re.compile(r'(.)\1+')
+TRANSLITERATIONS = [('sh', 's'), ('aa', 'a'), ('ee', 'i'), ('oo', 'u'), ('ou', 'u'),
+                    ('ph', 'f'), ('ck', 'k'), ('q', 'k'), ('w', 'v'), ('z', 'j'), ('y', 'i')]
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def _index_statements(model, index, columns):
+    table = model.__table__.name
+    column_list = ', '.join(columns)
+    new_values = ', '.join(f'new.{column}' for column in columns)
+    old_values = ', '.join(f'old.{column}' for column in columns)
+    delete = (f"INSERT INTO {index}({index}, rowid, {column_list}) "
+              f"VALUES ('delete', old.id, {old_values});")
+    insert = f"INSERT INTO {index}(rowid, {column_list}) VALUES (new.id, {new_values});"
+    count = f"UPDATE {CHANGES_TABLE} SET version = version + 1;"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5({column_list}, content='{table}', "
+        f"content_rowid='id', tokenize=\"{TOKENIZER}\", prefix='2 3')",
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index}_vocab USING fts5vocab({index}, 'row')",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_insert AFTER INSERT ON {table} BEGIN {insert} {count} END",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_delete AFTER DELETE ON {table} BEGIN {delete} {count} END",
+        f"CREATE TRIGGER IF NOT EXISTS {index}_update AFTER UPDATE OF {column_list} ON {table} "
+        f"BEGIN {delete} {insert} {count} END",
+    ]
+
+
+def init_app(app):
+    vocabulary.ttl = app.config.get('SEARCH_VOCABULARY_TTL_SECONDS', VOCABULARY_TTL_SECONDS)
+
+
+# Creates missing indexes and triggers, filling new indexes from their tables
+def create_search_indexes():
+    if not _is_sqlite():
+        return
+    with db.engine.begin() as connection:
+        existing = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master"))}
+        if CHANGES_TABLE not in existing:
+            connection.execute(text(f"CREATE TABLE {CHANGES_TABLE} (version INTEGER NOT NULL)"))
+            connection.execute(text(f"INSERT INTO {CHANGES_TABLE} (version) VALUES (0)"))
+            # Triggers from before the change counter are recreated with it
+            for _, index, _ in INDEXES.values():
+                for operation in ('insert', 'delete', 'update'):
+                    connection.execute(text(f"DROP TRIGGER IF EXISTS {index}_{operation}"))
+        for model, index, columns in INDEXES.values():
+            for statement in _index_statements(model, index, columns):
+                connection.execute(text(statement))
+            if index not in existing:
+                connection.execute(text(f"INSERT INTO {index}({index}) VALUES ('rebuild')"))
+
+
+def rebuild_search_indexes():
+    if not _is_sqlite():
+        return
+    with db.engine.begin() as connection:
+        for _, index, _ in INDEXES.values():
+            connection.execute(text(f"INSERT INTO {index}({index}) VALUES ('rebuild')"))
+    vocabulary.clear()
+
+
+def normalize_word(word):
+    # Latin diacritics are folded like the unicode61 tokenizer does; other
+    # scripts keep their combining vowel signs
+    stripped = ''.join(c for c in unicodedata.normalize('NFKD', word) if not unicodedata.combining(c))
+    return stripped if stripped.isascii() else word
+
+
+def phonetic_key(word):
+    key = word.lower()
+    for spelling, replacement in TRANSLITERATIONS:
+        key = key.replace(spelling, replacement)
+    key = ASPIRATED.sub(r'\1', key)
+    key = REPEATED.sub(r'\1', key)
+    if len(key) > 3 and key.endswith('a'):
+        key = key[:-1]
+    return key
+
+
+def _within_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def _grams(key):
+    padded = f'$${key}$$'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _Snapshot:
+    # One loaded vocabulary. Phonetic keys are indexed by their padded
+    # trigrams: a key within edit distance d of another shares all but at
+    # most 3 * d of its distinct trigrams with it, so only keys reaching that count
+    # are compared with the full edit distance.
+    def __init__(self, counts):
+        self.terms = sorted(counts)
+        self.counts = counts
+        self.keys = {}
+        for term in counts:
+            self.keys.setdefault(phonetic_key(term), []).append(term)
+        self.key_list = list(self.keys)
+        self.grams = {}
+        for index, key in enumerate(self.key_list):
+            for gram in _grams(key):
+                self.grams.setdefault(gram, []).append(index)
+
+    def near_keys(self, key, limit):
+        grams = _grams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.grams.get(gram, ()))
+        needed = len(grams) - 3 * limit
+        for index, count in shared.items():
+            if count < needed:
+                continue
+            other = self.key_list[index]
+            if other != key and other[:1] == key[:1] and _within_distance(key, other, limit):
+                yield other
+
+
+class Vocabulary:
+    # Terms of all search indexes with their document counts. Every ttl
+    # seconds the change counter is read, and the fts5vocab tables are only
+    # read again when it moved. Only the first load blocks a request; later
+    # ones run on a background thread while the previous snapshot keeps
+    # serving.
+    def __init__(self, ttl=VOCABULARY_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._reloading = False
+        self.clear()
+
+    def clear(self):
+        self._snapshot = None
+        self._loaded_at = None
+        self._version = None
+
+    def _load(self, engine):
+        counts = {}
+        with engine.connect() as connection:
+            # Read first, so writes racing the load are picked up next time
+            version = connection.execute(text(f"SELECT version FROM {CHANGES_TABLE}")).scalar()
+            for _, index, _ in INDEXES.values():
+                for term, documents in connection.execute(text(f"SELECT term, doc FROM {index}_vocab")):
+                    counts[term] = counts.get(term, 0) + documents
+        self._snapshot = _Snapshot(counts)
+        self._version = version
+        self._loaded_at = time.monotonic()
+
+    def refresh(self, engine):
+        with engine.connect() as connection:
+            version = connection.execute(text(f"SELECT version FROM {CHANGES_TABLE}")).scalar()
+        if version == self._version:
+            self._loaded_at = time.monotonic()
+        else:
+            self._load(engine)
+
+    def _reload_in_background(self, engine):
+        try:
+            self.refresh(engine)
+        except Exception:
+            logger.exception('Reloading the search vocabulary failed')
+        finally:
+            self._reloading = False
+
+    def _current(self):
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._load(db.engine)
+        elif time.monotonic() - self._loaded_at > self.ttl and not self._reloading:
+            with self._lock:
+                if not self._reloading:
+                    self._reloading = True
+                    threading.Thread(target=self._reload_in_background, args=(db.engine,),
+                                     name='search-vocabulary', daemon=True).start()
+        return self._snapshot
+
+    def has_prefix(self, word):
+        terms = self._current().terms
+        position = bisect_left(terms, word)
+        return position < len(terms) and terms[position].startswith(word)
+
+    # Indexed terms that are spelling variants of word, most frequent first
+    def similar(self, word):
+        snapshot = self._current()
+        key = phonetic_key(word)
+        limit = 0 if len(key) < 4 else 1 if len(key) < 8 else 2
+        matches = list(snapshot.keys.get(key, []))
+        if limit:
+            for other in snapshot.near_keys(key, limit):
+                matches.extend(snapshot.keys[other])
+        matches.sort(key=lambda term: -snapshot.counts[term])
+        return matches[:MAX_EXPANSIONS]
+
+
+vocabulary = Vocabulary()
+
+
+def parse_words(query):
+    words = [normalize_word(word) for word in WORD_PATTERN.findall(query.lower())]
+    return [word for word in words if word][:MAX_WORDS]
+
+
+def _quote(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+# FTS5 MATCH expression requiring every word, each as a prefix or, when
+# nothing in the index starts with it, as one of its spelling variants
+def match_expression(words):
+    clauses = []
+    for word in words:
+        variants = [] if vocabulary.has_prefix(word) else vocabulary.similar(word)
+        if variants:
+            clauses.append('(' + ' OR '.join(_quote(variant) for variant in variants) + ')')
+        else:
+            clauses.append(_quote(word) + '*')
+    return ' AND '.join(clauses)
+
+
+def _fts_ids(name, expression, limit):
+    _, index, _ = INDEXES[name]
+    if name == 'collections':
+        # Millions of collections can share a street name, so they are
+        # returned newest first, which FTS5 reads straight off the doclist
+        # instead of scoring every match
+        order = 'rowid DESC'
+    else:
+        order = 'rank'
+    rows = db.session.execute(
+        text(f"SELECT rowid FROM {index} WHERE {index} MATCH :expression ORDER BY {order} LIMIT :limit"),
+        {'expression': expression, 'limit': limit}
+    )
+    return [row[0] for row in rows]
+
+
+def _like_ids(name, words, limit):
+    model, _, columns = INDEXES[name]
+    query = db.session.query(model.id)
+    for word in words:
+        query = query.filter(or_(*[getattr(model, column).ilike(f'%{word}%') for column in columns]))
+    return [row[0] for row in query.order_by(model.id.desc()).limit(limit)]
+
+
+def _records(model, ids):
+    by_id = {record.id: record for record in model.query.filter(model.id.in_(ids))}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+# Matching record ids per type, best first
+def search_ids(query, types=None, limit=DEFAULT_LIMIT):
+    words = parse_words(query)
+    types = types or list(INDEXES)
+    if not words:
+        return {name: [] for name in types}
+    if _is_sqlite():
+        expression = match_expression(words)
+        return {name: _fts_ids(name, expression, limit) for name in types}
+    return {name: _like_ids(name, words, limit) for name in types}
+
+
+def search(query, types=None, limit=DEFAULT_LIMIT):
+    results = {}
+    for name, ids in search_ids(query, types, limit).items():
+        model = INDEXES[name][0]
+        records = _records(model, ids)
+        if model is CollectionPoint:
+            collection_dates = resolve_collection_dates(records)
+            results[name] = [record.to_dict(collection_dates) for record in records]
+        else:
+            results[name] = [record.to_dict() for record in records]
+    return results
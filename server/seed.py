@@ -1,5 +1,8 @@
 from app import create_app, db
-from models import Collection, CollectionPoint
+from models import Collection, CollectionArchive, CollectionArchiveSummary, CollectionPoint
+from statistics_rollup import rebuild_statistics
+from bulk_ingest import ingest_collections
+from sync import reset_sync_log
 from datetime import datetime, timedelta
 import random
 
@@ -22,6 +25,8 @@ def seed_database():
     
     with app.app_context():
         # Clear existing data
+        db.session.query(CollectionArchiveSummary).delete()
+        db.session.query(CollectionArchive).delete()
         db.session.query(Collection).delete()
         db.session.query(CollectionPoint).delete()
         db.session.commit()
@@ -72,6 +77,7 @@ def seed_database():
         print("Collection points created successfully!")
         
         # Now create collections using the collection points
+        collections = []
         for point in collection_points:
             # Create 3-5 collections for each point
             num_collections = random.randint(3, 5)
@@ -94,18 +100,21 @@ def seed_database():
                     status = 'completed'
                 
                 # Create collection entry
-                collection = Collection(
-                    location=point.address,
-                    date_time=collection_date,
-                    waste_type=random.choice(["general", "recyclable", "hazardous", "organic", "electronic", "medical"]),
-                    assigned_team=f"Team {random.randint(1, 6)}",
-                    status=status,
-                    notes=f"Collection at {point.name}",
-                    waste_collected=round(random.uniform(10, 500), 2) if status == 'completed' else 0.0
-                )
-                db.session.add(collection)
+                collections.append({
+                    'location': point.address,
+                    'date_time': collection_date,
+                    'waste_type': random.choice(["general", "recyclable", "hazardous", "organic", "electronic", "medical"]),
+                    'assigned_team': f"Team {random.randint(1, 6)}",
+                    'status': status,
+                    'notes': f"Collection at {point.name}",
+                    'waste_collected': round(random.uniform(10, 500), 2) if status == 'completed' else 0.0
+                })
         
+        ingest_collections(collections)
+        rebuild_statistics()
         db.session.commit()
+        # The tables were cleared without logging deletions
+        reset_sync_log()
         print("Collections created successfully!")
 
 if __name__ == "__main__":
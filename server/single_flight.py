@@ -0,0 +1,48 @@
+import threading
+
+# Collapses concurrent identical computations in one process: the first
+# caller for a key runs the function and every caller arriving while it runs
+# waits for and shares its result, or its exception. Nothing is kept once
+# the call finishes, so this only removes duplicate in-flight work; caching
+# stays with the callers.
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    # Returns (result, shared) where shared is True for callers that waited
+    # on another caller's run
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = function()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,125 @@
+import math
+from sqlalchemy import and_, or_, update
+
+# Grid-cell spatial index that works on plain SQLite. The globe is split into
+# CELL_SIZE degree cells numbered row-major, and each located row stores its
+# cell in an indexed integer column. A bounding box becomes one integer range
+# per grid row; candidates are then refined on the exact coordinates and
+# Haversine distance.
+
+CELL_SIZE = 0.01  # degrees, roughly 1.1 km north-south
+GRID_COLUMNS = int(round(360 / CELL_SIZE))
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Boxes spanning more grid rows than this fall back to a coordinate range
+# filter instead of one OR branch per row
+MAX_RANGE_ROWS = 64
+# Nearest-neighbour search gives up on the grid past this half-width in cells
+MAX_SEARCH_CELLS = 256
+
+
+def _row(latitude):
+    return int(math.floor((latitude + 90) / CELL_SIZE))
+
+
+def _column(longitude):
+    return int(math.floor((longitude + 180) / CELL_SIZE)) % GRID_COLUMNS
+
+
+def grid_cell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return _row(latitude) * GRID_COLUMNS + _column(longitude)
+
+
+# (latitude, longitude) of the middle of a grid cell
+def cell_center(cell):
+    row, column = divmod(cell, GRID_COLUMNS)
+    return (row + 0.5) * CELL_SIZE - 90, (column + 0.5) * CELL_SIZE - 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _bbox_filter(model, south, west, north, east):
+    coordinates = and_(
+        model.latitude >= south, model.latitude <= north,
+        model.longitude >= west, model.longitude <= east
+    )
+    first_row, last_row = _row(south), _row(north)
+    first_column, last_column = _column(west), _column(east)
+    if last_row - first_row + 1 > MAX_RANGE_ROWS or first_column > last_column:
+        return coordinates
+    cells = or_(*[
+        model.grid_cell.between(row * GRID_COLUMNS + first_column, row * GRID_COLUMNS + last_column)
+        for row in range(first_row, last_row + 1)
+    ])
+    return and_(cells, coordinates)
+
+
+def within_bbox(model, south, west, north, east, limit=None):
+    query = model.query.filter(_bbox_filter(model, south, west, north, east))
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _radius_bbox(latitude, longitude, radius_km):
+    lat_delta = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(min(89.9, abs(latitude) + lat_delta)))
+    lon_delta = min(180.0, radius_km / (KM_PER_DEGREE * max(cos_lat, 1e-6)))
+    return latitude - lat_delta, longitude - lon_delta, latitude + lat_delta, longitude + lon_delta
+
+
+# Returns [(row, distance_km)] sorted by distance
+def within_radius(model, latitude, longitude, radius_km):
+    candidates = within_bbox(model, *_radius_bbox(latitude, longitude, radius_km))
+    matches = []
+    for row in candidates:
+        distance = haversine_km(latitude, longitude, row.latitude, row.longitude)
+        if distance <= radius_km:
+            matches.append((row, distance))
+    matches.sort(key=lambda match: match[1])
+    return matches
+
+
+# Returns the k closest [(row, distance_km)]. The search square doubles until
+# it holds k rows and the k-th distance is inside the area already covered.
+def nearest(model, latitude, longitude, k=5):
+    half_width = 1
+    while half_width <= MAX_SEARCH_CELLS:
+        span_km = half_width * CELL_SIZE * KM_PER_DEGREE
+        matches = within_radius(model, latitude, longitude, span_km)
+        if len(matches) >= k:
+            return matches[:k]
+        half_width *= 2
+
+    matches = [
+        (row, haversine_km(latitude, longitude, row.latitude, row.longitude))
+        for row in model.query.filter(model.latitude.isnot(None), model.longitude.isnot(None)).all()
+    ]
+    matches.sort(key=lambda match: match[1])
+    return matches[:k]
+
+
+# Fills in grid cells for rows written before the column existed or by bulk
+# inserts that bypass the ORM hooks
+def backfill_grid_cells(db, model, chunk_size=1000):
+    while True:
+        rows = db.session.query(model.id, model.latitude, model.longitude).filter(
+            model.grid_cell.is_(None),
+            model.latitude.isnot(None),
+            model.longitude.isnot(None)
+        ).limit(chunk_size).all()
+        if not rows:
+            break
+        db.session.execute(update(model), [
+            {'id': id, 'grid_cell': grid_cell(latitude, longitude)}
+            for id, latitude, longitude in rows
+        ])
+        db.session.commit()
@@ -0,0 +1,169 @@
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from models import db, Collection, CollectionArchiveSummary, CollectionPoint, StatisticsRollup
+
+# Running totals behind /api/statistics. Write handlers pass the before/after
+# state of the row they touch and the difference is applied in the same
+# transaction, so reading the dashboard numbers never scans the history.
+
+POINTS_KEY = 'points'
+POINTS_FULL_KEY = 'points_full'
+WASTE_KEY_PREFIX = 'waste:'
+
+# Relative tolerance for float totals drifting from repeated increments
+TOTAL_TOLERANCE = 1e-6
+
+
+def collection_state(collection):
+    return (collection.status, collection.waste_type, collection.waste_collected)
+
+
+def point_state(point):
+    return (point.status,)
+
+
+def _collection_contribution(state):
+    if state is None:
+        return {}
+    status, waste_type, waste_collected = state
+    if status != 'completed':
+        return {}
+    return {WASTE_KEY_PREFIX + (waste_type or '').lower(): (1, waste_collected or 0.0)}
+
+
+def _point_contribution(state):
+    if state is None:
+        return {}
+    contribution = {POINTS_KEY: (1, 0.0)}
+    if state[0] == 'Full':
+        contribution[POINTS_FULL_KEY] = (1, 0.0)
+    return contribution
+
+
+def _apply_delta(before, after):
+    deltas = {}
+    for sign, contribution in ((-1, before), (1, after)):
+        for name, (count, total) in contribution.items():
+            delta = deltas.setdefault(name, [0, 0.0])
+            delta[0] += sign * count
+            delta[1] += sign * total
+
+    rows = [{'name': name, 'count': count, 'total': total}
+            for name, (count, total) in deltas.items() if count or total]
+    if not rows:
+        return
+    # One statement per key, so concurrent writers adding a new key both
+    # land their increment instead of one failing on the primary key
+    table = StatisticsRollup.__table__
+    dialect_insert = postgresql_insert if db.engine.dialect.name == 'postgresql' else sqlite_insert
+    statement = dialect_insert(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['name'],
+        set_={
+            'count': table.c.count + statement.excluded['count'],
+            'total': table.c.total + statement.excluded['total'],
+        }
+    )
+    db.session.execute(statement, rows)
+
+
+def record_collection_change(before, after):
+    _apply_delta(_collection_contribution(before), _collection_contribution(after))
+
+
+# Same as record_collection_change for many rows, applied as one delta
+def record_collection_changes(changes):
+    before, after = {}, {}
+    for old_state, new_state in changes:
+        for merged, state in ((before, old_state), (after, new_state)):
+            for name, (count, total) in _collection_contribution(state).items():
+                current = merged.get(name, (0, 0.0))
+                merged[name] = (current[0] + count, current[1] + total)
+    _apply_delta(before, after)
+
+
+# Applies the change between two {waste type: (count, total)} summaries of
+# completed collections, for set-based updates that never load the rows
+def record_completed_totals(before, after):
+    _apply_delta(*[
+        {WASTE_KEY_PREFIX + (waste_type or '').lower(): value for waste_type, value in totals.items()}
+        for totals in (before, after)
+    ])
+
+
+def record_point_change(before, after):
+    _apply_delta(_point_contribution(before), _point_contribution(after))
+
+
+def compute_statistics():
+    waste_type = func.lower(Collection.waste_type)
+    rows = db.session.query(
+        waste_type,
+        func.count(Collection.id),
+        func.coalesce(func.sum(Collection.waste_collected), 0.0)
+    ).filter(Collection.status == 'completed').group_by(waste_type).all()
+
+    totals = {WASTE_KEY_PREFIX + (name or ''): (count, float(total)) for name, count, total in rows}
+
+    # Archived collections are all completed and still count
+    archived_type = func.lower(CollectionArchiveSummary.waste_type)
+    archived = db.session.query(
+        archived_type,
+        func.sum(CollectionArchiveSummary.count),
+        func.sum(CollectionArchiveSummary.waste_collected)
+    ).group_by(archived_type).all()
+    for name, count, total in archived:
+        key = WASTE_KEY_PREFIX + (name or '')
+        current = totals.get(key, (0, 0.0))
+        totals[key] = (current[0] + int(count), current[1] + float(total))
+    totals[POINTS_KEY] = (CollectionPoint.query.count(), 0.0)
+    totals[POINTS_FULL_KEY] = (CollectionPoint.query.filter_by(status='Full').count(), 0.0)
+    return totals
+
+
+def rebuild_statistics():
+    StatisticsRollup.query.delete(synchronize_session=False)
+    for name, (count, total) in compute_statistics().items():
+        db.session.add(StatisticsRollup(name=name, count=count, total=total))
+    db.session.flush()
+
+
+# Rebuilds the rollup for databases created before it existed
+def ensure_statistics():
+    if StatisticsRollup.query.filter_by(name=POINTS_KEY).first() is None:
+        rebuild_statistics()
+        db.session.commit()
+
+
+# Returns [(name, expected, actual)] for every rollup row that disagrees
+# with a full recomputation
+def check_statistics():
+    expected = compute_statistics()
+    actual = {row.name: (row.count, row.total) for row in StatisticsRollup.query.all()}
+    mismatches = []
+    for name in sorted(set(expected) | set(actual)):
+        expected_count, expected_total = expected.get(name, (0, 0.0))
+        actual_count, actual_total = actual.get(name, (0, 0.0))
+        total_matches = abs(expected_total - actual_total) <= TOTAL_TOLERANCE * max(1.0, abs(expected_total))
+        if expected_count != actual_count or not total_matches:
+            mismatches.append((name, (expected_count, expected_total), (actual_count, actual_total)))
+    return mismatches
+
+
+def read_statistics():
+    rows = {row.name: row for row in StatisticsRollup.query.all()}
+    total_waste = sum(row.total for name, row in rows.items() if name.startswith(WASTE_KEY_PREFIX))
+    recyclable = rows.get(WASTE_KEY_PREFIX + 'recyclable')
+    recyclable_waste = recyclable.total if recyclable else 0.0
+    points = rows.get(POINTS_KEY)
+    points_full = rows.get(POINTS_FULL_KEY)
+
+    recycling_rate = (recyclable_waste / total_waste * 100) if total_waste > 0 else 0
+
+    return {
+        'totalWaste': total_waste,
+        'recyclingRate': round(recycling_rate),
+        'activePoints': points.count if points else 0,
+        'binsAtCapacity': points_full.count if points_full else 0
+    }
@@ -0,0 +1,190 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, event, func, insert, literal, select, text
+from sqlalchemy.orm import Session
+from models import (
+    db, Collection, CollectionPoint, RecyclingCenter, SyncChange,
+    resolve_collection_dates, serialize_point
+)
+
+# Change log behind the delta sync API. Every insert, update and delete of a
+# synced row writes a sync_changes entry in the same transaction, numbered by
+# an autoincrement sequence, so clients resume from the last sequence number
+# they saw instead of a timestamp and clock skew cannot drop updates. The log
+# keeps only the newest entry per row; deletions stay as tombstones until
+# pruned, and a client whose watermark predates pruned tombstones is told to
+# resync from scratch.
+#
+# ORM flushes are logged by the session listener below; Core bulk writes call
+# record_changes themselves.
+
+RESOURCES = {
+    'collections': Collection,
+    'collection-points': CollectionPoint,
+    'recycling-centers': RecyclingCenter,
+}
+RESOURCE_NAMES = {model: name for name, model in RESOURCES.items()}
+
+DEFAULT_LIMIT = 500
+MAX_LIMIT = 5000
+TOMBSTONE_RETENTION_DAYS = 90
+# Entry whose record_id holds the highest pruned sequence number
+PRUNED_MARKER = '*'
+# PostgreSQL allocates sequence values before commit; this advisory lock
+# keeps the order in which changes become visible equal to sequence order
+ADVISORY_LOCK_KEY = 0x5359_4E43
+ID_CHUNK_SIZE = 500
+
+
+def _serialize(resource, records):
+    if resource == 'collection-points':
+        collection_dates = resolve_collection_dates(records)
+        return [serialize_point(record, collection_dates) for record in records]
+    return [record.to_dict() for record in records]
+
+
+def record_changes(connection, resource, ids, deleted=False):
+    ids = list(ids)
+    if not ids:
+        return
+    table = SyncChange.__table__
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        connection.execute(delete(table).where(
+            table.c.resource == resource, table.c.record_id.in_(ids[start:start + ID_CHUNK_SIZE])
+        ))
+    now = datetime.utcnow()
+    connection.execute(insert(table), [
+        {'resource': resource, 'record_id': id, 'deleted': deleted, 'changed_at': now} for id in ids
+    ])
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flush(session, flush_context):
+    changed = defaultdict(list)
+    deleted = defaultdict(list)
+    for instance in session.new:
+        if type(instance) in RESOURCE_NAMES:
+            changed[RESOURCE_NAMES[type(instance)]].append(instance.id)
+    for instance in session.dirty:
+        if type(instance) in RESOURCE_NAMES and session.is_modified(instance, include_collections=False):
+            changed[RESOURCE_NAMES[type(instance)]].append(instance.id)
+    for instance in session.deleted:
+        if type(instance) in RESOURCE_NAMES:
+            deleted[RESOURCE_NAMES[type(instance)]].append(instance.id)
+    if not changed and not deleted:
+        return
+    connection = session.connection()
+    for resource, ids in changed.items():
+        record_changes(connection, resource, ids)
+    for resource, ids in deleted.items():
+        record_changes(connection, resource, ids, deleted=True)
+
+
+def pruned_through():
+    return db.session.query(SyncChange.record_id).filter(
+        SyncChange.resource == PRUNED_MARKER
+    ).scalar() or 0
+
+
+def _set_pruned_through(seq):
+    db.session.execute(delete(SyncChange).where(SyncChange.resource == PRUNED_MARKER))
+    db.session.execute(insert(SyncChange), [{'resource': PRUNED_MARKER, 'record_id': seq, 'deleted': False}])
+
+
+def _backfill():
+    for resource, model in RESOURCES.items():
+        db.session.execute(insert(SyncChange).from_select(
+            ['resource', 'record_id', 'deleted', 'changed_at'],
+            select(literal(resource), model.id, literal(False), literal(datetime.utcnow())).order_by(model.id)
+        ))
+
+
+# Logs every existing row when the log is empty, e.g. on first start
+def ensure_sync_log():
+    if db.session.query(SyncChange.seq).first() is None:
+        _backfill()
+        db.session.commit()
+
+
+# Rebuilds the log after tables were rewritten without it (seed scripts);
+# clients holding an older watermark are sent a reset
+def reset_sync_log():
+    head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+    db.session.execute(delete(SyncChange))
+    _backfill()
+    _set_pruned_through(head + 1)
+    db.session.commit()
+
+
+def prune_tombstones(days=TOMBSTONE_RETENTION_DAYS):
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    condition = (SyncChange.deleted.is_(True)) & (SyncChange.changed_at < cutoff)
+    newest = db.session.query(func.max(SyncChange.seq)).filter(condition).scalar()
+    if newest is None:
+        return 0
+    pruned = db.session.execute(delete(SyncChange).where(condition)).rowcount
+    _set_pruned_through(max(newest, pruned_through()))
+    db.session.commit()
+    return pruned
+
+
+# Watermarks are opaque to clients: '<seq>' resumes a delta sync after that
+# sequence number, while 'f<seq>' continues a full sync started from '0'. A
+# full sync can pass sequence numbers older than pruned tombstones without
+# having missed anything, so it is never sent a reset.
+def parse_watermark(value):
+    value = (value or '0').strip()
+    full = value.startswith('f')
+    try:
+        seq = int(value[1:] if full else value)
+    except ValueError:
+        raise ValueError('Invalid since watermark')
+    if seq < 0:
+        raise ValueError('Invalid since watermark')
+    return seq, full or seq == 0
+
+
+# Changes after the since watermark, oldest first and at most limit entries.
+# next is the watermark to send on the following request; a reset asks the
+# client to drop its copy and sync again from '0'.
+def changes_since(since, resources=None, limit=DEFAULT_LIMIT):
+    seq, full = parse_watermark(since)
+    resources = resources or list(RESOURCES)
+    if not full and seq < pruned_through():
+        return {'since': since, 'next': '0', 'more': True, 'reset': True, 'changes': {}, 'deleted': {}}
+
+    head = db.session.query(func.max(SyncChange.seq)).scalar() or 0
+    entries = db.session.query(SyncChange.seq, SyncChange.resource, SyncChange.record_id, SyncChange.deleted).filter(
+        SyncChange.seq > seq, SyncChange.seq <= head, SyncChange.resource.in_(resources)
+    ).order_by(SyncChange.seq).limit(limit + 1).all()
+    more = len(entries) > limit
+    entries = entries[:limit]
+
+    changed = defaultdict(list)
+    deleted = defaultdict(list)
+    for entry in entries:
+        (deleted if entry.deleted else changed)[entry.resource].append(entry.record_id)
+
+    changes = {}
+    for resource, ids in changed.items():
+        model = RESOURCES[resource]
+        records = []
+        for start in range(0, len(ids), ID_CHUNK_SIZE):
+            records.extend(model.query.filter(model.id.in_(ids[start:start + ID_CHUNK_SIZE])).all())
+        records.sort(key=lambda record: record.id)
+        changes[resource] = _serialize(resource, records)
+
+    if more:
+        next = f"{'f' if full else ''}{entries[-1].seq}"
+    else:
+        next = str(head)
+    return {
+        'since': since,
+        'next': next,
+        'more': more,
+        'reset': False,
+        'changes': changes,
+        'deleted': dict(deleted),
+    }
@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta
+import pytest
+from app import create_app
+from models import db, CollectionPoint
+import analytics
+import response_cache
+import search
+
+# Every test gets an app on a fresh in-memory SQLite database, created the
+# way the server creates it at startup. The process-wide caches are emptied
+# so no response outlives the database it was built from.
+
+BASE_TIME = datetime(2024, 3, 1, 9, 0)
+
+
+@pytest.fixture
+def app():
+    app = create_app('testing')
+    response_cache.responses.clear()
+    search.vocabulary.clear()
+    with app.app_context():
+        analytics.clear_cache()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+# Adds collection points around Dadar, one per (name, latitude, longitude)
+@pytest.fixture
+def add_points(app):
+    def add(*points, status='Active'):
+        rows = [CollectionPoint(
+            name=name, address=f'{name} Road, Mumbai', area='Dadar',
+            latitude=latitude, longitude=longitude, capacity=0.0, status=status
+        ) for name, latitude, longitude in points]
+        db.session.add_all(rows)
+        db.session.commit()
+        return rows
+    return add
+
+
+# Posts collections through the bulk endpoint and returns their ids
+@pytest.fixture
+def add_collections(client):
+    def add(*records):
+        rows = [{
+            'date_time': (BASE_TIME + timedelta(days=index)).isoformat(),
+            'waste_type': 'Plastic', 'assigned_team': 'Team 1', **record
+        } for index, record in enumerate(records)]
+        response = client.post('/api/collections/bulk', json=rows)
+        assert response.status_code == 201, response.json
+        return [result['id'] for result in response.json['results']]
+    return add
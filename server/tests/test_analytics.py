@@ -0,0 +1,73 @@
+from datetime import datetime
+import pytest
+from sqlalchemy import update
+import analytics
+from analytics import aggregate, fold
+from models import db, Collection
+
+# Finished analytics buckets are cached per process; writes through the API
+# drop the buckets they touch, and other writers are picked up once the
+# cached bucket expires, see analytics.py.
+
+START, END = datetime(2024, 3, 1), datetime(2024, 4, 1)
+
+
+def _by_day():
+    return {row['bucket']: row['waste_collected'] for row in aggregate('day', [], START, END)}
+
+
+def _total():
+    return fold(aggregate('month', ['waste_type'], START, END), [])[0]['waste_collected']
+
+
+@pytest.fixture
+def collections(add_collections):
+    return add_collections(*[
+        {'location': f'Road {index}', 'status': 'completed', 'waste_collected': 10.0,
+         'date_time': f'2024-03-0{index + 1}T09:00:00'}
+        for index in range(3)
+    ])
+
+
+def test_writes_drop_the_cached_buckets(client, collections):
+    assert _total() == pytest.approx(30.0)
+    client.patch(f'/api/collections/{collections[0]}', json={'waste_collected': 25.0})
+    assert _total() == pytest.approx(45.0)
+    client.delete(f'/api/collections/{collections[1]}')
+    assert _total() == pytest.approx(35.0)
+
+
+def test_moved_collection_leaves_its_old_bucket(client, collections):
+    before = _by_day()
+    client.patch(f'/api/collections/{collections[0]}', json={'date_time': '2024-03-20T09:00:00'})
+    after = _by_day()
+    assert sum(after.values()) == pytest.approx(sum(before.values()))
+    assert len([day for day, kg in after.items() if kg]) == 3
+    assert after != before
+
+
+def test_other_writers_show_up_after_the_ttl(app, collections, monkeypatch):
+    assert _total() == pytest.approx(30.0)
+    # A write from another process does not invalidate this one's cache
+    db.session.execute(update(Collection).values(waste_collected=1.0))
+    db.session.commit()
+    assert _total() == pytest.approx(30.0)
+
+    monkeypatch.setattr(analytics, 'CACHE_TTL_SECONDS', 0)
+    assert _total() == pytest.approx(3.0)
+
+
+def test_current_bucket_is_never_cached(client, add_collections):
+    now = datetime.now()
+    add_collections({'location': 'Road 1', 'status': 'completed', 'waste_collected': 4.0,
+                     'date_time': now.isoformat()})
+    assert fold(aggregate('month', [], now=now), [])[0]['waste_collected'] == pytest.approx(4.0)
+    db.session.execute(update(Collection).values(waste_collected=6.0))
+    db.session.commit()
+    assert fold(aggregate('month', [], now=now), [])[0]['waste_collected'] == pytest.approx(6.0)
+
+
+def test_invalid_arguments_are_rejected(client):
+    assert client.get('/api/analytics/trends?bucket=hour').status_code == 400
+    assert client.get('/api/analytics/trends?group_by=colour').status_code == 400
+    assert client.get('/api/analytics/trends?start=yesterday').status_code == 400
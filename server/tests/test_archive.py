@@ -0,0 +1,59 @@
+from datetime import datetime
+import json
+import pytest
+import analytics
+import response_cache
+from analytics import aggregate, fold
+from archive import archive_collections
+from models import Collection, CollectionArchive
+from statistics_rollup import check_statistics
+
+# Old completed collections move to the archive tables, and list, analytics
+# and statistics reads still see them, see archive.py.
+
+NOW = datetime(2025, 6, 15)
+
+
+@pytest.fixture
+def collections(add_collections):
+    # Two old completed collections, an old open one and a recent one
+    return add_collections(
+        {'location': 'Road 1', 'status': 'completed', 'waste_collected': 10.0, 'date_time': '2024-01-10T09:00:00'},
+        {'location': 'Road 2', 'status': 'completed', 'waste_collected': 20.0, 'date_time': '2024-02-10T09:00:00'},
+        {'location': 'Road 3', 'status': 'scheduled', 'date_time': '2024-02-11T09:00:00'},
+        {'location': 'Road 4', 'status': 'completed', 'waste_collected': 40.0, 'date_time': '2025-06-01T09:00:00'},
+    )
+
+
+def _list(client, query=''):
+    response = client.get(f'/api/collections?limit=100&{query}')
+    assert response.status_code == 200
+    return [row['id'] for row in json.loads(response.get_data())]
+
+
+def test_completed_collections_move_a_month_at_a_time(collections):
+    assert archive_collections(365, now=NOW) == {'2024-01': 1, '2024-02': 1}
+    assert [row.id for row in CollectionArchive.query.order_by(CollectionArchive.id)] == collections[:2]
+    assert [row.id for row in Collection.query.order_by(Collection.id)] == collections[2:]
+    assert archive_collections(365, now=NOW) == {}
+
+
+def test_lists_read_archived_collections_when_asked(client, collections):
+    archive_collections(365, now=NOW)
+    assert _list(client) == collections[2:]
+    assert _list(client, 'archived=1') == collections
+    assert _list(client, 'start=2024-02-01') == collections[1:]
+    assert _list(client, 'start=2025-01-01') == collections[3:]
+
+
+def test_totals_count_archived_collections(client, collections):
+    start, end = datetime(2024, 1, 1), datetime(2025, 7, 1)
+    before = fold(aggregate('month', ['waste_type'], start, end), [])[0]['waste_collected']
+    statistics = client.get('/api/statistics').json
+    archive_collections(365, now=NOW)
+    # Recomputed from the archive, not served from before it
+    analytics.clear_cache()
+    response_cache.responses.clear()
+    assert fold(aggregate('month', ['waste_type'], start, end), [])[0]['waste_collected'] == pytest.approx(before)
+    assert client.get('/api/statistics').json == statistics
+    assert check_statistics() == []
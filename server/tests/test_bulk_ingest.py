@@ -0,0 +1,82 @@
+import json
+import pytest
+import bulk_ingest
+from models import db, Collection
+from statistics_rollup import check_statistics
+from sync import changes_since
+
+# Bulk ingestion validates records one by one and inserts the valid ones a
+# chunk at a time, reporting a result per input record, see bulk_ingest.py.
+
+VALID = {'location': 'Ranade Road', 'date_time': '2024-03-01T09:00:00', 'waste_type': 'Plastic',
+         'assigned_team': 'Team 1'}
+
+
+def _post(client, records):
+    return client.post('/api/collections/bulk', json=records)
+
+
+def test_all_valid_records_are_created(client):
+    response = _post(client, [VALID, {**VALID, 'status': 'completed', 'waste_collected': 12}])
+    assert response.status_code == 201
+    assert response.json['created'] == 2
+    ids = [result['id'] for result in response.json['results']]
+    assert db.session.get(Collection, ids[1]).waste_collected == 12.0
+    assert check_statistics() == []
+    # Core inserts are logged for delta sync like ORM writes
+    assert sorted(changes_since('0')['changes']['collections'], key=lambda row: row['id'])[0]['id'] == ids[0]
+
+
+@pytest.mark.parametrize('record, error', [
+    ({**VALID, 'location': ''}, 'Missing fields: location'),
+    ({**VALID, 'date_time': 'tomorrow'}, 'Invalid date_time'),
+    ({**VALID, 'status': 'lost'}, 'Invalid status'),
+    ({**VALID, 'waste_collected': -1}, 'Invalid waste_collected'),
+    ({**VALID, 'waste_collected': True}, 'Invalid waste_collected'),
+    ({**VALID, 'user_id': '7'}, 'Invalid user_id'),
+    ('not an object', 'Record must be a JSON object'),
+])
+def test_invalid_records_are_reported(client, record, error):
+    response = _post(client, [record])
+    assert response.status_code == 400
+    result, = response.json['results']
+    assert result['status'] == 'error' and result['error'].startswith(error)
+    assert Collection.query.count() == 0
+
+
+def test_partial_failure_keeps_the_valid_records(client):
+    response = _post(client, [VALID, {**VALID, 'status': 'lost'}, {**VALID, 'location': 'Worli Road'}])
+    assert response.status_code == 207
+    assert (response.json['created'], response.json['failed']) == (2, 1)
+    assert [result['status'] for result in response.json['results']] == ['created', 'error', 'created']
+    assert {row.location for row in Collection.query} == {'Ranade Road', 'Worli Road'}
+
+
+def test_failed_chunk_does_not_undo_earlier_chunks(client, monkeypatch):
+    insert_chunk = bulk_ingest._insert_chunk
+    calls = []
+
+    def failing_second_chunk(rows):
+        calls.append(rows)
+        if len(calls) == 2:
+            raise RuntimeError('disk full')
+        return insert_chunk(rows)
+
+    monkeypatch.setattr(bulk_ingest, '_insert_chunk', failing_second_chunk)
+    results = bulk_ingest.ingest_collections([VALID] * 5, chunk_size=2)
+    assert [result['status'] for result in results] == ['created', 'created', 'error', 'error', 'created']
+    assert results[2]['error'] == 'disk full'
+    assert Collection.query.count() == 3
+    assert check_statistics() == []
+
+
+def test_ndjson_stream_reports_bad_lines(client):
+    body = '\n'.join([json.dumps(VALID), '{not json', '', json.dumps(VALID)])
+    response = client.post('/api/collections/bulk', data=body, content_type='application/x-ndjson')
+    assert response.status_code == 207
+    assert [result['status'] for result in response.json['results']] == ['created', 'error', 'created']
+    assert response.json['results'][1]['error'].startswith('Invalid JSON')
+
+
+def test_body_must_be_an_array(client):
+    assert client.post('/api/collections/bulk', json=VALID).status_code == 400
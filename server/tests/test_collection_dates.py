@@ -0,0 +1,58 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from models import db
+
+# Point listings resolve last/next collection dates for a whole batch of
+# points in one grouped query, see resolve_collection_dates in models.py.
+
+
+@contextmanager
+def _count_queries():
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def _points(client):
+    response = client.get('/api/collection-points')
+    assert response.status_code == 200
+    return {point['id']: point for point in json.loads(response.get_data())}
+
+
+def test_dates_come_from_completed_and_upcoming_collections(client, add_points, add_collections):
+    busy, idle = add_points(('Ranade', 19.02, 72.84), ('Worli', 19.00, 72.82))
+    soon = datetime.now() + timedelta(days=2)
+    add_collections(
+        {'location': busy.address, 'status': 'completed', 'date_time': '2024-03-01T09:00:00'},
+        {'location': busy.address, 'status': 'completed', 'date_time': '2024-03-05T09:00:00'},
+        {'location': busy.address, 'status': 'scheduled', 'date_time': soon.isoformat()},
+        {'location': busy.address, 'status': 'scheduled', 'date_time': (soon + timedelta(days=3)).isoformat()},
+        # Cancelled and past scheduled collections count for neither date
+        {'location': busy.address, 'status': 'cancelled', 'date_time': '2024-04-01T09:00:00'},
+        {'location': idle.address, 'status': 'scheduled', 'date_time': '2024-02-01T09:00:00'},
+    )
+    points = _points(client)
+    assert points[busy.id]['last_collection'] == '2024-03-05'
+    assert points[busy.id]['next_collection'] == soon.strftime('%Y-%m-%d')
+    assert points[idle.id]['last_collection'] is None
+    assert points[idle.id]['next_collection'] is None
+
+
+def test_listing_does_not_query_per_point(client, add_points, add_collections):
+    add_points(*[(f'Point {index}', 19.0, 72.8 + index / 100) for index in range(3)])
+    with _count_queries() as few:
+        assert len(_points(client)) == 3
+    points = add_points(*[(f'More {index}', 19.1, 72.8 + index / 100) for index in range(30)])
+    add_collections(*[{'location': point.address, 'status': 'completed'} for point in points])
+    with _count_queries() as many:
+        assert len(_points(client)) == 33
+    assert len(many) == len(few)
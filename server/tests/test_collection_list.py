@@ -0,0 +1,69 @@
+import json
+import pytest
+
+# Keyset pagination, filters and field projection on GET /api/collections,
+# see collection_queries.py.
+
+
+def _page(client, query):
+    response = client.get(f'/api/collections?{query}')
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return json.loads(response.get_data()), response.headers.get('X-Next-Cursor')
+
+
+def _all_pages(client, query):
+    rows, cursor = _page(client, query)
+    while cursor:
+        page, cursor = _page(client, f'{query}&cursor={cursor}')
+        rows += page
+    return rows
+
+
+@pytest.fixture
+def collections(add_collections):
+    # Pairs share a date_time so the id breaks the tie
+    return add_collections(*[
+        {'location': f'Road {index}', 'date_time': f'2024-03-0{index // 2 + 1}T09:00:00',
+         'status': 'completed' if index % 3 == 0 else 'scheduled'}
+        for index in range(7)
+    ])
+
+
+def test_pages_follow_date_time_then_id(client, collections):
+    assert [row['id'] for row in _all_pages(client, 'limit=2')] == collections
+    assert [row['id'] for row in _all_pages(client, 'limit=3&order=desc')] == collections[::-1]
+
+
+def test_last_page_has_no_cursor(client, collections):
+    rows, cursor = _page(client, 'limit=7')
+    assert len(rows) == 7 and cursor is None
+    rows, cursor = _page(client, 'limit=6')
+    assert len(rows) == 6 and cursor is not None
+
+
+def test_cursor_is_stable_under_writes(client, add_collections, collections):
+    first, cursor = _page(client, 'limit=3')
+    # A row sorting before the cursor and the deletion of a seen row do not
+    # shift the following pages
+    add_collections({'location': 'Early Road', 'date_time': '2024-01-01T09:00:00'})
+    client.delete(f"/api/collections/{first[0]['id']}")
+    rest, _ = _page(client, f'limit=10&cursor={cursor}')
+    assert [row['id'] for row in first + rest] == collections
+
+
+def test_filters_and_fields(client, collections):
+    rows = _all_pages(client, 'limit=2&status=completed&fields=id,status')
+    assert [row['id'] for row in rows] == [collections[0], collections[3], collections[6]]
+    assert all(set(row) == {'id', 'status'} for row in rows)
+    rows, _ = _page(client, 'start=2024-03-02&end=2024-03-03')
+    assert [row['id'] for row in rows] == collections[2:4]
+
+
+@pytest.mark.parametrize('query', ['fields=id,secret', 'cursor=not-a-cursor', 'limit=many', 'start=yesterday'])
+def test_invalid_arguments_are_rejected(client, collections, query):
+    assert client.get(f'/api/collections?{query}').status_code == 400
+
+
+def test_limit_is_clamped(client, collections):
+    rows, cursor = _page(client, 'limit=0')
+    assert len(rows) == 1 and cursor is not None
@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+import pytest
+from fill_forecast import FillForecaster, forecaster
+
+# Fill-level forecasts from sensor readings, including readings that arrive
+# out of order and readings ingested by another worker, see fill_forecast.py.
+
+HORIZON_HOURS = 24 * 7
+
+
+def _post_readings(client, point_id, *readings, now):
+    response = client.post('/api/capacity-readings', json=[
+        {'point_id': point_id, 'recorded_at': (now - timedelta(hours=hours_ago)).isoformat(), 'capacity': capacity}
+        for hours_ago, capacity in readings
+    ])
+    assert response.status_code == 201, response.json
+
+
+def _forecast(engine, point_id, now):
+    matches = [row for row in engine.predicted_full(HORIZON_HOURS, now=now) if row['point_id'] == point_id]
+    return matches[0] if matches else None
+
+
+def test_late_reading_keeps_the_fill_cycle(client, add_points):
+    point, = add_points(('Ranade', 19.02, 72.84))
+    now = datetime.utcnow()
+    _post_readings(client, point.id, (6, 20.0), (4, 40.0), (2, 60.0), now=now)
+    before = _forecast(forecaster, point.id, now)
+    assert before is not None and before['capacity'] == 60.0
+
+    # Recorded between the first two, so it is not a drop after emptying
+    _post_readings(client, point.id, (5, 30.0), now=now)
+    after = _forecast(forecaster, point.id, now)
+    assert after is not None and after['capacity'] == 60.0
+    assert after['fill_rate_per_hour'] > 0
+
+    rebuilt = FillForecaster()
+    rebuilt.rebuild()
+    assert _forecast(rebuilt, point.id, now) == after
+
+
+def test_late_reading_does_not_overwrite_the_point(client, add_points):
+    point, = add_points(('Ranade', 19.02, 72.84))
+    now = datetime.utcnow()
+    _post_readings(client, point.id, (2, 95.0), now=now)
+    version = client.get('/api/collection-points/nearest?lat=19.02&lon=72.84&k=1').json[0]['version']
+    since = client.get('/api/sync?since=0').json['next']
+
+    _post_readings(client, point.id, (10, 10.0), now=now)
+    current = client.get('/api/collection-points/nearest?lat=19.02&lon=72.84&k=1').json[0]
+    assert (current['capacity'], current['status'], current['version']) == (95.0, 'Full', version)
+    assert client.get('/api/statistics').json['binsAtCapacity'] == 1
+    assert client.get(f'/api/sync?since={since}').json['changes'] == {}
+
+    # A late reading among newer ones in the same batch does not win either
+    _post_readings(client, point.id, (1, 40.0), (12, 5.0), now=now)
+    current = client.get('/api/collection-points/nearest?lat=19.02&lon=72.84&k=1').json[0]
+    assert (current['capacity'], current['status']) == (40.0, 'Active')
+
+
+def test_drop_after_emptying_starts_a_new_cycle(client, add_points):
+    point, = add_points(('Ranade', 19.02, 72.84))
+    now = datetime.utcnow()
+    _post_readings(client, point.id, (8, 50.0), (6, 80.0), (4, 5.0), (2, 15.0), now=now)
+    forecast = _forecast(forecaster, point.id, now)
+    assert forecast['capacity'] == 15.0
+    # Only the readings since the bin was emptied are fitted
+    assert forecast['fill_rate_per_hour'] == pytest.approx(5.0)
+
+
+def test_other_workers_follow_ingested_readings(client, add_points):
+    point, = add_points(('Ranade', 19.02, 72.84))
+    other = FillForecaster()
+    other.rebuild()
+    now = datetime.utcnow()
+    _post_readings(client, point.id, (6, 20.0), (4, 40.0), (2, 60.0), now=now)
+    assert _forecast(other, point.id, now) == _forecast(forecaster, point.id, now)
+
+    assert client.delete(f'/api/collection-points/{point.id}').status_code in (200, 204)
+    assert _forecast(other, point.id, now) is None
+    assert _forecast(forecaster, point.id, now) is None
+
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from heatmap import heatmap_grid, rebuild_heatmap
+
+# The heatmap layers are kept current from the sync log; after every kind of
+# change the incremental result must equal a rebuild from the tables, see
+# heatmap.py.
+
+WASTE_TYPES = [None, ['plastic'], ['organic']]
+
+
+def _grids():
+    return [heatmap_grid(waste_types=waste_types) for waste_types in WASTE_TYPES]
+
+
+def _assert_matches_rebuild():
+    incremental = _grids()
+    rebuild_heatmap()
+    for (grid, total_kg, collections), (expected_grid, expected_kg, expected_collections) in zip(incremental, _grids()):
+        np.testing.assert_allclose(grid, expected_grid, atol=1e-3)
+        assert total_kg == pytest.approx(expected_kg)
+        assert collections == expected_collections
+
+
+@pytest.fixture
+def seeded(client, add_points, add_collections):
+    points = add_points(('Ranade', 19.02, 72.84), ('Worli', 19.00, 72.82))
+    ids = add_collections(
+        {'location': points[0].address, 'status': 'completed', 'waste_collected': 12.0},
+        {'location': points[0].address, 'status': 'completed', 'waste_collected': 3.0, 'waste_type': 'Organic'},
+        {'location': points[1].address, 'status': 'completed', 'waste_collected': 8.0},
+        {'location': points[1].address, 'status': 'scheduled'},
+    )
+    _assert_matches_rebuild()
+    return points, ids
+
+
+def test_collection_writes(client, add_collections, seeded):
+    points, ids = seeded
+    add_collections({'location': points[1].address, 'status': 'completed', 'waste_collected': 4.0})
+    _assert_matches_rebuild()
+    client.patch(f'/api/collections/{ids[0]}', json={'waste_collected': 20.0, 'waste_type': 'Organic'})
+    _assert_matches_rebuild()
+    client.post('/api/collections/transition', json={
+        'where': {'status': 'scheduled'}, 'set': {'status': 'completed'}, 'weights': {str(ids[3]): 6.0},
+    })
+    _assert_matches_rebuild()
+    client.delete(f'/api/collections/{ids[2]}')
+    _assert_matches_rebuild()
+    assert heatmap_grid()[1] == pytest.approx(20.0 + 3.0 + 4.0 + 6.0)
+
+
+def test_point_moves_and_deletes(client, add_points, add_collections, seeded):
+    points, ids = seeded
+    client.patch(f'/api/collection-points/{points[0].id}', json={'latitude': 19.10, 'longitude': 72.90})
+    _assert_matches_rebuild()
+    # Collections at an address nobody had registered count once it is
+    client.patch(f'/api/collection-points/{points[1].id}', json={'address': 'New Road, Mumbai'})
+    _assert_matches_rebuild()
+    add_collections({'location': 'Later Road, Mumbai', 'status': 'completed', 'waste_collected': 5.0})
+    _assert_matches_rebuild()
+    add_points(('Later', 19.05, 72.86))
+    _assert_matches_rebuild()
+    client.delete(f'/api/collection-points/{points[0].id}')
+    _assert_matches_rebuild()
+
+
+def test_sensor_readings_do_not_move_weight(client, seeded):
+    points, _ = seeded
+    before = heatmap_grid()
+    client.post('/api/capacity-readings', json=[{'point_id': points[0].id, 'capacity': 95.0}])
+    after = heatmap_grid()
+    np.testing.assert_allclose(after[0], before[0])
+    _assert_matches_rebuild()
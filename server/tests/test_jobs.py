@@ -0,0 +1,107 @@
+import pytest
+import jobs
+from models import db, Job
+
+# Submitting the same work while it is still live returns the existing job,
+# see jobs.py. Jobs run in process here; the testing config starts no
+# dispatcher.
+
+
+# Claims the oldest queued job the way the dispatcher does; the claim ends
+# the session, so callers keep ids rather than job instances
+def _claim():
+    job_id = jobs.dispatcher._claim()
+    assert job_id is not None
+    return job_id
+
+
+def test_identical_submissions_coalesce(app):
+    job, coalesced = jobs.submit('report', {'bucket': 'week', 'group_by': 'assigned_team,waste_type'})
+    assert not coalesced
+    # Same parameters once normalised
+    again, coalesced = jobs.submit('report', {'bucket': 'week', 'group_by': ['assigned_team', 'waste_type']})
+    assert coalesced and again.id == job.id
+    other, coalesced = jobs.submit('report', {'bucket': 'month'})
+    assert not coalesced and other.id != job.id
+
+
+def test_running_job_is_returned_until_it_finishes(app):
+    job_id = jobs.submit('statistics')[0].id
+    assert _claim() == job_id
+    running, coalesced = jobs.submit('statistics')
+    assert coalesced and running.id == job_id
+
+    jobs.run_job(job_id)
+    assert db.session.get(Job, job_id).status == 'succeeded'
+    later, coalesced = jobs.submit('statistics')
+    assert not coalesced and later.id != job_id
+
+
+def test_follow_up_is_queued_behind_a_running_pass(app):
+    job, _ = jobs.submit('credit-rewards')
+    job_id = job.id
+    assert jobs.submit('credit-rewards') == (job, True)
+    assert _claim() == job_id
+
+    follow_up, coalesced = jobs.submit('credit-rewards')
+    assert not coalesced and follow_up.id != job_id
+    assert jobs.submit('credit-rewards') == (follow_up, True)
+
+
+def test_collection_writes_share_one_queued_credit_pass(client, add_collections):
+    ids = add_collections({'location': 'Road 1'}, {'location': 'Road 2'})
+    for id in ids:
+        client.patch(f'/api/collections/{id}', json={'status': 'completed', 'waste_collected': 4.0})
+    queued = Job.query.filter_by(kind='credit-rewards').all()
+    assert [job.status for job in queued] == ['queued']
+
+
+def test_lost_race_returns_the_winner(app, monkeypatch):
+    winner, _ = jobs.submit('statistics')
+    live_job = jobs._live_job
+    calls = []
+
+    # The first lookup misses the job, as if both submissions ran at once
+    def racing_live_job(key, statuses=jobs.LIVE_STATUSES):
+        calls.append(key)
+        return None if len(calls) == 1 else live_job(key, statuses)
+
+    monkeypatch.setattr(jobs, '_live_job', racing_live_job)
+    job, coalesced = jobs.submit('statistics')
+    assert coalesced and job.id == winner.id
+    assert Job.query.count() == 1
+
+
+def test_cancelled_job_no_longer_coalesces(app):
+    job, _ = jobs.submit('statistics')
+    assert jobs.cancel(job.id)
+    again, coalesced = jobs.submit('statistics')
+    assert not coalesced and again.id != job.id
+
+
+def test_invalid_submissions_are_rejected(client):
+    with pytest.raises(ValueError):
+        jobs.submit('unknown')
+    response = client.post('/api/jobs', json={'kind': 'report', 'params': {'bucket': 'fortnight'}})
+    assert response.status_code == 400
+    response = client.post('/api/jobs', json={'kind': 'statistics'})
+    assert response.status_code == 202
+    assert response.headers['Location'] == f"/api/jobs/{response.json['id']}"
+
+
+def test_job_list_pages_newest_first(client):
+    ids = [jobs.submit('report', {'bucket': bucket})[0].id for bucket in ('day', 'week', 'month')]
+
+    def pages(limit):
+        listed, cursor = [], None
+        while True:
+            response = client.get(f'/api/jobs?limit={limit}' + (f'&cursor={cursor}' if cursor else ''))
+            assert response.status_code == 200, response.json
+            listed += [job['id'] for job in response.json]
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                return listed
+    assert pages(2) == ids[::-1]
+    # Limits below 1 still return a row per page
+    assert pages(0) == ids[::-1]
+    assert pages(-5) == ids[::-1]
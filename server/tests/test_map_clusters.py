@@ -0,0 +1,69 @@
+import pytest
+import map_clusters
+from map_clusters import MAX_CLUSTER_ZOOM, SUM_COLUMNS, rebuild_clusters, refresh_clusters
+from models import db, MapCluster
+
+# Map clusters are running sums kept current from the sync log; after point
+# writes the incremental result must equal a rebuild, see map_clusters.py.
+
+
+def _clusters():
+    return {
+        (row.zoom, row.cell_x, row.cell_y): tuple(getattr(row, name) for name in SUM_COLUMNS)
+        for row in db.session.query(MapCluster)
+    }
+
+
+def _assert_matches_rebuild():
+    refresh_clusters()
+    incremental = _clusters()
+    rebuild_clusters()
+    rebuilt = _clusters()
+    assert incremental.keys() == rebuilt.keys()
+    for key, sums in rebuilt.items():
+        assert incremental[key] == pytest.approx(sums), key
+
+
+@pytest.fixture
+def points(add_points):
+    points = add_points(('Ranade', 19.02, 72.84), ('Worli', 19.00, 72.82), ('Powai', 19.12, 72.91))
+    _assert_matches_rebuild()
+    return points
+
+
+def test_point_writes(client, add_points, points):
+    add_points(('Chembur', 19.05, 72.90))
+    _assert_matches_rebuild()
+    client.patch(f'/api/collection-points/{points[0].id}', json={'latitude': 19.21, 'longitude': 72.85})
+    _assert_matches_rebuild()
+    client.patch(f'/api/collection-points/{points[1].id}', json={'status': 'Maintenance'})
+    _assert_matches_rebuild()
+    client.post('/api/capacity-readings', json=[{'point_id': points[2].id, 'capacity': 95.0}])
+    _assert_matches_rebuild()
+    client.delete(f'/api/collection-points/{points[1].id}')
+    _assert_matches_rebuild()
+    top = {key: sums for key, sums in _clusters().items() if key[0] == 0}
+    assert sum(sums[0] for sums in top.values()) == 3
+
+
+def test_refresh_in_batches(client, add_points, points, monkeypatch):
+    monkeypatch.setattr(map_clusters, 'REFRESH_BATCH_SIZE', 2)
+    add_points(*[(f'Point {index}', 19.0 + index / 100, 72.8 + index / 100) for index in range(5)])
+    for point in points:
+        client.patch(f'/api/collection-points/{point.id}', json={'capacity': 50.0})
+    _assert_matches_rebuild()
+
+
+def test_emptied_cells_are_removed(client, points):
+    for point in points:
+        client.delete(f'/api/collection-points/{point.id}')
+    refresh_clusters()
+    assert _clusters() == {}
+
+
+def test_clusters_in_viewport(client, points):
+    response = client.get('/api/map/clusters?bbox=18.9,72.7,19.3,73.0&zoom=3')
+    assert response.status_code == 200
+    assert sum(cluster['count'] for cluster in response.json) == 3
+    response = client.get(f'/api/map/clusters?bbox=19.01,72.83,19.03,72.85&zoom={MAX_CLUSTER_ZOOM + 1}')
+    assert [marker['id'] for marker in response.json] == [f'point/{points[0].id}']
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta
+import pytest
+from models import RewardLedger
+from rewards import check_balances, compact_ledger, credit_completed
+
+# Crediting completed collections from the sync log, ledger compaction and
+# the paged user, leaderboard and ledger reads, see rewards.py.
+
+
+@pytest.fixture
+def add_users(client):
+    def add(*names, role='citizen'):
+        ids = []
+        for name in names:
+            response = client.post('/api/users', json={'name': name, 'role': role})
+            assert response.status_code == 201, response.json
+            ids.append(response.json['id'])
+        return ids
+    return add
+
+
+def _rewards(client, user_id):
+    return client.get(f'/api/users/{user_id}').json['rewards']
+
+
+def _all_pages(client, path, key=None):
+    rows, cursor = [], ''
+    while cursor is not None:
+        separator = '&' if '?' in path else '?'
+        response = client.get(f'{path}{separator}cursor={cursor}' if cursor else path)
+        assert response.status_code == 200, response.json
+        rows += response.json[key] if key else response.json
+        cursor = response.headers.get('X-Next-Cursor')
+    return rows
+
+
+def test_completed_collections_are_credited_once(client, add_users, add_collections):
+    user_id, = add_users('Sunita')
+    ids = add_collections(
+        {'location': 'Road 1', 'status': 'completed', 'waste_collected': 2.0, 'waste_type': 'Recyclable',
+         'user_id': user_id},
+        {'location': 'Road 2', 'status': 'scheduled', 'waste_collected': 4.0, 'user_id': user_id},
+    )
+    assert credit_completed() == 1
+    assert credit_completed() == 0
+    assert _rewards(client, user_id)['balance'] == 30
+    assert _rewards(client, user_id)['collections'] == 1
+
+    client.patch(f'/api/collections/{ids[0]}', json={'waste_collected': 3.0})
+    client.patch(f'/api/collections/{ids[1]}', json={'status': 'completed'})
+    credit_completed()
+    assert _rewards(client, user_id)['balance'] == 45 + 20
+    client.delete(f'/api/collections/{ids[1]}')
+    credit_completed()
+    assert _rewards(client, user_id)['balance'] == 45
+    assert check_balances() == []
+
+
+def test_compaction_keeps_balances_and_the_ledger_history(client, add_users, add_collections):
+    user_id, = add_users('Sunita')
+    add_collections({'location': 'Road 1', 'status': 'completed', 'waste_collected': 10.0, 'user_id': user_id})
+    credit_completed()
+    assert client.post(f'/api/users/{user_id}/redeem', json={'points': 20}).status_code == 201
+    before = _rewards(client, user_id)
+
+    assert compact_ledger(days=90, now=datetime.utcnow() + timedelta(days=91)) == 2
+    assert RewardLedger.query.count() == 0
+    assert _rewards(client, user_id) == before
+    assert check_balances() == []
+    ledger = client.get(f'/api/users/{user_id}/ledger').json
+    assert ledger['entries'] == []
+    assert ledger['compacted']['balance'] == 30
+    assert ledger['compacted']['lifetime_points'] == 50
+
+
+def test_users_page_by_id(client, add_users):
+    ids = add_users(*[f'User {index}' for index in range(5)])
+    assert [user['id'] for user in _all_pages(client, '/api/users?limit=2')] == ids
+    assert [user['id'] for user in _all_pages(client, '/api/users?limit=0')] == ids
+
+
+def test_ledger_pages_newest_first(client, add_users):
+    user_id, = add_users('Sunita')
+    for points in range(1, 6):
+        client.post(f'/api/users/{user_id}/adjustments', json={'points': points})
+    entries = _all_pages(client, f'/api/users/{user_id}/ledger?limit=2', 'entries')
+    assert [entry['points'] for entry in entries] == [5, 4, 3, 2, 1]
+    entries = _all_pages(client, f'/api/users/{user_id}/ledger?limit=-3', 'entries')
+    assert [entry['points'] for entry in entries] == [5, 4, 3, 2, 1]
+
+
+def test_leaderboard_ranks_by_lifetime_points(client, add_users):
+    ids = add_users('Asha', 'Ravi', 'Meena') + add_users('Kishore', role='raddiwala')
+    for user_id, points in zip(ids, [10, 30, 20, 40]):
+        client.post(f'/api/users/{user_id}/adjustments', json={'points': points})
+    board = client.get('/api/users/leaderboard?limit=2').json
+    assert [(row['rank'], row['user_id']) for row in board] == [(1, ids[3]), (2, ids[1])]
+    board = client.get('/api/users/leaderboard?role=citizen').json
+    assert [row['user_id'] for row in board] == [ids[1], ids[2], ids[0]]
+    assert len(client.get('/api/users/leaderboard?limit=0').json) == 1
+    assert client.get('/api/users/leaderboard?limit=many').status_code == 400
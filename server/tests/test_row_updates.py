@@ -0,0 +1,79 @@
+import pytest
+from models import db, Collection
+from statistics_rollup import check_statistics, read_statistics
+
+# Optimistic concurrency on PATCH and the rollup totals kept by set-based
+# transitions, see row_updates.py and statistics_rollup.py.
+
+
+def test_patch_bumps_the_version(client, add_collections):
+    id, = add_collections({'location': 'Ranade Road, Mumbai'})
+    response = client.patch(f'/api/collections/{id}', json={'notes': 'gate locked'}, headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['ETag'] == '"2"'
+    assert response.json['version'] == 2
+    assert response.json['notes'] == 'gate locked'
+
+
+@pytest.mark.parametrize('how', ['header', 'body'])
+def test_patch_with_a_stale_version_is_refused(client, add_collections, how):
+    id, = add_collections({'location': 'Ranade Road, Mumbai'})
+    assert client.patch(f'/api/collections/{id}', json={'notes': 'first'}).status_code == 200
+
+    if how == 'header':
+        response = client.patch(f'/api/collections/{id}', json={'notes': 'second'}, headers={'If-Match': '"1"'})
+    else:
+        response = client.patch(f'/api/collections/{id}', json={'notes': 'second', 'version': 1})
+    assert response.status_code == 409
+    assert response.json['version'] == 2
+    assert db.session.get(Collection, id).notes == 'first'
+
+
+def test_patch_of_a_missing_row_is_not_found(client):
+    assert client.patch('/api/collections/999', json={'notes': 'x'}).status_code == 404
+
+
+def test_point_patch_with_a_stale_version_is_refused(client, add_points):
+    point, = add_points(('Ranade', 19.02, 72.84))
+    assert client.patch(f'/api/collection-points/{point.id}', json={'status': 'Maintenance'}).status_code == 200
+    response = client.patch(f'/api/collection-points/{point.id}', json={'status': 'Active'}, headers={'If-Match': '"1"'})
+    assert response.status_code == 409
+    assert response.json['version'] == 2
+
+
+def test_transition_keeps_the_rollup_totals(client, add_collections):
+    location = 'Ranade Road, Mumbai'
+    ids = add_collections(
+        {'location': location, 'assigned_team': 'Team 3', 'status': 'in_progress', 'waste_collected': 5.0},
+        {'location': location, 'assigned_team': 'Team 3', 'status': 'in_progress', 'waste_type': 'Recyclable'},
+        {'location': location, 'assigned_team': 'Team 3', 'status': 'in_progress'},
+        {'location': location, 'assigned_team': 'Team 1', 'status': 'in_progress', 'waste_collected': 7.0},
+        {'location': location, 'status': 'completed', 'waste_collected': 2.5},
+    )
+    response = client.post('/api/collections/transition', json={
+        'where': {'assigned_team': 'Team 3', 'status': 'in_progress'},
+        'set': {'status': 'completed'},
+        'weights': {str(ids[1]): 10.0, str(ids[2]): 4.5},
+    })
+    assert response.status_code == 200
+    assert response.json['updated'] == 3
+    assert check_statistics() == []
+    statistics = read_statistics()
+    assert statistics['totalWaste'] == pytest.approx(5.0 + 10.0 + 4.5 + 2.5)
+    assert statistics['recyclingRate'] == round(10.0 / 22.0 * 100)
+
+    response = client.post('/api/collections/transition', json={
+        'where': {'assigned_team': 'Team 3', 'status': 'completed'}, 'set': {'status': 'cancelled'},
+    })
+    assert response.json['updated'] == 3
+    assert check_statistics() == []
+    assert read_statistics()['totalWaste'] == pytest.approx(2.5)
+
+
+def test_transition_rejects_unknown_fields(client, add_collections):
+    add_collections({'location': 'Ranade Road, Mumbai'})
+    response = client.post('/api/collections/transition', json={
+        'where': {'status': 'scheduled'}, 'set': {'location': 'elsewhere'},
+    })
+    assert response.status_code == 400
+    assert check_statistics() == []
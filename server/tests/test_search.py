@@ -0,0 +1,72 @@
+from sqlalchemy import text
+from models import db
+import search
+
+# Full-text search with prefix matching and phonetic spelling variants, and
+# the vocabulary's change counter, see search.py.
+
+
+def _names(client, query, types='collection_points'):
+    response = client.get(f'/api/search?q={query}&types={types}')
+    assert response.status_code == 200, response.json
+    return [record['name'] for record in response.json['results'][types]]
+
+
+def _changes():
+    return db.session.execute(text(f"SELECT version FROM {search.CHANGES_TABLE}")).scalar()
+
+
+def test_words_match_as_prefixes(client, add_points):
+    add_points(('Shivaji Park', 19.027, 72.838), ('Ghatkopar Depot', 19.086, 72.908))
+    assert _names(client, 'shiv') == ['Shivaji Park']
+    assert _names(client, 'shivaji park') == ['Shivaji Park']
+    assert _names(client, 'shivaji depot') == []
+
+
+def test_misspelled_words_match_spelling_variants(client, add_points):
+    add_points(('Shivaji Park', 19.027, 72.838), ('Ghatkopar Depot', 19.086, 72.908),
+               ('Vile Parle Station', 19.100, 72.844))
+    assert _names(client, 'sivaji') == ['Shivaji Park']
+    assert _names(client, 'ghatkoper') == ['Ghatkopar Depot']
+    assert _names(client, 'wile parle') == ['Vile Parle Station']
+
+
+def test_collections_are_searched_newest_first(client, add_collections):
+    ids = add_collections(*[{'location': 'Dadar Market', 'status': 'scheduled'}] * 3,
+                          {'location': 'Andheri East', 'status': 'scheduled'})
+    response = client.get('/api/search?q=dadar&types=collections')
+    assert [record['id'] for record in response.json['results']['collections']] == ids[:3][::-1]
+
+
+def test_unknown_types_and_missing_query_are_rejected(client):
+    assert client.get('/api/search?q=dadar&types=bins').status_code == 400
+    assert client.get('/api/search?q=').status_code == 400
+
+
+def test_index_writes_move_the_change_counter(app, add_points):
+    before = _changes()
+    point, = add_points(('Shivaji Park', 19.027, 72.838))
+    point.name = 'Sivaji Park'
+    db.session.commit()
+    db.session.delete(point)
+    db.session.commit()
+    assert _changes() == before + 3
+
+
+def test_vocabulary_reloads_only_after_index_changes(app, add_points):
+    add_points(('Shivaji Park', 19.027, 72.838))
+    vocabulary = search.vocabulary
+    assert vocabulary.has_prefix('shivaji')
+    snapshot = vocabulary._snapshot
+    vocabulary.refresh(db.engine)
+    assert vocabulary._snapshot is snapshot
+
+    add_points(('Ghatkopar Depot', 19.086, 72.908))
+    assert not vocabulary.has_prefix('ghatkopar')
+    vocabulary.refresh(db.engine)
+    assert vocabulary._snapshot is not snapshot
+    assert vocabulary.has_prefix('ghatkopar')
+
+
+def test_vocabulary_interval_comes_from_the_config(app):
+    assert search.vocabulary.ttl == app.config['SEARCH_VOCABULARY_TTL_SECONDS']
@@ -0,0 +1,72 @@
+import json
+import random
+import pytest
+from models import CollectionPoint
+from spatial import haversine_km, nearest, within_bbox, within_radius
+
+# The grid-cell index must return what a full scan would, see spatial.py.
+
+QUERIES = [(19.02, 72.84), (19.20, 72.95), (18.90, 72.80), (28.61, 77.21)]
+
+
+@pytest.fixture
+def points(add_points):
+    rng = random.Random(7)
+    return add_points(*[
+        (f'Point {index}', rng.uniform(18.9, 19.3), rng.uniform(72.75, 73.0)) for index in range(200)
+    ])
+
+
+def _by_distance(points, latitude, longitude):
+    return sorted(points, key=lambda point: haversine_km(latitude, longitude, point.latitude, point.longitude))
+
+
+@pytest.mark.parametrize('latitude, longitude', QUERIES)
+def test_nearest_matches_a_full_scan(points, latitude, longitude):
+    for k in (1, 5, 40):
+        found = [point.id for point, _ in nearest(CollectionPoint, latitude, longitude, k)]
+        assert found == [point.id for point in _by_distance(points, latitude, longitude)[:k]]
+
+
+@pytest.mark.parametrize('bbox', [(19.0, 72.8, 19.1, 72.9), (18.0, 72.0, 20.0, 74.0), (19.1, 72.9, 19.0, 72.8)])
+def test_bbox_matches_a_full_scan(points, bbox):
+    south, west, north, east = bbox
+    expected = {point.id for point in points
+                if south <= point.latitude <= north and west <= point.longitude <= east}
+    assert {point.id for point in within_bbox(CollectionPoint, *bbox)} == expected
+
+
+def test_radius_matches_a_full_scan(points):
+    matches = within_radius(CollectionPoint, 19.05, 72.85, 3.0)
+    expected = [point.id for point in _by_distance(points, 19.05, 72.85)
+                if haversine_km(19.05, 72.85, point.latitude, point.longitude) <= 3.0]
+    assert [point.id for point, _ in matches] == expected
+
+
+def test_moved_point_is_found_at_its_new_place(client, points):
+    point = points[0]
+    assert client.patch(f'/api/collection-points/{point.id}', json={'latitude': 28.61, 'longitude': 77.21}).status_code == 200
+    response = client.get('/api/collection-points/nearest?lat=28.6&lon=77.2&k=1')
+    assert [row['id'] for row in response.json] == [point.id]
+    response = client.get('/api/collection-points/within?bbox=28.5,77.1,28.7,77.3')
+    assert [row['id'] for row in json.loads(response.get_data())] == [point.id]
+
+
+def test_nearest_route_reports_distances(client, points):
+    response = client.get('/api/collection-points/nearest?lat=19.02&lon=72.84&k=3')
+    assert response.status_code == 200
+    distances = [row['distance_km'] for row in response.json]
+    assert len(distances) == 3 and distances == sorted(distances)
+
+
+@pytest.mark.parametrize('query', [
+    'lat=19.0&lon=72.8&k=0', 'lat=19.0&lon=72.8&k=-1', 'lat=19.0&lon=72.8&k=two',
+    'lat=95&lon=72.8', 'lon=72.8', 'lat=abc&lon=72.8',
+])
+def test_invalid_nearest_arguments_are_rejected(client, query):
+    assert client.get(f'/api/collection-points/nearest?{query}').status_code == 400
+    assert client.get(f'/api/recycling-centers/nearest?{query}').status_code == 400
+
+
+def test_invalid_bbox_is_rejected(client):
+    assert client.get('/api/collection-points/within?bbox=19,72,20').status_code == 400
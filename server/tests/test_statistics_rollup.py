@@ -0,0 +1,73 @@
+import pytest
+from sqlalchemy import insert
+from models import db, StatisticsRollup
+from statistics_rollup import check_statistics, read_statistics, record_collection_change
+
+# /api/statistics reads running totals that every write adjusts in its own
+# transaction; they must always equal a full recomputation, see
+# statistics_rollup.py.
+
+
+def _statistics(client):
+    response = client.get('/api/statistics')
+    assert response.status_code == 200
+    return response.json
+
+
+def _rollup(name):
+    row = db.session.get(StatisticsRollup, name)
+    db.session.refresh(row)
+    return row.count, row.total
+
+
+def test_collection_writes_keep_the_totals(client, add_collections):
+    ids = add_collections(
+        {'location': 'Road 1', 'status': 'completed', 'waste_collected': 10.0, 'waste_type': 'Recyclable'},
+        {'location': 'Road 2', 'status': 'completed', 'waste_collected': 30.0},
+        {'location': 'Road 3'},
+    )
+    assert _statistics(client)['totalWaste'] == pytest.approx(40.0)
+    assert _statistics(client)['recyclingRate'] == 25
+
+    client.patch(f'/api/collections/{ids[2]}', json={'status': 'completed', 'waste_collected': 5.0})
+    client.patch(f'/api/collections/{ids[1]}', json={'waste_type': 'Recyclable'})
+    client.delete(f'/api/collections/{ids[0]}')
+    assert check_statistics() == []
+    statistics = _statistics(client)
+    assert statistics['totalWaste'] == pytest.approx(35.0)
+    assert statistics['recyclingRate'] == round(30.0 / 35.0 * 100)
+
+
+def test_new_waste_type_is_added_once(client, add_collections):
+    ids = add_collections(*[{'location': f'Road {index}'} for index in range(3)])
+    for id in ids:
+        client.patch(f'/api/collections/{id}', json={'status': 'completed', 'waste_collected': 2.0,
+                                                     'waste_type': 'E-Waste'})
+    assert _rollup('waste:e-waste') == (3, pytest.approx(6.0))
+    assert check_statistics() == []
+
+
+def test_delta_is_added_to_a_key_written_outside_the_session(app):
+    # The upsert never reads the key first, so a row another writer created
+    # is incremented rather than inserted twice
+    db.session.execute(insert(StatisticsRollup.__table__), [{'name': 'waste:metal', 'count': 1, 'total': 4.0}])
+    record_collection_change(None, ('completed', 'Metal', 6.0))
+    db.session.commit()
+    assert _rollup('waste:metal') == (2, pytest.approx(10.0))
+
+
+def test_point_writes_keep_the_counts(client):
+    ids = []
+    for name in ('Ranade', 'Worli', 'Powai'):
+        response = client.post('/api/collection-points', json={
+            'name': name, 'address': f'{name} Road', 'area': 'Dadar', 'latitude': 19.0, 'longitude': 72.8,
+        })
+        assert response.status_code == 201
+        ids.append(response.json['id'])
+    client.post('/api/capacity-readings', json=[{'point_id': ids[0], 'capacity': 95.0}])
+    client.patch(f'/api/collection-points/{ids[1]}', json={'status': 'Full'})
+    client.delete(f'/api/collection-points/{ids[2]}')
+    assert check_statistics() == []
+    statistics = read_statistics()
+    assert statistics['activePoints'] == 2
+    assert statistics['binsAtCapacity'] == 2
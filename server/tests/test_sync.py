@@ -0,0 +1,81 @@
+from sync import prune_tombstones
+
+# Delta sync watermarks, paging and tombstones, see sync.py.
+
+
+def _sync(client, since, limit=500):
+    response = client.get(f'/api/sync?since={since}&resources=collections&limit={limit}')
+    assert response.status_code == 200, response.json
+    return response.json
+
+
+def _ids(page):
+    return [record['id'] for record in page['changes'].get('collections', [])]
+
+
+def test_delta_returns_only_rows_changed_after_the_watermark(client, add_collections):
+    ids = add_collections(*[{'location': f'Road {index}'} for index in range(3)])
+    first = _sync(client, '0')
+    assert sorted(_ids(first)) == ids
+    assert not first['more']
+    assert _ids(_sync(client, first['next'])) == []
+
+    client.patch(f'/api/collections/{ids[1]}', json={'notes': 'moved bin'})
+    delta = _sync(client, first['next'])
+    assert _ids(delta) == [ids[1]]
+    assert delta['changes']['collections'][0]['notes'] == 'moved bin'
+    assert _ids(_sync(client, delta['next'])) == []
+
+
+def test_full_sync_pages_with_its_own_watermark(client, add_collections):
+    ids = add_collections(*[{'location': f'Road {index}'} for index in range(5)])
+    seen = []
+    since = '0'
+    while True:
+        page = _sync(client, since, limit=2)
+        seen += _ids(page)
+        if not page['more']:
+            break
+        assert page['next'].startswith('f')
+        since = page['next']
+    assert sorted(seen) == ids
+
+
+def test_each_row_is_sent_once_per_delta(client, add_collections):
+    id, = add_collections({'location': 'Ranade Road, Mumbai'})
+    since = _sync(client, '0')['next']
+    for note in ('one', 'two', 'three'):
+        client.patch(f'/api/collections/{id}', json={'notes': note})
+    delta = _sync(client, since)
+    assert _ids(delta) == [id]
+    assert delta['changes']['collections'][0]['notes'] == 'three'
+
+
+def test_deletes_are_sent_as_tombstones(client, add_collections):
+    ids = add_collections({'location': 'Road 1'}, {'location': 'Road 2'})
+    since = _sync(client, '0')['next']
+    assert client.delete(f'/api/collections/{ids[0]}').status_code == 204
+    delta = _sync(client, since)
+    assert delta['deleted'] == {'collections': [ids[0]]}
+    assert _ids(delta) == []
+
+
+def test_watermark_before_pruned_tombstones_is_reset(client, add_collections):
+    ids = add_collections({'location': 'Road 1'}, {'location': 'Road 2'})
+    since = _sync(client, '0')['next']
+    client.delete(f'/api/collections/{ids[0]}')
+    current = _sync(client, since)['next']
+
+    assert prune_tombstones(days=-1) == 1
+    stale = _sync(client, since)
+    assert stale['reset'] and stale['next'] == '0' and stale['changes'] == {}
+    # Caught up clients and full syncs are unaffected
+    assert not _sync(client, current)['reset']
+    full = _sync(client, '0')
+    assert not full['reset']
+    assert _ids(full) == [ids[1]]
+
+
+def test_invalid_watermark_is_rejected(client):
+    assert client.get('/api/sync?since=abc').status_code == 400
+    assert client.get('/api/sync?since=-5').status_code == 400
@@ -0,0 +1,26 @@
+# Production entry point.
+#
+#   python wsgi.py                          gevent server on $PORT (default 8080)
+#   gunicorn -k gevent -w 1 wsgi:app        under gunicorn
+#
+# With SQLite, queries block the worker while they run, so scale out with
+# worker processes rather than more greenlets per worker. Several workers
+# need RESPONSE_CACHE_SHM set and share neither live updates nor analytics
+# cache invalidation; see the README before raising -w.
+#
+# Background jobs are not run in these processes (JOB_WORKERS defaults to 0
+# in production); run them with: flask --app app:create_app run-jobs
+from gevent import monkey
+monkey.patch_all()
+
+import logging
+import os
+from gevent.pywsgi import WSGIServer
+from app import create_app
+
+app = create_app(os.getenv('APP_CONFIG', 'production'))
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 8080))
+    logging.getLogger(__name__).info('Serving on 0.0.0.0:%d', port)
+    WSGIServer(('0.0.0.0', port), app).serve_forever()